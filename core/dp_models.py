@@ -1,11 +1,8 @@
 import os
-import sys
-import h5py
 import numpy as np
-import scipy as sp
 from collections import OrderedDict
-from sklearn import cluster
 from simdat.core import image
+from simdat.core import dp_tools
 from simdat.core import ml
 from keras import regularizers
 from keras.models import Sequential
@@ -19,10 +16,12 @@ from keras.layers import AveragePooling2D
 from keras.utils import np_utils
 
 
-class DP:
+class DP(dp_tools.DP):
     def __init__(self):
         self.im = image.IMAGE()
         self.mlr = ml.MLRun()
+        self.hc_extractors = {}
+        self.hc_centers = None
         self.dp_init()
 
     def dp_init(self):
@@ -97,27 +96,6 @@ class DP:
 
             graph.write_png(to_file)
 
-    def extract_hypercolumn(self, model, la_idx, instance):
-        ''' Extract HyperColumn of pixels (Theano Only)
-
-        @param model: input DP model
-        @param la_idx: indexes of the layers to be extract
-        @param instamce: image instance used to extract the hypercolumns
-
-        '''
-        import theano
-        layers = [model.layers[li].get_output(train=False) for li in la_idx]
-        get_feature = theano.function([model.layers[0].input], layers,
-                                      allow_input_downcast=False)
-        feature_maps = get_feature(instance)
-        hypercolumns = []
-        for convmap in feature_maps:
-            for fmap in convmap[0]:
-                upscaled = sp.misc.imresize(fmap, size=(224, 224),
-                                            mode="F", interp='bilinear')
-                hypercolumns.append(upscaled)
-        return np.asarray(hypercolumns)
-
     def is_dense(self, layer):
         '''Check if the layer is dense (fully connected)
            Return layer name if it is a dense layer, None otherwise'''
@@ -138,20 +116,6 @@ class DP:
             return layer_name
         return None
 
-    def cluster_hc(self, hc, n_jobs=1):
-        ''' Use KMeans to cluster hypercolumns'''
-
-        ori_size = hc.shape[1]
-        new_size = ori_size*ori_size
-        m = hc.transpose(1, 2, 0).reshape(new_size, -1)
-        kmeans = cluster.KMeans(n_clusters=2, max_iter=300, n_jobs=n_jobs,
-                                precompute_distances=True)
-        cluster_labels = kmeans .fit_predict(m)
-        imcluster = np.zeros((ori_size, ori_size))
-        imcluster = imcluster.reshape((new_size,))
-        imcluster = cluster_labels
-        return imcluster.reshape(ori_size, ori_size)
-
     def prepare_data(self, img_loc, width, height, convert_Y=True,
                      rc=False, scale=True, classes=None,
                      sort=False, trans=True):
@@ -366,29 +330,37 @@ class DPModel(DP):
 
         return model
 
-    def load_weights(self, model, weights_path, lastFC=True):
+    def count_layers(self, stacks):
+        """ Count layers of the stacks of the last built model
+
+        @param stacks: names of the stacks, e.g. ['conv1', 'conv2']
+
+        """
+        return sum([len(self.layers[s]) for s in stacks])
+
+    def load_weights(self, model, weights_path, lastFC=True, cache=False,
+                     quantize=None):
         """ Load model weights
 
         @param model: the model
-        @param weight_path: path of the weight file
+        @param weight_path: path of the weight file, a .flat file written
+                            by keras_models.convert_weights is memory-mapped
 
         Arguments:
 
-        lastFC -- True to load weights for the last FC layer (default: True)
+        lastFC   -- True to load weights for the last FC layer
+                    (default: True)
+        cache    -- True to convert the HDF5 file to weight_path.flat at
+                    the first call and memory-map it afterwards
+                    (default: False)
+        quantize -- None, 'float16' or 'int8', quantization of the cached
+                    flat file (default: None)
 
         """
-        if lastFC:
-            model.load_weights(weights_path)
-            return
-        f = h5py.File(weights_path)
-        for k in range(f.attrs['nb_layers']):
-            if k >= len(model.layers):
-                break
-            g = f['layer_{}'.format(k)]
-            weights = [g['param_{}'.format(p)] for p in range(g.attrs['nb_params'])]
-            model.layers[k].set_weights(weights)
-        f.close()
-        return
+        from simdat.core import keras_models
+        return keras_models.load_weights(model, weights_path,
+                                         lastFC=lastFC, cache=cache,
+                                         quantize=quantize)
 
     def Simple(self, cats, img_row=224, img_col=224, conv_size=3,
                colors=3, weights_path=None, filter_size=32):
@@ -436,35 +408,6 @@ class DPModel(DP):
         return model
 
 
-class ImageNet(image.IMAGE):
-    def get_labels(self, fname='synset_words.txt'):
-        '''Get ImageNet labels from file'''
-
-        if not self.check_exist(fname):
-            print('ERROR: Cannot find %s.' % fname)
-            sys.exit(1)
-        return np.loadtxt(fname, str, delimiter='\t')
-
-    def find_topk(self, prob, labels=None, fname='synset_words.txt', ntop=3):
-        ''' Find the categories with highest probabilities
-
-        @param prob: a list of probabilities of 1,000 categories
-
-        Keyword arguments:
-        labels -- ImageNet labels (default: re-gain from self.get_labels)
-        fname  -- filename of the ImageNet labels
-        ntop   -- how many top cats to be shown (default: 3)
-
-        @retuen results = {INDEX: (probability, label, [cats])}
-         example: {955: (0.00051713100401684642, 'n07754684',
-                   ['jackfruit', 'jak', 'jack'])}
-
-        '''
-        if labels is None:
-            labels = self.get_labels(fname)
-        results = {}
-        top_k = prob.flatten().argsort()[-1:-(ntop+1):-1]
-        for k in top_k:
-            l = labels[k].replace(',', '').split(' ')
-            results[k] = (prob[k], l[0], l[1:])
-        return results
+class ImageNet(dp_tools.ImageNet):
+    '''ImageNet tools, see dp_tools.ImageNet'''
+    pass
@@ -1,29 +1,1010 @@
 import os
 import sys
-import h5py
+import time
 import numpy as np
-import scipy as sp
 from collections import OrderedDict
-from sklearn import cluster
+from simdat.core import tools
 from simdat.core import image
 from simdat.core import ml
-from keras import regularizers
-from keras.models import Sequential
-# from keras.models import Graph
-from keras.models import Model
-from keras.layers import Input, Activation, merge
-from keras.layers import Flatten, Dense, Dropout
-from keras.layers import Convolution2D, MaxPooling2D
-from keras.layers import ZeroPadding2D
-from keras.layers import AveragePooling2D
-from keras.preprocessing.image import ImageDataGenerator
-from keras.utils import np_utils
+
+cluster = tools.LazyImport('sklearn.cluster')
+np_utils = tools.LazyImport('keras.utils.np_utils')
+
+
+def _prefetch_worker(tasks, done, buffers, labels, shape, rescale, aug):
+    """Worker loop of BatchPrefetcher, fills shared batch buffers
+
+    An exception of a batch is sent back as (slot, traceback string)
+    and raised by BatchPrefetcher.next, the worker keeps running.
+
+    """
+    import traceback
+    im = image.IMAGE()
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        slot, files, cls, seed = task
+        try:
+            rng = np.random.RandomState(seed)
+            X = np.frombuffer(buffers[slot],
+                              dtype=np.float32).reshape(shape)
+            Y = np.frombuffer(labels[slot], dtype=np.int32)
+            n = 0
+            for fimg, c in zip(files, cls):
+                # cv2 takes (cols, rows) while shape is (n, c, rows, cols)
+                img = im.read(fimg, size=(shape[3], shape[2]))
+                if img is None:
+                    continue
+                img = img[:, :, ::-1]
+                if aug is not None:
+                    img = im.random_affine(img, rng=rng, **aug)
+                X[n] = img.transpose((2, 0, 1))
+                X[n] *= rescale
+                Y[n] = c
+                n += 1
+        except Exception:
+            done.put((slot, traceback.format_exc()))
+            continue
+        done.put((slot, n))
+
+
+class BatchPrefetcher(object):
+    def __init__(self, data_dir, target_size, class_mode='categorical',
+                 batch_size=32, shuffle=True, seed=None, rescale=1./255,
+                 shear_range=0., zoom_range=0., horizontal_flip=False,
+                 nb_worker=2, prefetch=4):
+        """Generator which decodes and augments images in worker
+           processes, compatible with Keras DirectoryIterator
+
+        @param data_dir: path of the images, one sub-folder per class
+        @param target_size: tuple of (rows, cols) of the output images
+
+        Keyword arguments:
+        class_mode -- "categorical", "binary", "sparse" or None
+                      (default: categorical)
+        batch_size -- Batch size (default: 32)
+        shuffle    -- True to shuffle the images every epoch (default: True)
+        seed       -- random seed for shuffling and augmentation
+        rescale    -- factor multiplied to the pixel values (default: 1/255)
+        nb_worker  -- number of worker processes (default: 2)
+        prefetch   -- number of batches decoded ahead, each of them owns
+                      one shared memory buffer (default: 4)
+
+        """
+        import multiprocessing as mp
+        from multiprocessing.sharedctypes import RawArray
+
+        self.im = image.IMAGE()
+        self.classes = sorted([d for d in os.listdir(data_dir)
+                               if os.path.isdir(os.path.join(data_dir, d))])
+        self.nb_class = len(self.classes)
+        self.class_indices = dict(zip(self.classes, range(self.nb_class)))
+        self.filenames = []
+        labels = []
+        for c in self.classes:
+            imgs = sorted(self.im.find_images(
+                dir_path=os.path.join(data_dir, c)))
+            self.filenames += imgs
+            labels += [self.class_indices[c]] * len(imgs)
+        self.labels = np.array(labels, dtype=np.int32)
+        self.nb_sample = len(self.filenames)
+        print('[DP] Found %i images belonging to %i classes.'
+              % (self.nb_sample, self.nb_class))
+
+        self.class_mode = class_mode
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.RandomState(seed)
+        self.shape = (batch_size, 3) + tuple(target_size)
+        self.prefetch = max(int(prefetch), 1)
+        aug = None
+        if shear_range or zoom_range or horizontal_flip:
+            aug = {'shear_range': shear_range, 'zoom_range': zoom_range,
+                   'horizontal_flip': horizontal_flip}
+
+        size = int(np.prod(self.shape))
+        self.buffers = [RawArray('f', size) for i in range(self.prefetch)]
+        self.buffer_labels = [RawArray('i', batch_size)
+                              for i in range(self.prefetch)]
+        self.tasks = mp.Queue()
+        self.done = mp.Queue()
+        self.workers = []
+        for i in range(max(int(nb_worker), 1)):
+            p = mp.Process(target=_prefetch_worker,
+                           args=(self.tasks, self.done, self.buffers,
+                                 self.buffer_labels, self.shape,
+                                 rescale, aug))
+            p.daemon = True
+            p.start()
+            self.workers.append(p)
+
+        import threading
+        self.lock = threading.Lock()
+        self.index_array = np.arange(0)
+        self.batch_index = 0
+        self.total_batches_seen = 0
+        self.reset_stats()
+        for slot in range(self.prefetch):
+            self._submit(slot)
+
+    def reset_stats(self):
+        """Reset the queue-starvation statistics"""
+
+        self.nb_batches = 0
+        self.nb_starved = 0
+        self.wait_time = 0.
+        self.max_wait = 0.
+
+    def stats(self):
+        """Return queue-starvation statistics
+
+        @return dictionary of
+                batches   -- number of batches delivered
+                starved   -- batches requested before any was ready
+                wait_time -- total seconds spent waiting for workers
+                max_wait  -- the longest single wait in seconds
+                starved_ratio -- starved / batches
+
+        """
+        ratio = float(self.nb_starved) / max(self.nb_batches, 1)
+        return {'batches': self.nb_batches, 'starved': self.nb_starved,
+                'wait_time': self.wait_time, 'max_wait': self.max_wait,
+                'starved_ratio': ratio}
+
+    def print_stats(self):
+        """Print queue-starvation statistics"""
+
+        s = self.stats()
+        print('[DP] %i batches, %i starved (%.1f%%), waited %.3f s '
+              '(max %.3f s)' % (s['batches'], s['starved'],
+                                100 * s['starved_ratio'],
+                                s['wait_time'], s['max_wait']))
+        if s['starved_ratio'] > 0.5:
+            print('[DP] Training is input-bound, consider increasing '
+                  'nb_worker')
+
+    def _next_files(self):
+        """Pick the file indexes of the next batch"""
+
+        if self.batch_index * self.batch_size >= len(self.index_array):
+            self.batch_index = 0
+            if self.shuffle:
+                self.index_array = self.rng.permutation(self.nb_sample)
+            else:
+                self.index_array = np.arange(self.nb_sample)
+        start = self.batch_index * self.batch_size
+        self.batch_index += 1
+        self.total_batches_seen += 1
+        return self.index_array[start:start + self.batch_size]
+
+    def _submit(self, slot):
+        """Ask the workers to fill the buffer slot with the next batch"""
+
+        idx = self._next_files()
+        self.tasks.put((slot, [self.filenames[i] for i in idx],
+                        self.labels[idx].tolist(),
+                        self.rng.randint(0, 2**31 - 1)))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.next()
+
+    def _wait(self, timeout=1.):
+        """Wait for the next filled slot, raise if a worker died
+
+        Keyword arguments:
+        timeout -- seconds between checks of the workers (default: 1.)
+
+        """
+        try:
+            import queue
+        except ImportError:
+            import Queue as queue
+        while True:
+            try:
+                return self.done.get(timeout=timeout)
+            except queue.Empty:
+                dead = [p for p in self.workers if not p.is_alive()]
+                if len(dead) > 0:
+                    raise Exception("[DP] %i prefetch worker(s) exited "
+                                    "with code %s" % (
+                                        len(dead),
+                                        [p.exitcode for p in dead]))
+
+    def next(self):
+        """Return the next (X, Y) batch, or X if class_mode is None"""
+
+        try:
+            import queue
+        except ImportError:
+            import Queue as queue
+        with self.lock:
+            t0 = time.time()
+            try:
+                slot, n = self.done.get_nowait()
+            except queue.Empty:
+                self.nb_starved += 1
+                slot, n = self._wait()
+            wait = time.time() - t0
+            self.nb_batches += 1
+            self.wait_time += wait
+            self.max_wait = max(self.max_wait, wait)
+            if not isinstance(n, int):
+                # traceback of the worker, the slot is refilled so the
+                # generator can still be used after the error
+                self._submit(slot)
+                raise Exception("[DP] Prefetch worker failed:\n%s" % n)
+
+            X = np.frombuffer(self.buffers[slot], dtype=np.float32)
+            X = X.reshape(self.shape)[:n].copy()
+            Y = np.frombuffer(self.buffer_labels[slot], dtype=np.int32)
+            Y = Y[:n].copy()
+            self._submit(slot)
+
+        if self.class_mode == 'categorical':
+            return X, np_utils.to_categorical(Y, self.nb_class)
+        elif self.class_mode == 'binary':
+            return X, Y.astype('float32')
+        elif self.class_mode == 'sparse':
+            return X, Y
+        return X
+
+    def close(self):
+        """Stop the worker processes"""
+
+        for p in self.workers:
+            self.tasks.put(None)
+        for p in self.workers:
+            p.join(1)
+            if p.is_alive():
+                p.terminate()
+        self.workers = []
+
+
+def bilinear_matrix(nin, nout):
+    """Matrix of shape (nout, nin) which resizes an axis bilinearly
+       with pixel-center alignment, as sp.misc.imresize does
+
+    @param nin: input length of the axis
+    @param nout: output length of the axis
+
+    """
+    pos = (np.arange(nout) + 0.5) * float(nin) / nout - 0.5
+    pos = np.clip(pos, 0, nin - 1)
+    low = np.floor(pos).astype(int)
+    high = np.minimum(low + 1, nin - 1)
+    frac = (pos - low).astype(np.float32)
+    m = np.zeros((nout, nin), dtype=np.float32)
+    rows = np.arange(nout)
+    m[rows, low] += 1 - frac
+    m[rows, high] += frac
+    return m
+
+
+def upsample_maps(fmaps, size):
+    """Resize all feature maps bilinearly in one vectorized pass
+
+    @param fmaps: feature maps in (n, c, h, w)
+    @param size: tuple of the output (rows, cols)
+
+    @return float32 array in (n, c, rows, cols)
+
+    """
+    fmaps = np.asarray(fmaps, dtype=np.float32)
+    n, c, h, w = fmaps.shape
+    ry = bilinear_matrix(h, size[0])
+    rx = bilinear_matrix(w, size[1])
+    # (n*c, h, w) x (w, cols) -> (n*c, h, cols)
+    out = np.dot(fmaps.reshape(n * c * h, w), rx.T).reshape(n * c, h, -1)
+    # (rows, h) x (n*c, h, cols) -> (n*c, rows, cols)
+    out = np.matmul(ry, out)
+    return out.reshape(n, c, size[0], size[1])
+
+
+def cluster_pixels(m, n_clusters=2, method='minibatch', subsample=None,
+                   init=None, n_jobs=1, seed=None):
+    """Cluster pixel features with KMeans fitted on float32 data
+
+    @param m: pixel features in (npixels, nfeatures)
+
+    Keyword arguments:
+    n_clusters -- number of clusters (default: 2)
+    method     -- 'minibatch' for MiniBatchKMeans or 'kmeans'
+                  (default: minibatch)
+    subsample  -- number of random pixels to fit on, all pixels are
+                  still labeled (default: None, fit on all pixels)
+    init       -- initial centroids, e.g. from the previous image
+                  (default: None, use k-means++)
+    n_jobs     -- number of jobs used by KMeans (default: 1)
+    seed       -- random seed (default: None)
+
+    KMeans fits on C-contiguous data, so fitting on all pixels of a
+    transposed (channels, pixels) view copies them once. Set subsample
+    to bound that copy, labeling the pixels never copies them.
+
+    @return labels of the pixels, cluster centers
+
+    """
+    # keep transposed views as they are, np.dot handles them without copy
+    m = np.asarray(m, dtype=np.float32)
+    rng = np.random.RandomState(seed)
+    sample = m
+    if subsample is not None and subsample < m.shape[0]:
+        idx = np.sort(rng.choice(m.shape[0], int(subsample), replace=False))
+        sample = m[idx]
+    if init is None:
+        init, n_init = 'k-means++', 3
+    else:
+        init, n_init = np.asarray(init, dtype=np.float32), 1
+    if method == 'minibatch':
+        kmeans = cluster.MiniBatchKMeans(
+            n_clusters=n_clusters, init=init, n_init=n_init,
+            batch_size=min(1024, sample.shape[0]), random_state=rng)
+    else:
+        kmeans = cluster.KMeans(n_clusters=n_clusters, init=init,
+                                n_init=n_init, max_iter=300,
+                                n_jobs=n_jobs, random_state=rng)
+    # a no-op for C-contiguous float32 samples
+    kmeans.fit(np.ascontiguousarray(sample))
+    centers = kmeans.cluster_centers_.astype(np.float32)
+    # argmin of |x - c|^2 = |x|^2 - 2 x.c + |c|^2, |x|^2 is the same for all c
+    dist = np.dot(m, -2 * centers.T) + (centers ** 2).sum(axis=1)
+    return dist.argmin(axis=1), kmeans.cluster_centers_
+
+
+def tta_boxes(nrow, ncol, ratio=0.7):
+    """Crop boxes used by test-time augmentation: the full image, the
+       center and the four corners, as read_and_random_crop does
+
+    @param nrow: number of rows of the images
+    @param ncol: number of columns of the images
+
+    Keyword arguments:
+    ratio -- size of the crops relative to the image (default: 0.7)
+
+    @return list of (row_start, row_end, col_start, col_end)
+
+    """
+    h = int(nrow * ratio)
+    w = int(ncol * ratio)
+    r0 = (nrow - h) // 2
+    c0 = (ncol - w) // 2
+    return [(0, nrow, 0, ncol), (r0, r0 + h, c0, c0 + w),
+            (0, h, 0, w), (nrow - h, nrow, 0, w),
+            (0, h, ncol - w, ncol), (nrow - h, nrow, ncol - w, ncol)]
+
+
+def tta_variants(X, ratio=0.7, flip=True, out=None):
+    """Build all crop and flip variants of a batch of images
+
+    Every crop is resized back to the input size with the bilinear
+    matrices of bilinear_matrix, for all images at once.
+
+    @param X: images in (n, c, h, w)
+
+    Keyword arguments:
+    ratio -- size of the crops relative to the image (default: 0.7)
+    flip  -- True to add the horizontally flipped variants (default: True)
+    out   -- preallocated float32 array of at least
+             (n * nb_variant, c, h, w) to write to (default: None)
+
+    @return float32 array in (nb_variant * n, c, h, w), variant major,
+            i.e. out[v * n + i] is variant v of image i
+
+    """
+    n, c, h, w = X.shape
+    boxes = tta_boxes(h, w, ratio=ratio)
+    nv = len(boxes) * (2 if flip else 1)
+    if out is None:
+        out = np.empty((nv * n, c, h, w), dtype=np.float32)
+    out = out[:nv * n]
+    for v, (r0, r1, c0, c1) in enumerate(boxes):
+        dst = out[v * n:(v + 1) * n]
+        if (r1 - r0, c1 - c0) == (h, w):
+            dst[...] = X
+        else:
+            crop = np.ascontiguousarray(X[:, :, r0:r1, c0:c1],
+                                        dtype=np.float32)
+            ry = bilinear_matrix(r1 - r0, h)
+            rx = bilinear_matrix(c1 - c0, w)
+            tmp = np.dot(crop.reshape(-1, c1 - c0), rx.T)
+            tmp = tmp.reshape(n * c, r1 - r0, w)
+            dst[...] = np.matmul(ry, tmp).reshape(n, c, h, w)
+        if flip:
+            v_flip = v + len(boxes)
+            out[v_flip * n:(v_flip + 1) * n] = dst[..., ::-1]
+    return out
+
+
+def predict_tta(model, X, ratio=0.7, flip=True, batch_size=32,
+                chunk=None, reduce='mean'):
+    """Predict class probabilities with test-time augmentation
+
+    Variants of a chunk of images are written to one preallocated
+    tensor and predicted with a single predict_proba call, then
+    reduced per image.
+
+    @param model: Keras model
+    @param X: images in (n, c, h, w)
+
+    Keyword arguments:
+    ratio      -- size of the crops relative to the image (default: 0.7)
+    flip       -- True to add flipped variants (default: True)
+    batch_size -- batch size of predict_proba (default: 32)
+    chunk      -- number of images per predict_proba call
+                  (default: batch_size)
+    reduce     -- 'mean' or 'max' over the variants (default: 'mean')
+
+    @return probabilities in (n, nb_class)
+
+    """
+    n, c, h, w = X.shape
+    chunk = chunk or batch_size
+    nv = len(tta_boxes(h, w, ratio=ratio)) * (2 if flip else 1)
+    buf = np.empty((nv * min(chunk, n), c, h, w), dtype=np.float32)
+    results = []
+    for start in range(0, n, chunk):
+        Xc = X[start:start + chunk]
+        V = tta_variants(Xc, ratio=ratio, flip=flip, out=buf)
+        probs = model.predict_proba(V, batch_size=batch_size, verbose=0)
+        probs = probs.reshape(nv, len(Xc), -1)
+        if reduce == 'max':
+            results.append(probs.max(axis=0))
+        else:
+            results.append(probs.mean(axis=0))
+    return np.concatenate(results)
+
+
+class ActivationProbe(object):
+    def __init__(self, model, layers):
+        """Outputs of several layers from one compiled function, so
+           probing all of them needs a single forward pass
+
+        @param model: input DP model
+        @param layers: list of layer indexes, names or layer objects
+
+        """
+        from keras import backend as K
+        self.layers = []
+        for l in layers:
+            if isinstance(l, int):
+                l = model.layers[l]
+            elif not hasattr(l, 'output'):
+                l = [la for la in model.layers if la.name == l][0]
+            self.layers.append(l)
+        self.names = [l.name for l in self.layers]
+        outputs = [l.output for l in self.layers]
+        # the 0 fed to K.learning_phase() disables the training phase
+        self._f = K.function(model.inputs + [K.learning_phase()], outputs)
+
+    def probe(self, X):
+        """Return the outputs of all layers for a batch of inputs"""
+
+        return self._f([X, 0])
+
+    def run(self, X, batch_size=16, callback=None, out_dir=None):
+        """Stream the layer outputs batch by batch
+
+        @param X: inputs of the model
+
+        Keyword arguments:
+        batch_size -- number of inputs per forward pass (default: 16)
+        callback   -- function called as callback(start, outputs) per
+                      batch, where outputs is an OrderedDict of layer
+                      name to the batch outputs (default: None)
+        out_dir    -- store the outputs to float32 np.memmap files
+                      out_dir/<layer name>.dat instead of memory
+                      (default: None)
+
+        @return OrderedDict of layer name to outputs of all inputs,
+                None if callback is given
+
+        """
+        nimgs = X.shape[0]
+        outs = None
+        for start in range(0, nimgs, batch_size):
+            acts = OrderedDict(zip(self.names,
+                                   self.probe(X[start:start + batch_size])))
+            if callback is not None:
+                callback(start, acts)
+                continue
+            if outs is None:
+                outs = OrderedDict()
+                if out_dir is not None and not os.path.isdir(out_dir):
+                    os.makedirs(out_dir)
+                for name, a in acts.items():
+                    shape = (nimgs,) + a.shape[1:]
+                    if out_dir is not None:
+                        outs[name] = np.memmap(
+                            os.path.join(out_dir, name + '.dat'),
+                            dtype='float32', mode='w+', shape=shape)
+                    else:
+                        outs[name] = np.empty(shape, dtype=np.float32)
+            for name, a in acts.items():
+                outs[name][start:start + a.shape[0]] = a
+        if out_dir is not None and outs is not None:
+            for a in outs.values():
+                a.flush()
+        return outs
+
+
+def deprocess_image(x):
+    """Convert an input array in (c, h, w) to a uint8 RGB image
+
+    The array is centered on 0.5 with std 0.1 and clipped to [0, 1].
+
+    """
+    x = x - x.mean()
+    x /= (x.std() + 1e-5)
+    x *= 0.1
+    x += 0.5
+    x = np.clip(x, 0, 1) * 255
+    return x.transpose((1, 2, 0)).astype('uint8')
+
+
+class FilterVisualizer(object):
+    def __init__(self, model, layer):
+        """Gradient ascent in input space for many filters at once
+
+        Every image of a batch maximizes the mean activation of its own
+        filter. The per-image losses are summed into one loss, so one
+        gradient call per step updates the whole batch.
+
+        @param model: input DP model
+        @param layer: index, name or layer object to visualize
+
+        """
+        from keras import backend as K
+        if isinstance(layer, int):
+            layer = model.layers[layer]
+        elif not hasattr(layer, 'output'):
+            layer = [la for la in model.layers if la.name == layer][0]
+        self.layer = layer
+        self.input_shape = tuple(model.input_shape[1:])
+        out = layer.output
+        self.nb_filter = layer.output_shape[-1]
+        if K.ndim(out) == 4:
+            if K.image_dim_ordering() == 'th':
+                self.nb_filter = layer.output_shape[1]
+                out = K.mean(out, axis=[2, 3])
+            else:
+                out = K.mean(out, axis=[1, 2])
+        # one-hot (n, nb_filter) selection of the filter of each image
+        select = K.placeholder(ndim=2)
+        losses = K.sum(out * select, axis=1)
+        grads = K.gradients(K.sum(losses), model.inputs[0])[0]
+        # normalize the gradient of each image by its L2 norm
+        norm = K.sqrt(K.mean(K.square(grads), axis=[1, 2, 3],
+                             keepdims=True))
+        grads = grads / (norm + 1e-5)
+        self._f = K.function(
+            model.inputs + [select, K.learning_phase()], [losses, grads])
+
+    def visualize(self, filters=None, nb_iter=20, step=1., batch_size=16,
+                  patience=3, tol=1e-3, seed=None, offset=128.):
+        """Run gradient ascent for all filters in batches
+
+        A filter is dropped from the batch when its loss is not positive
+        (stuck at 0) or when it improved by less than tol (relative) for
+        patience steps; its slot is then refilled with the next filter.
+
+        Keyword arguments:
+        filters    -- list of filter indexes (default: all filters)
+        nb_iter    -- maximum number of steps per filter (default: 20)
+        step       -- step size of gradient ascent (default: 1.)
+        batch_size -- number of images optimized at once (default: 16)
+        patience   -- steps without improvement before dropping
+                      (default: 3)
+        tol        -- relative improvement counted as progress
+                      (default: 1e-3)
+        seed       -- seed of the random initial images (default: None)
+        offset     -- gray level of the initial images, which get
+                      uniform noise in [0, 20) on top (default: 128.)
+
+        @return list of (filter index, input array in (c, h, w), loss)
+                of the filters with positive losses, by decreasing loss
+
+        """
+        if filters is None:
+            filters = range(self.nb_filter)
+        pending = list(filters)[::-1]
+        rng = np.random.RandomState(seed)
+        X = np.empty((batch_size,) + self.input_shape, dtype=np.float32)
+        select = np.zeros((batch_size, self.nb_filter), dtype=np.float32)
+        slots = [None] * batch_size
+        results = []
+
+        def _fill(i):
+            if len(pending) == 0:
+                slots[i] = None
+                return
+            # start from a gray image with some random noise
+            X[i] = rng.random_sample(self.input_shape) * 20 + offset
+            select[i] = 0
+            fi = pending.pop()
+            select[i, fi] = 1
+            slots[i] = {'filter': fi, 'best': None, 'wait': 0, 'iter': 0}
+
+        for i in range(batch_size):
+            _fill(i)
+        while any(s is not None for s in slots):
+            active = [i for i in range(batch_size) if slots[i] is not None]
+            losses, grads = self._f([X[active], select[active], 0])
+            X[active] += grads * step
+            for j, i in enumerate(active):
+                s = slots[i]
+                s['iter'] += 1
+                loss = float(losses[j])
+                if s['best'] is None or \
+                        loss > s['best'] + tol * abs(s['best']):
+                    s['wait'] = 0
+                    s['best'] = loss
+                else:
+                    s['wait'] += 1
+                    s['best'] = max(s['best'], loss)
+                if loss <= 0:
+                    # some filters get stuck to 0, skip them
+                    _fill(i)
+                elif s['wait'] >= patience or s['iter'] >= nb_iter:
+                    results.append((s['filter'], X[i].copy(), loss))
+                    _fill(i)
+        results.sort(key=lambda r: -r[2])
+        return results
+
+
+class HypercolumnExtractor(object):
+    def __init__(self, model, la_idx, size=(224, 224)):
+        """Extract hypercolumns of pixels with the feature function
+           compiled only once for the model and the layers
+
+        @param model: input DP model
+        @param la_idx: indexes of the layers to be extract
+
+        Keyword arguments:
+        size -- size of the output hypercolumn maps (default: (224, 224))
+
+        """
+        self.la_idx = list(la_idx)
+        self.size = tuple(size)
+        self.probe = ActivationProbe(model, self.la_idx)
+        self.nb_channels = None
+
+    def features(self, X):
+        """Return feature maps of the layers for a batch of images"""
+
+        return self.probe.probe(X)
+
+    def extract(self, X, batch_size=16, fname=None):
+        """Extract hypercolumns for a batch of images
+
+        @param X: input images in (n, c, h, w)
+
+        Keyword arguments:
+        batch_size -- number of images per forward pass (default: 16)
+        fname      -- store the output to a float32 np.memmap file
+                      instead of memory (default: None)
+
+        @return hypercolumns in (n, channels, size[0], size[1])
+
+        """
+        nimgs = X.shape[0]
+        out = None
+        for start in range(0, nimgs, batch_size):
+            maps = self.features(X[start:start + batch_size])
+            if out is None:
+                self.nb_channels = sum([m.shape[1] for m in maps])
+                shape = (nimgs, self.nb_channels) + self.size
+                if fname is not None:
+                    out = np.memmap(fname, dtype='float32',
+                                    mode='w+', shape=shape)
+                else:
+                    out = np.empty(shape, dtype=np.float32)
+            end = start + maps[0].shape[0]
+            ch = 0
+            for m in maps:
+                out[start:end, ch:ch + m.shape[1]] = \
+                    upsample_maps(m, self.size)
+                ch += m.shape[1]
+        if fname is not None:
+            out.flush()
+        return out
+
+
+class BottleneckCache(object):
+    def __init__(self, model, nb_frozen, cache_dir='./bottleneck'):
+        """Cache outputs of the frozen bottom layers of a model, so only
+           the layers above them need to run while training
+
+        Features are appended to a float32 file under
+        cache_dir/<hash of the frozen weights>/ and indexed by the hash
+        of each input image, so they are computed once per image as
+        long as the frozen weights do not change.
+
+        @param model: the full model
+        @param nb_frozen: number of bottom layers which are frozen
+
+        Keyword arguments:
+        cache_dir -- parent directory of the cache (default: ./bottleneck)
+
+        """
+        import json
+        import hashlib
+        from keras import backend as K
+        self.model = model
+        self.nb_frozen = nb_frozen
+        md5 = hashlib.md5()
+        for layer in model.layers[:nb_frozen]:
+            for w in layer.get_weights():
+                md5.update(np.ascontiguousarray(w).tobytes())
+        self.whash = md5.hexdigest()
+        self.cache_dir = os.path.join(cache_dir, self.whash)
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self.fdata = os.path.join(self.cache_dir, 'features.dat')
+        self.findex = os.path.join(self.cache_dir, 'index.json')
+
+        output = model.layers[nb_frozen - 1].output
+        self._f = K.function(model.inputs + [K.learning_phase()], [output])
+        self.shape = tuple(model.layers[nb_frozen - 1].output_shape[1:])
+        self.row_nbytes = 4 * int(np.prod(self.shape))
+        self.index = {}
+        if os.path.isfile(self.findex):
+            with open(self.findex) as f:
+                self.index = json.load(f)
+        self._truncate()
+        print('[DP] Bottleneck cache %s has %i images'
+              % (self.cache_dir, len(self.index)))
+
+    def _truncate(self):
+        """Drop rows of the data file which are not in the index, e.g.
+           written by an interrupted run before the index was saved"""
+
+        if not os.path.isfile(self.fdata):
+            return
+        nrows = max(self.index.values()) + 1 if len(self.index) > 0 else 0
+        if os.path.getsize(self.fdata) > nrows * self.row_nbytes:
+            print('[DP] Dropping bottleneck rows which are not indexed')
+            with open(self.fdata, 'r+b') as f:
+                f.truncate(nrows * self.row_nbytes)
+
+    def _hash(self, img):
+        import hashlib
+        return hashlib.md5(np.ascontiguousarray(img).tobytes()).hexdigest()
+
+    def _rows(self):
+        """Open the cached features as np.memmap"""
+
+        nrows = os.path.getsize(self.fdata) // self.row_nbytes
+        return np.memmap(self.fdata, dtype='float32', mode='r',
+                         shape=(nrows,) + self.shape)
+
+    def features(self, X, batch_size=32):
+        """Return bottleneck features of the images, computing only
+           those which are not cached yet
+
+        @param X: input images in (n, c, h, w)
+
+        Keyword arguments:
+        batch_size -- number of images per forward pass (default: 32)
+
+        @return features in (n,) + output shape of the frozen layers
+
+        """
+        import json
+        keys = [self._hash(x) for x in X]
+        missing = [i for i, k in enumerate(keys) if k not in self.index]
+        if len(missing) > 0:
+            print('[DP] Computing bottleneck features of %i images'
+                  % len(missing))
+            with open(self.fdata, 'ab') as f:
+                # rows are placed after the data actually in the file
+                f.seek(0, os.SEEK_END)
+                nrows = f.tell() // self.row_nbytes
+                for start in range(0, len(missing), batch_size):
+                    idx = missing[start:start + batch_size]
+                    out = self._f([X[idx], 0])[0].astype(np.float32)
+                    for i, o in zip(idx, out):
+                        # duplicated images in X share one row
+                        if keys[i] in self.index:
+                            continue
+                        f.write(np.ascontiguousarray(o).tobytes())
+                        self.index[keys[i]] = nrows
+                        nrows += 1
+            ftmp = self.findex + '.tmp'
+            with open(ftmp, 'w') as f:
+                json.dump(self.index, f)
+            os.rename(ftmp, self.findex)
+        rows = np.array([self.index[k] for k in keys])
+        data = self._rows()
+        if len(rows) > 0 and \
+                np.array_equal(rows, np.arange(rows[0], rows[0] + len(rows))):
+            return data[rows[0]:rows[0] + len(rows)]
+        return data[rows]
+
+    def head_model(self):
+        """Return a model of the layers above the frozen ones, taking
+           the bottleneck features as input. The layers are shared with
+           the full model, so training the head updates the full model.
+
+        """
+        from keras.layers import Input
+        from keras.models import Model
+        x = input_features = Input(shape=self.shape)
+        for layer in self.model.layers[self.nb_frozen:]:
+            x = layer(x)
+        return Model(input=input_features, output=x)
+
+
+def image_frames(img_loc, size=None):
+    """Yield the images of a folder in sorted order as video frames
+
+    @param img_loc: path of the images or a list of image paths
+
+    Keyword arguments:
+    size -- tuple of new size in (height, width) (default: None)
+
+    """
+    im = image.IMAGE()
+    if type(img_loc) is list:
+        imgs = img_loc
+    else:
+        imgs = im.find_images(dir_path=img_loc)
+    for fimg in sorted(imgs):
+        img = im.read(fimg, size=size)
+        if img is not None:
+            yield img
+
+
+def video_frames(path, size=None):
+    """Yield the frames of a video file
+
+    @param path: path of the video
+
+    Keyword arguments:
+    size -- tuple of new size in (height, width) (default: None)
+
+    """
+    import cv2
+    cap = cv2.VideoCapture(path)
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if size is not None:
+                frame = cv2.resize(frame, size)
+            yield frame
+    finally:
+        cap.release()
+
+
+class ClipEngine(object):
+    def __init__(self, predict, clip_len=16, stride=1, batch_size=32,
+                 crop=None):
+        """Run a clip model (e.g. C3D) over sliding frame windows
+
+        Frames are written once, channel first, into a buffer holding
+        clip_len + (batch_size - 1) * stride frames. Clip batches are
+        strided views of that buffer in (n, c, clip_len, h, w), and only
+        the clip_len - stride overlapping frames are moved to the front
+        after each batch, so memory is bounded by the buffer size
+        whatever the length of the video.
+
+        @param predict: function mapping a clip batch to predictions,
+                        e.g. model.predict_on_batch
+
+        Keyword arguments:
+        clip_len   -- number of frames per clip (default: 16)
+        stride     -- number of frames between two clips (default: 1)
+        batch_size -- number of clips per predict call (default: 32)
+        crop       -- (row_slice, col_slice) applied to every frame
+                      (default: None)
+
+        """
+        self.predict = predict
+        self.clip_len = clip_len
+        self.stride = stride
+        self.batch_size = batch_size
+        self.crop = crop
+        self.capacity = clip_len + (batch_size - 1) * stride
+        self.buffer = None
+
+    def _allocate(self, frame):
+        h, w, c = frame.shape
+        self.buffer = np.empty((c, self.capacity, h, w), dtype=np.float32)
+
+    def clips(self, nb_clip, offset=0):
+        """Return a view of nb_clip clips starting at buffer index offset
+
+        @return array in (nb_clip, c, clip_len, h, w)
+
+        """
+        c, t, h, w = self.buffer.shape
+        sc, st, sh, sw = self.buffer.strides
+        view = np.lib.stride_tricks.as_strided(
+            self.buffer[:, offset:],
+            shape=(nb_clip, c, self.clip_len, h, w),
+            strides=(st * self.stride, sc, st, sh, sw))
+        view.flags.writeable = False
+        return view
+
+    def _flush(self, fill, first):
+        """Predict all complete clips in buffer[:, :fill]
+
+        @param fill: number of frames in the buffer
+        @param first: frame index of the first clip in the buffer
+
+        """
+        nb_clip = (fill - self.clip_len) // self.stride + 1
+        if nb_clip <= 0:
+            return []
+        output = self.predict(self.clips(nb_clip))
+        return [(first + i * self.stride, output[i]) for i in range(nb_clip)]
+
+    def run(self, frames):
+        """Predict every clip of a frame source
+
+        @param frames: iterable of frames in (h, w, c)
+
+        @return generator of (index of the first frame, prediction)
+                per clip, in frame order
+
+        """
+        fill = 0
+        first = 0
+        skip = 0
+        for i, frame in enumerate(frames):
+            if skip > 0:
+                # stride larger than clip_len, frames between clips
+                skip -= 1
+                continue
+            if self.crop is not None:
+                frame = frame[self.crop[0], self.crop[1]]
+            if self.buffer is None:
+                self._allocate(frame)
+            if fill == 0:
+                first = i
+            self.buffer[:, fill] = np.rollaxis(frame, 2)
+            fill += 1
+            if fill < self.capacity:
+                continue
+            for result in self._flush(fill, first):
+                yield result
+            shift = self.batch_size * self.stride
+            keep = max(fill - shift, 0)
+            skip = max(shift - fill, 0)
+            if keep > 0:
+                self.buffer[:, :keep] = self.buffer[:, fill - keep:fill]
+            fill = keep
+            first += shift
+        for result in self._flush(fill, first):
+            yield result
+
+    def predict_all(self, frames):
+        """Predict every clip of a frame source
+
+        @param frames: iterable of frames in (h, w, c)
+
+        @return (frame indexes, predictions) of all clips as arrays
+
+        """
+        index = []
+        outputs = []
+        for i, output in self.run(frames):
+            index.append(i)
+            outputs.append(output)
+        return np.array(index), np.array(outputs)
 
 
 class DP:
     def __init__(self):
         self.im = image.IMAGE()
         self.mlr = ml.MLRun()
+        self.hc_extractors = {}
+        self.hc_centers = None
         self.dp_init()
 
     def dp_init(self):
@@ -32,7 +1013,7 @@ class DP:
 
     def train_data_generator(self, data_dir, img_width, img_height,
                              class_mode="categorical", batch_size=32,
-                             train_mode=True):
+                             train_mode=True, nb_worker=0, prefetch=4):
         """trturn ImageDataGenerator for training data
 
         @param data_dir: path of the images
@@ -48,9 +1029,25 @@ class DP:
                      (default: True)
         sort      -- True to sort the images (default: False)
         trans     -- True to transport the image from (h, w, c) to (c, h, w)
+        nb_worker -- number of processes decoding and augmenting images
+                     ahead of training, 0 to use ImageDataGenerator
+                     (default: 0)
+        prefetch  -- number of batches prepared ahead by the workers
+                     (default: 4)
 
         """
 
+        if nb_worker > 0:
+            aug = {}
+            if train_mode:
+                aug = {'shear_range': 0.2, 'zoom_range': 0.2,
+                       'horizontal_flip': True}
+            return BatchPrefetcher(
+                data_dir, (img_width, img_height), class_mode=class_mode,
+                batch_size=batch_size, shuffle=train_mode,
+                nb_worker=nb_worker, prefetch=prefetch, **aug)
+
+        from keras.preprocessing.image import ImageDataGenerator
         if train_mode:
             datagen = ImageDataGenerator(
                 rescale=1./255,
@@ -70,12 +1067,14 @@ class DP:
         return generator
 
     def val_data_generator(self, val_data_dir, img_width, img_height,
-                           class_mode="categorical", batch_size=32):
+                           class_mode="categorical", batch_size=32,
+                           nb_worker=0, prefetch=4):
         """return ImageDataGenerator for validation data"""
 
         return self.train_data_generator(
             val_data_dir, img_width, img_height, train_mode=False,
-            class_mode=class_mode, batch_size=batch_size)
+            class_mode=class_mode, batch_size=batch_size,
+            nb_worker=nb_worker, prefetch=prefetch)
 
     def prepare_cifar10_data(self, nb_classes=10):
         """ Get Cifar10 data """
@@ -122,6 +1121,7 @@ class DP:
     def visualize_model(self, model, to_file='model.png'):
         '''Visualize model (work with Keras 1.0)'''
 
+        from keras.models import Sequential, Model
         if type(model) == Sequential or type(model) == Model:
             from keras.utils.visualize_util import plot
             plot(model, to_file=to_file)
@@ -145,26 +1145,86 @@ class DP:
 
             graph.write_png(to_file)
 
-    def extract_hypercolumn(self, model, la_idx, instance):
-        ''' Extract HyperColumn of pixels (Theano Only)
+    def activation_probe(self, model, layers):
+        """Return an ActivationProbe which outputs all the layers
+           in one forward pass
+
+        @param model: input DP model
+        @param layers: list of layer indexes, names or layer objects
+
+        """
+        return ActivationProbe(model, layers)
+
+    def filter_visualizer(self, model, layer):
+        """Return a FilterVisualizer which runs gradient ascent for
+           a batch of filters of the layer at once
+
+        @param model: input DP model
+        @param layer: index, name or layer object to visualize
+
+        """
+        return FilterVisualizer(model, layer)
+
+    def hypercolumn_extractor(self, model, la_idx, size=(224, 224)):
+        """Return the HypercolumnExtractor of the model and the layers,
+           which is created (compiled) only at the first call
+
+        @param model: input DP model
+        @param la_idx: indexes of the layers to be extract
+
+        Keyword arguments:
+        size -- size of the output hypercolumn maps (default: (224, 224))
+
+        """
+        key = (id(model), tuple(la_idx), tuple(size))
+        if key not in self.hc_extractors:
+            self.hc_extractors[key] = HypercolumnExtractor(
+                model, la_idx, size=size)
+        return self.hc_extractors[key]
+
+    def extract_hypercolumn(self, model, la_idx, instance,
+                            batch_size=16, fname=None):
+        ''' Extract HyperColumn of pixels
 
         @param model: input DP model
         @param la_idx: indexes of the layers to be extract
         @param instamce: image instance used to extract the hypercolumns
 
+        Arguments:
+        batch_size -- number of images per forward pass (default: 16)
+        fname      -- store the output to a float32 np.memmap file
+
+        @return hypercolumns in (channels, 224, 224) for one image,
+                or (n, channels, 224, 224) for a batch of images
+
         '''
-        import theano
-        layers = [model.layers[li].get_output(train=False) for li in la_idx]
-        get_feature = theano.function([model.layers[0].input], layers,
-                                      allow_input_downcast=False)
-        feature_maps = get_feature(instance)
-        hypercolumns = []
-        for convmap in feature_maps:
-            for fmap in convmap[0]:
-                upscaled = sp.misc.imresize(fmap, size=(224, 224),
-                                            mode="F", interp='bilinear')
-                hypercolumns.append(upscaled)
-        return np.asarray(hypercolumns)
+        extractor = self.hypercolumn_extractor(model, la_idx)
+        hc = extractor.extract(instance, batch_size=batch_size, fname=fname)
+        if hc.shape[0] == 1 and fname is None:
+            return hc[0]
+        return hc
+
+    def predict_tta(self, model, X, ratio=0.7, flip=True, batch_size=32,
+                    chunk=None, reduce='mean'):
+        """Predict probabilities averaged over crop and flip variants
+
+        @param model: Keras model
+        @param X: images in (n, c, h, w)
+
+        Keyword arguments:
+        ratio      -- size of the crops relative to the image (default: 0.7)
+        flip       -- True to add flipped variants (default: True)
+        batch_size -- batch size of predict_proba (default: 32)
+        chunk      -- number of images per predict_proba call
+                      (default: batch_size)
+        reduce     -- 'mean' or 'max' over the variants (default: 'mean')
+
+        @return probabilities in (n, nb_class)
+
+        """
+        return predict_tta(
+            model, X, ratio=ratio, flip=flip, batch_size=batch_size,
+            chunk=chunk, reduce=reduce)
 
     def is_dense(self, layer):
         '''Check if the layer is dense (fully connected)
@@ -186,19 +1246,67 @@ class DP:
             return layer_name
         return None
 
-    def cluster_hc(self, hc, n_jobs=1):
-        ''' Use KMeans to cluster hypercolumns'''
+    def cluster_hc(self, hc, n_jobs=1, method='kmeans', n_clusters=2,
+                   subsample=None, warm_start=False, seed=None):
+        ''' Use KMeans to cluster hypercolumns
+
+        @param hc: hypercolumns in (channels, rows, cols)
+
+        Arguments:
+        n_jobs     -- number of jobs used by KMeans (default: 1)
+        method     -- 'kmeans' for full KMeans, 'minibatch' for
+                      MiniBatchKMeans (default: kmeans)
+        n_clusters -- number of clusters (default: 2)
+        subsample  -- number of random pixels to fit on (default: None)
+        warm_start -- True to start from the centroids of the previous
+                      call (default: False)
+        seed       -- random seed (default: None)
+
+        '''
+        nch, rows, cols = hc.shape
+        if method == 'kmeans' and subsample is None and not warm_start:
+            m = hc.transpose(1, 2, 0).reshape(rows*cols, -1)
+            kmeans = cluster.KMeans(n_clusters=n_clusters, max_iter=300,
+                                    n_jobs=n_jobs,
+                                    precompute_distances=True)
+            cluster_labels = kmeans.fit_predict(m)
+            self.hc_centers = kmeans.cluster_centers_
+            return cluster_labels.reshape(rows, cols)
+
+        init = None
+        if warm_start and self.hc_centers is not None and \
+                self.hc_centers.shape == (n_clusters, nch):
+            init = self.hc_centers
+        m = hc.reshape(nch, rows*cols).T
+        cluster_labels, self.hc_centers = cluster_pixels(
+            m, n_clusters=n_clusters, method=method, subsample=subsample,
+            init=init, n_jobs=n_jobs, seed=seed)
+        return cluster_labels.reshape(rows, cols)
+
+    def cluster_hcs(self, hcs, method='minibatch', subsample=10000,
+                    warm_start=True, **kwargs):
+        ''' Cluster hypercolumns of many images, the centroids of
+            each image start from those of the previous one
+
+        @param hcs: hypercolumns in (n, channels, rows, cols),
+                    a memmap or an iterable of (channels, rows, cols)
+
+        Arguments:
+        method     -- see cluster_hc (default: minibatch)
+        subsample  -- see cluster_hc (default: 10000)
+        warm_start -- True to start from the previous centroids, also
+                      for the first image if cluster_hc ran before
+                      (default: True)
+
+        @return cluster maps in (n, rows, cols)
 
-        ori_size = hc.shape[1]
-        new_size = ori_size*ori_size
-        m = hc.transpose(1, 2, 0).reshape(new_size, -1)
-        kmeans = cluster.KMeans(n_clusters=2, max_iter=300, n_jobs=n_jobs,
-                                precompute_distances=True)
-        cluster_labels = kmeans .fit_predict(m)
-        imcluster = np.zeros((ori_size, ori_size))
-        imcluster = imcluster.reshape((new_size,))
-        imcluster = cluster_labels
-        return imcluster.reshape(ori_size, ori_size)
+        '''
+        results = []
+        for hc in hcs:
+            results.append(self.cluster_hc(
+                hc, method=method, subsample=subsample,
+                warm_start=warm_start, **kwargs))
+        return np.array(results)
 
     def prepare_data(self, img_loc, width, height, convert_Y=True,
                      rc=False, scale=True, classes=None,
@@ -335,14 +1443,111 @@ class DP:
         return X_train, X_test, Y_train, Y_test, classes
 
 
+_IMAGENET_LABELS = {}
+
+
+def imagenet_labels(fname='synset_words.txt'):
+    """Parse the ImageNet label file once and cache it per path
+
+    @param fname: filename of the ImageNet labels
+
+    @return dictionary of
+            raw   -- lines of the file as np.ndarray (np.loadtxt output)
+            wnid  -- WordNet ids, e.g. 'n07754684'
+            names -- descriptions, e.g. 'jackfruit, jak, jack'
+            cats  -- descriptions split to words without commas
+
+    """
+    key = os.path.abspath(fname)
+    if key not in _IMAGENET_LABELS:
+        raw = np.loadtxt(fname, str, delimiter='\t')
+        _IMAGENET_LABELS[key] = parse_imagenet_labels(raw)
+    return _IMAGENET_LABELS[key]
+
+
+def parse_imagenet_labels(raw):
+    """Split lines like 'n07754684 jackfruit, jak, jack' to the label
+       table returned by imagenet_labels"""
+
+    splits = [l.split(' ', 1) for l in raw]
+    names = [sp[1] if len(sp) > 1 else '' for sp in splits]
+    return {'raw': raw,
+            'wnid': np.array([sp[0] for sp in splits]),
+            'names': np.array(names),
+            'cats': [n.replace(',', '').split(' ') for n in names]}
+
+
 class ImageNet(image.IMAGE):
     def get_labels(self, fname='synset_words.txt'):
-        '''Get ImageNet labels from file'''
+        '''Get ImageNet labels from file, the file is read only once'''
 
-        if not self.check_exist(fname):
+        if os.path.abspath(fname) not in _IMAGENET_LABELS and \
+                not self.check_exist(fname):
             print('ERROR: Cannot find %s.' % fname)
             sys.exit(1)
-        return np.loadtxt(fname, str, delimiter='\t')
+        return imagenet_labels(fname)['raw']
+
+    def _label_table(self, labels, fname):
+        """Return the cached label table, or parse the given labels,
+           which are parsed again only if another labels object is given
+        """
+
+        if labels is None:
+            self.get_labels(fname)
+            return imagenet_labels(fname)
+        cached = getattr(self, '_parsed_labels', None)
+        if cached is None or cached[0] is not labels:
+            # the labels object is kept so its id is not reused
+            self._parsed_labels = (labels, parse_imagenet_labels(labels))
+        return self._parsed_labels[1]
+
+    def topk_index(self, probs, ntop=3):
+        ''' Indexes of the ntop highest probabilities of each row,
+            sorted from the highest
+
+        @param probs: probabilities in (N, ncats)
+
+        '''
+        probs = np.atleast_2d(probs)
+        ntop = min(ntop, probs.shape[1])
+        if ntop < probs.shape[1]:
+            part = np.argpartition(-probs, ntop - 1, axis=1)[:, :ntop]
+        else:
+            part = np.tile(np.arange(probs.shape[1]), (probs.shape[0], 1))
+        rows = np.arange(probs.shape[0])[:, None]
+        order = np.argsort(-probs[rows, part], axis=1)
+        return part[rows, order]
+
+    def find_topk_batch(self, probs, labels=None,
+                        fname='synset_words.txt', ntop=3):
+        ''' Find the categories with highest probabilities for a batch
+
+        @param probs: probabilities in (N, 1000)
+
+        Keyword arguments:
+        labels -- ImageNet labels (default: cached self.get_labels)
+        fname  -- filename of the ImageNet labels
+        ntop   -- how many top cats to be shown (default: 3)
+
+        @return structured array in (N, ntop) with fields
+                index, prob, wnid and name, sorted from the highest
+         example: results[0][0] = (955, 0.0005171, 'n07754684',
+                                   'jackfruit, jak, jack')
+
+        '''
+        table = self._label_table(labels, fname)
+        probs = np.atleast_2d(probs)
+        top = self.topk_index(probs, ntop=ntop)
+        rows = np.arange(probs.shape[0])[:, None]
+        dtype = [('index', np.int32), ('prob', probs.dtype),
+                 ('wnid', table['wnid'].dtype),
+                 ('name', table['names'].dtype)]
+        results = np.empty(top.shape, dtype=dtype)
+        results['index'] = top
+        results['prob'] = probs[rows, top]
+        results['wnid'] = table['wnid'][top]
+        results['name'] = table['names'][top]
+        return results
 
     def find_topk(self, prob, labels=None, fname='synset_words.txt', ntop=3):
         ''' Find the categories with highest probabilities
@@ -350,7 +1555,7 @@ class ImageNet(image.IMAGE):
         @param prob: a list of probabilities of 1,000 categories
 
         Keyword arguments:
-        labels -- ImageNet labels (default: re-gain from self.get_labels)
+        labels -- ImageNet labels (default: cached self.get_labels)
         fname  -- filename of the ImageNet labels
         ntop   -- how many top cats to be shown (default: 3)
 
@@ -359,11 +1564,9 @@ class ImageNet(image.IMAGE):
                    ['jackfruit', 'jak', 'jack'])}
 
         '''
-        if labels is None:
-            labels = self.get_labels(fname)
+        table = self._label_table(labels, fname)
+        prob = np.asarray(prob).flatten()
         results = {}
-        top_k = prob.flatten().argsort()[-1:-(ntop+1):-1]
-        for k in top_k:
-            l = labels[k].replace(',', '').split(' ')
-            results[k] = (prob[k], l[0], l[1:])
+        for k in self.topk_index(prob, ntop=ntop)[0]:
+            results[k] = (prob[k], table['wnid'][k], table['cats'][k])
         return results
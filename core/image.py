@@ -3,13 +3,14 @@ import sys
 import subprocess
 import numpy as np
 import logging
-import cv2
-from PIL import Image
-from simdat.core.so import math_tools
 from simdat.core import tools
 from simdat.core import plot
 from simdat.core import args
 
+cv2 = tools.LazyImport('cv2')
+Image = tools.LazyImport('PIL.Image')
+math_tools = tools.LazyImport('simdat.core.so.math_tools')
+
 
 class IMAGE(tools.TOOLS):
     def tools_init(self):
@@ -508,6 +509,41 @@ class IMAGE(tools.TOOLS):
                 self.save(imgs[corner], fname=fname)
         return imgs
 
+    def random_affine(self, img, shear_range=0., zoom_range=0.,
+                      horizontal_flip=False, rng=None):
+        """Apply random shear, zoom and horizontal flip in one warp
+
+        @param img: input image array in (h, w, c)
+
+        Keyword arguments:
+        shear_range     -- shear intensity in radians (default: 0)
+        zoom_range      -- zoom in [1-zoom_range, 1+zoom_range] (default: 0)
+        horizontal_flip -- True to flip half of the images (default: False)
+        rng             -- np.random.RandomState to draw from
+                           (default: np.random)
+
+        @return transformed image with the same shape
+
+        """
+        if rng is None:
+            rng = np.random
+        h, w = img.shape[:2]
+        shear = rng.uniform(-shear_range, shear_range) if shear_range else 0.
+        if zoom_range:
+            zx, zy = rng.uniform(1 - zoom_range, 1 + zoom_range, 2)
+        else:
+            zx, zy = 1., 1.
+        A = np.dot(np.array([[1., -np.sin(shear)], [0., np.cos(shear)]]),
+                   np.array([[zx, 0.], [0., zy]]))
+        if horizontal_flip and rng.uniform() < 0.5:
+            A[:, 0] *= -1
+        # A maps output pixels to input pixels around the image center
+        center = np.array([(w - 1) * 0.5, (h - 1) * 0.5])
+        M = np.hstack([A, (center - np.dot(A, center))[:, None]])
+        return cv2.warpAffine(img, M, (w, h),
+                              flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                              borderMode=cv2.BORDER_REPLICATE)
+
     def resize(self, img, size):
         """ Resize the image """
 
@@ -1,4 +1,6 @@
+import os
 import h5py
+import numpy as np
 from collections import OrderedDict
 from keras import regularizers
 from keras.models import Sequential
@@ -479,7 +481,7 @@ def Inception_v3(weights_path=None,
         model.layers[1].set_weights([weights, np.zeros((weights.shape[0],))])
 
     if weights_path:
-        model.load_weights(weights_path)
+        load_weights(model, weights_path)
 
     return model
 
@@ -552,7 +554,7 @@ def VGG_19(weights_path=None):
             model.add(l)
 
     if weights_path:
-        model.load_weights(weights_path)
+        load_weights(model, weights_path)
 
     return model
 
@@ -627,17 +629,30 @@ def VGG_16(weights_path=None, lastFC=True):
     return model
 
 
-def load_weights(model, weights_path, lastFC=True):
+def load_weights(model, weights_path, lastFC=True, cache=False,
+                 quantize=None):
     """ Load model weights
 
     @param model: the model
-    @param weight_path: path of the weight file
+    @param weight_path: path of the weight file, a .flat file written
+                        by convert_weights is memory-mapped
 
     Arguments:
 
-    lastFC -- True to load weights for the last FC layer (default: True)
+    lastFC   -- True to load weights for the last FC layer (default: True)
+    cache    -- True to convert the HDF5 file to weight_path.flat at the
+                first call and memory-map it afterwards (default: False)
+    quantize -- None, 'float16' or 'int8', quantization of the cached
+                flat file, see convert_weights (default: None)
 
     """
+    if weights_path.endswith('.flat'):
+        return load_flat_weights(model, weights_path, lastFC=lastFC)
+    if cache:
+        flat_path = flat_weights_path(weights_path, quantize=quantize)
+        if not is_flat_fresh(weights_path, flat_path):
+            convert_weights(weights_path, flat_path, quantize=quantize)
+        return load_flat_weights(model, flat_path, lastFC=lastFC)
     if lastFC:
         model.load_weights(weights_path)
         return
@@ -652,6 +667,277 @@ def load_weights(model, weights_path, lastFC=True):
     return
 
 
+def _h5_str(s):
+    """HDF5 attributes may be bytes with Python 3"""
+
+    return s.decode('utf8') if isinstance(s, bytes) else s
+
+
+def flat_weights_path(weights_path, quantize=None):
+    """ Default path of the flat file converted from weights_path"""
+
+    if quantize is None:
+        return weights_path + '.flat'
+    return '%s.%s.flat' % (weights_path, quantize)
+
+
+def quantize_weight(arr, quantize, min_size=1024):
+    """ Quantize one weight array
+
+    float16 casts the array. int8 is symmetric per output channel with
+    one float32 scale per channel: axis 0 for 4D convolution kernels
+    (nb_filter, stack, rows, cols) and the last axis for 2D dense
+    kernels (input_dim, output_dim). Biases and arrays smaller than
+    min_size elements are kept as they are.
+
+    @param arr: the weight array
+    @param quantize: 'float16' or 'int8'
+
+    Arguments:
+
+    min_size -- arrays with less elements are not quantized
+                (default: 1024)
+
+    @return (stored array, scales or None, channel axis or None)
+
+    """
+    if arr.dtype.kind != 'f' or arr.ndim < 2 or arr.size < min_size:
+        return arr, None, None
+    if quantize == 'float16':
+        return arr.astype(np.float16), None, None
+    if quantize != 'int8':
+        raise ValueError('Unknown quantization %s' % quantize)
+    axis = 0 if arr.ndim == 4 else arr.ndim - 1
+    moved = np.moveaxis(arr, axis, 0).reshape(arr.shape[axis], -1)
+    scale = np.abs(moved).max(axis=1).astype(np.float32) / 127.
+    scale[scale == 0] = 1.
+    shape = [1] * arr.ndim
+    shape[axis] = -1
+    q = np.clip(np.round(arr / scale.reshape(shape)), -127, 127)
+    return q.astype(np.int8), scale, axis
+
+
+def dequantize_weight(q, scale, axis, dtype):
+    """ Inverse of quantize_weight, returns an array of dtype"""
+
+    arr = q.astype(dtype)
+    if scale is not None:
+        shape = [1] * q.ndim
+        shape[axis] = -1
+        arr *= scale.reshape(shape)
+    return arr
+
+
+def convert_weights(weights_path, flat_path=None, align=64, quantize=None):
+    """ Convert a Keras HDF5 weight file to an uncompressed flat file,
+        which load_flat_weights maps to memory instead of copying
+
+    Arrays are written back to back to flat_path, each aligned to
+    `align` bytes. flat_path.json indexes the offset, shape and dtype
+    of every array per layer.
+
+    With quantize, kernels are stored as float16 or as int8 with
+    per-channel scales (see quantize_weight) and are dequantized by
+    read_flat_weights, so the file is 2x or 4x smaller but the weights
+    are copied instead of mapped.
+
+    @param weights_path: path of the HDF5 weight file
+
+    Arguments:
+
+    flat_path -- path of the output (default: flat_weights_path)
+    align     -- alignment of the arrays in bytes (default: 64)
+    quantize  -- None, 'float16' or 'int8' (default: None)
+
+    @return path of the flat file
+
+    """
+    import json
+    if flat_path is None:
+        flat_path = flat_weights_path(weights_path, quantize=quantize)
+
+    def _write(out, arr, offset):
+        pad = (-offset) % align
+        out.write(b'\0' * pad)
+        offset += pad
+        out.write(arr.tobytes())
+        return offset, offset + arr.nbytes
+    layers = []
+    offset = 0
+    with h5py.File(weights_path, 'r') as f, open(flat_path, 'wb') as out:
+        if 'layer_names' in f.attrs:
+            # format of Keras 1 model.save_weights, only layers
+            # with weights are matched while loading
+            fmt = 'filtered'
+            groups = []
+            for name in f.attrs['layer_names']:
+                g = f[_h5_str(name)]
+                wnames = [_h5_str(n) for n in g.attrs['weight_names']]
+                if len(wnames) > 0:
+                    groups.append([g[n] for n in wnames])
+        else:
+            fmt = 'layers'
+            groups = []
+            for k in range(f.attrs['nb_layers']):
+                g = f['layer_{}'.format(k)]
+                groups.append([g['param_{}'.format(p)]
+                               for p in range(g.attrs['nb_params'])])
+        for params in groups:
+            index = []
+            for ds in params:
+                arr = np.ascontiguousarray(ds[()])
+                w = {'shape': list(arr.shape), 'dtype': arr.dtype.str}
+                if quantize is not None:
+                    arr, scale, axis = quantize_weight(arr, quantize)
+                    w['stored_dtype'] = arr.dtype.str
+                    if scale is not None:
+                        start, offset = _write(out, scale, offset)
+                        w['scale_offset'] = start
+                        w['axis'] = axis
+                start, offset = _write(out, np.ascontiguousarray(arr),
+                                       offset)
+                w['offset'] = start
+                index.append(w)
+            layers.append(index)
+    st = os.stat(weights_path)
+    meta = {'version': 1, 'format': fmt, 'layers': layers,
+            'quantize': quantize,
+            'source_size': st.st_size, 'source_mtime': st.st_mtime}
+    with open(flat_path + '.json', 'w') as f:
+        json.dump(meta, f)
+    print('[keras_models] %s is converted to %s' % (weights_path, flat_path))
+    return flat_path
+
+
+def is_flat_fresh(weights_path, flat_path):
+    """ Check if flat_path is converted from the current weights_path"""
+
+    import json
+    if not os.path.isfile(flat_path) or \
+            not os.path.isfile(flat_path + '.json'):
+        return False
+    with open(flat_path + '.json') as f:
+        meta = json.load(f)
+    st = os.stat(weights_path)
+    return meta.get('source_size') == st.st_size and \
+        meta.get('source_mtime') == st.st_mtime
+
+
+def read_flat_weights(flat_path):
+    """ Map a flat weight file written by convert_weights to memory
+
+    @param flat_path: path of the flat file
+
+    @return list of weight arrays per layer (read-only views of the
+            memory map, or dequantized copies for quantized arrays),
+            format of the source file
+
+    """
+    import json
+    with open(flat_path + '.json') as f:
+        meta = json.load(f)
+    mm = np.memmap(flat_path, dtype=np.uint8, mode='r')
+    layers = []
+    for index in meta['layers']:
+        ws = []
+        for w in index:
+            shape = tuple(w['shape'])
+            dtype = np.dtype(w['dtype'])
+            stored = np.dtype(w.get('stored_dtype', w['dtype']))
+            arr = np.ndarray(shape, dtype=stored, buffer=mm,
+                             offset=w['offset'])
+            if stored != dtype:
+                scale = None
+                if 'scale_offset' in w:
+                    scale = np.ndarray((shape[w['axis']],),
+                                       dtype=np.float32, buffer=mm,
+                                       offset=w['scale_offset'])
+                arr = dequantize_weight(arr, scale, w.get('axis'), dtype)
+            ws.append(arr)
+        layers.append(ws)
+    return layers, meta['format']
+
+
+def load_flat_weights(model, flat_path, lastFC=True):
+    """ Load model weights from a flat file written by convert_weights
+
+    @param model: the model
+    @param flat_path: path of the flat file
+
+    Arguments:
+
+    lastFC -- True to load weights for all layers, False to load only
+              the layers the model has (default: True)
+
+    """
+    layers, fmt = read_flat_weights(flat_path)
+    if fmt == 'filtered':
+        targets = [l for l in model.layers if l.weights]
+    else:
+        targets = model.layers
+    if lastFC and len(layers) != len(targets):
+        raise Exception('You are trying to load a weight file containing '
+                        '%i layers into a model with %i layers.'
+                        % (len(layers), len(targets)))
+    for k, ws in enumerate(layers):
+        if k >= len(targets):
+            break
+        targets[k].set_weights(ws)
+    return
+
+
+def quantization_report(build_model, weights_path, X, batch_size=32,
+                        modes=('float16', 'int8')):
+    """ Compare quantized flat files with the original weights
+
+    @param build_model: function returning the model without weights,
+                        e.g. VGG_16
+    @param weights_path: path of the HDF5 weight file
+    @param X: sample inputs of the model
+
+    Arguments:
+
+    batch_size -- batch size of model.predict (default: 32)
+    modes      -- quantizations to compare (default: float16 and int8)
+
+    @return list of dictionaries of mode, size (MB), load time (s),
+            top-1 agreement and max absolute difference of the outputs
+            compared to the original weights
+
+    """
+    import time
+    model = build_model()
+    t0 = time.time()
+    load_weights(model, weights_path)
+    t_load = time.time() - t0
+    ref = model.predict(X, batch_size=batch_size)
+    report = [{'mode': 'hdf5', 'size': os.path.getsize(weights_path) / 1e6,
+               'load_time': t_load, 'top1_agreement': 1.0,
+               'max_abs_diff': 0.0}]
+    for mode in (None,) + tuple(modes):
+        flat_path = flat_weights_path(weights_path, quantize=mode)
+        if not is_flat_fresh(weights_path, flat_path):
+            convert_weights(weights_path, flat_path, quantize=mode)
+        t0 = time.time()
+        load_flat_weights(model, flat_path)
+        t_load = time.time() - t0
+        out = model.predict(X, batch_size=batch_size)
+        report.append({
+            'mode': mode or 'float32',
+            'size': os.path.getsize(flat_path) / 1e6,
+            'load_time': t_load,
+            'top1_agreement': float(np.mean(
+                out.argmax(axis=1) == ref.argmax(axis=1))),
+            'max_abs_diff': float(np.abs(out - ref).max())})
+    print('[keras_models] %-8s %10s %10s %8s %12s'
+          % ('mode', 'size (MB)', 'load (s)', 'top-1', 'max |diff|'))
+    for r in report:
+        print('[keras_models] %-8s %10.1f %10.3f %8.4f %12.2e'
+              % (r['mode'], r['size'], r['load_time'],
+                 r['top1_agreement'], r['max_abs_diff']))
+    return report
+
+
 def Simple(cats, img_row=224, img_col=224, conv_size=3,
            colors=3, weights_path=None, filter_size=32):
     '''Simple conv model to the best MNIST result.
@@ -1,7 +1,9 @@
 import os
 import sys
 import time
+import pickle
 import logging
+import contextlib
 import numpy as np
 from simdat.core import tools
 from simdat.core import args
@@ -47,6 +49,18 @@ class MLArgs(args.Args):
         self.random = 42
         self.outd = './'
         self.multiclass = None
+        self.search = 'grid'
+        self.halving_factor = 3
+        self.halving_min_samples = None
+        self.mmap = False
+        self.mmap_min_size = 65536
+        self.registry = False
+        self.predict_chunk = 10000
+        self.predict_jobs = 1
+        self.predict_backend = 'auto'
+        self.metrics = False
+        self.metrics_trace = False
+        self.metrics_model_size = True
 
     def tune_args_for_data(self, N):
         """Tunning args right before training is applied
@@ -71,6 +85,10 @@ class NeighborsArgs(MLArgs):
         self.radius = 0
         self.more = False
         self.n_neighbors = None
+        self.nlist = None
+        self.nprobe = 8
+        self.target_recall = 0.95
+        self.graph_search = True
 
     def _tune_args(self):
         """Tune args after running _set_srgs"""
@@ -82,6 +100,10 @@ class NeighborsArgs(MLArgs):
                        'algorithm': [self.algorithm],
                        'leaf_size': [20, 30, 40],
                        'p': [1, 2, 3]}]
+        if self.algorithm == 'ivf':
+            self.radius = 0
+            self.grids = [{'weights': ['uniform', 'distance'],
+                           'nprobe': [self.nprobe]}]
         if self.radius > 0:
             self.get_prob = False
         if self.n_neighbors is not None:
@@ -105,7 +127,7 @@ class NeighborsArgs(MLArgs):
                     k = int(math.sqrt(N))
                 vec = np.arange(0.5 * k, 1.5 * k, int(k/4), dtype=int)
                 self.grids[0]['n_neighbors'] = list(vec)
-            del self.grids[0]['radius']
+            self.grids[0].pop('radius', None)
 
         else:
             if self.radius == -1:
@@ -142,6 +164,8 @@ class RFArgs(MLArgs):
 
         self._add_ml_args()
         self.extreme = True
+        self.warm_start = True
+        self.oob = False
         self.grids = [{'criterion': ['gini', 'entropy'],
                        'bootstrap': [True, False],
                        'random_state': [None, 1, 64],
@@ -162,6 +186,8 @@ class SVMArgs(MLArgs):
         self.kernel = 'rbf'
         self.degree = 3
         self.C = [0.1, 1, 10, 100, 1000]
+        self.precompute = True
+        self.kernel_memory = 2048
 
     def _tune_args(self):
         """Tune args after running _set_srgs"""
@@ -201,6 +227,1888 @@ class SVMArgs(MLArgs):
                 self.grids[i]['C'] = deepcopy(self.C)
 
 
+class IncrementalArgs(MLArgs):
+    def _add_args(self):
+        """Function to add additional arguments"""
+
+        self._add_incremental_args()
+
+    def _add_incremental_args(self):
+        """Add additional arguments for IncrementalRun class"""
+
+        self._add_ml_args()
+        self.method = 'SGD'
+        self.parms = {}
+        self.classes = None
+        self.chunk_size = 10000
+        self.nb_epoch = 1
+        self.shuffle = True
+        self.checkpoint = 10
+        self.resume = False
+        self.source_format = 'auto'
+        self.target_col = -1
+        self.delimiter = ','
+        self.skip_header = 0
+        self.nfeatures = None
+        self.dtype = 'float32'
+
+
+class FeatureStore(object):
+    def __init__(self, path, ncomp=256, method='random', fit_size=None,
+                 seed=42):
+        """On-disk store of dimension-reduced features and their labels
+
+        Features are appended one sample (or a batch) at a time,
+        projected by the reducer and written as float32 rows to
+        path/features.dat, so memory does not grow with the number of
+        samples. Labels, the fitted reducer and meta data are written
+        to the same directory by close().
+
+        IncrementalPCA is updated with partial_fit on every ncomp
+        buffered samples until fit_size samples are seen. Samples seen
+        while fitting are spilled to path/fit_spill.dat and projected
+        once the fit is done.
+
+        @param path: directory of the store
+
+        Keyword arguments:
+        ncomp    -- number of reduced dimensions (default: 256)
+        method   -- 'random' for sparse random projection or
+                    'ipca' for IncrementalPCA (default: random)
+        fit_size -- number of samples used to fit IncrementalPCA
+                    (default: 10 * ncomp)
+        seed     -- random seed of the projection (default: 42)
+
+        """
+        self.path = path
+        self.ncomp = ncomp
+        self.method = method
+        self.fit_size = fit_size if fit_size is not None else 10 * ncomp
+        self.seed = seed
+        self.reducer = None
+        self.labels = []
+        self.count = 0
+        self.nfit = 0
+        self._fitted = False
+        self._buffer = []
+        self._buffer_labels = []
+        self._spill = None
+        self._spill_labels = []
+        self._nspill = 0
+        io.dir_check(path)
+        self.fdata = os.path.join(path, 'features.dat')
+        self.flabels = os.path.join(path, 'labels.npy')
+        self.freducer = os.path.join(path, 'reducer.pkl')
+        self.fmeta = os.path.join(path, 'meta.json')
+        self.fspill = os.path.join(path, 'fit_spill.dat')
+        self._f = open(self.fdata, 'wb')
+
+    @classmethod
+    def load(cls, path):
+        """Open an existing store for reading
+
+        @param path: directory of the store
+
+        """
+        meta = io.parse_json(os.path.join(path, 'meta.json'))
+        store = cls.__new__(cls)
+        store.__dict__.update(meta)
+        store.path = path
+        store.fdata = os.path.join(path, 'features.dat')
+        store.flabels = os.path.join(path, 'labels.npy')
+        store.freducer = os.path.join(path, 'reducer.pkl')
+        store.fmeta = os.path.join(path, 'meta.json')
+        store.reducer = None
+        store.labels = list(np.load(store.flabels))
+        store._fitted = True
+        store._f = None
+        return store
+
+    def fit(self, X):
+        """Fit the reducer, IncrementalPCA is updated with partial_fit
+           so it can be called once per batch of samples
+
+        @param X: samples in (n, nfeatures), only the shape is used
+                  for the random projection
+
+        """
+        from sklearn import decomposition
+        from sklearn import random_projection
+        X = np.atleast_2d(X)
+        if self.method == 'ipca':
+            if self.reducer is None:
+                self.reducer = decomposition.IncrementalPCA(
+                    n_components=self.ncomp)
+            self.reducer.partial_fit(X)
+        else:
+            self.reducer = random_projection.SparseRandomProjection(
+                n_components=self.ncomp, dense_output=True,
+                random_state=self.seed)
+            self.reducer.fit(X[:1])
+        return self.reducer
+
+    def transform(self, X):
+        """Project samples with the fitted reducer"""
+
+        if self.reducer is None:
+            self.reducer = self.read_reducer()
+        X = np.atleast_2d(X)
+        return np.asarray(self.reducer.transform(X), dtype=np.float32)
+
+    def append(self, x, y):
+        """Reduce and write one sample, or a batch of samples
+
+        @param x: feature vector, or samples in (n, nfeatures)
+        @param y: label of the sample, or a list of labels
+
+        """
+        X = np.atleast_2d(x)
+        Y = list(y) if X.shape[0] > 1 or np.ndim(y) > 0 else [y]
+        if not self._fitted:
+            if self.method != 'ipca':
+                self.fit(X)
+                self._fitted = True
+            else:
+                self._buffer.append(X.astype(np.float32))
+                self._buffer_labels += Y
+                if sum([b.shape[0] for b in self._buffer]) >= self.ncomp:
+                    self._partial_fit()
+                return
+        self._write(self.transform(X), Y)
+
+    def _partial_fit(self, update=True):
+        """Update IncrementalPCA with the buffered samples and spill
+           them to disk, until fit_size samples are seen
+
+        Keyword arguments:
+        update -- False to only spill the samples (default: True)
+
+        """
+        if len(self._buffer) == 0:
+            return
+        X = np.vstack(self._buffer)
+        self._buffer = []
+        if update:
+            self.fit(X)
+            self.nfit += X.shape[0]
+        if self._spill is None:
+            self._spill = open(self.fspill, 'wb')
+        self._spill.write(np.ascontiguousarray(X).tobytes())
+        self._spill_labels += self._buffer_labels
+        self._buffer_labels = []
+        self._nspill += X.shape[0]
+        if self.nfit >= self.fit_size:
+            self._finish_fit()
+
+    def _finish_fit(self):
+        """Project the spilled samples with the fitted reducer"""
+
+        self._fitted = True
+        if self._spill is None:
+            return
+        self._spill.close()
+        self._spill = None
+        nfeatures = self.reducer.components_.shape[1]
+        spill = np.memmap(self.fspill, dtype='float32', mode='r',
+                          shape=(self._nspill, nfeatures))
+        for start in range(0, self._nspill, self.ncomp):
+            end = start + self.ncomp
+            self._write(self.transform(spill[start:end]),
+                        self._spill_labels[start:end])
+        del spill
+        os.remove(self.fspill)
+        self._spill_labels = []
+        self._nspill = 0
+
+    def _write(self, X, Y):
+        """Write reduced samples to the data file"""
+
+        self._f.write(np.ascontiguousarray(X, dtype=np.float32).tobytes())
+        self.labels += Y
+        self.count += X.shape[0]
+
+    def close(self):
+        """Flush the data file and write labels, reducer and meta data"""
+
+        if not self._fitted:
+            # too few samples are left to update the fitted reducer
+            self._partial_fit(update=self.reducer is None)
+            if not self._fitted:
+                self._finish_fit()
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        np.save(self.flabels, np.array(self.labels))
+        with open(self.freducer, 'wb') as f:
+            pickle.dump(self.reducer, f, protocol=pickle.HIGHEST_PROTOCOL)
+        io.write_json({'ncomp': self.ncomp, 'method': self.method,
+                       'count': self.count, 'seed': self.seed,
+                       'fit_size': self.fit_size, 'nfit': self.nfit},
+                      fname=self.fmeta)
+        print('[ML] %i samples of %i features are stored in %s'
+              % (self.count, self.ncomp, self.path))
+
+    def read_reducer(self):
+        """Read the fitted reducer, used to transform new data"""
+
+        with open(self.freducer, 'rb') as f:
+            return pickle.load(f)
+
+    def data(self):
+        """Return features as a read-only np.memmap in (count, ncomp)"""
+
+        return np.memmap(self.fdata, dtype='float32', mode='r',
+                         shape=(self.count, self.ncomp))
+
+    def target(self):
+        """Return labels as np.ndarray"""
+
+        return np.array(self.labels)
+
+
+class _RowView(object):
+    def __init__(self, data, index):
+        """Rows of data selected by index, read only when sliced
+
+        @param data: np.ndarray or np.memmap
+        @param index: indexes of the selected rows
+
+        """
+        self.data = data
+        self.index = index
+        self.shape = (len(index),) + tuple(data.shape[1:])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        return self.data[self.index[key]]
+
+
+class ChunkReader(object):
+    def __init__(self, source, target=None, fmt='auto', chunk_size=10000,
+                 target_col=-1, delimiter=',', skip_header=0,
+                 nfeatures=None, dtype='float32'):
+        """Read a dataset chunk by chunk without loading it in memory
+
+        Iterating the reader yields (data, target) chunks of at most
+        chunk_size rows, in the same order every time, so it can be
+        iterated once per epoch.
+
+        @param source: path of a CSV or svmlight file, a .npy file,
+                       a FeatureStore (or its directory), or an array
+                       (np.memmap) of samples
+
+        Keyword arguments:
+        target      -- array or .npy path of the labels, if None the
+                       target_col column of source is used, ignored for
+                       svmlight and FeatureStore sources (default: None)
+        fmt         -- csv/svmlight/npy/store/array or auto to guess
+                       from the source (default: auto)
+        chunk_size  -- number of rows per chunk (default: 10000)
+        target_col  -- column of the labels (default: -1)
+        delimiter   -- delimiter of CSV files (default: ',')
+        skip_header -- number of lines to skip in CSV files (default: 0)
+        nfeatures   -- number of features, required by svmlight files
+                       (default: None)
+        dtype       -- dtype of the data chunks (default: float32)
+
+        """
+        self.source = source
+        self.target = target
+        self.fmt = self._guess_format(source) if fmt == 'auto' else fmt
+        self.chunk_size = chunk_size
+        self.target_col = target_col
+        self.delimiter = delimiter
+        self.skip_header = skip_header
+        self.nfeatures = nfeatures
+        self.dtype = dtype
+        if self.fmt == 'svmlight' and nfeatures is None:
+            raise Exception("nfeatures must be set for svmlight files")
+
+    def _guess_format(self, source):
+        """Guess the format of the source"""
+
+        if isinstance(source, FeatureStore):
+            return 'store'
+        if hasattr(source, 'shape'):
+            return 'array'
+        if os.path.isdir(source):
+            return 'store'
+        ext = os.path.splitext(source)[1].lower()
+        if ext == '.npy':
+            return 'npy'
+        if ext in ['.svm', '.svmlight', '.libsvm']:
+            return 'svmlight'
+        return 'csv'
+
+    def _split_target(self, data):
+        """Split the target_col column from the data"""
+
+        col = self.target_col % data.shape[1]
+        cols = [i for i in range(data.shape[1]) if i != col]
+        return data[:, cols], data[:, col]
+
+    def _read_arrays(self, data, target):
+        """Yield chunks of in-memory or memory-mapped arrays"""
+
+        for start in range(0, data.shape[0], self.chunk_size):
+            X = np.asarray(data[start:start + self.chunk_size])
+            if target is None:
+                X, y = self._split_target(X)
+            else:
+                y = np.asarray(target[start:start + self.chunk_size])
+            yield X.astype(self.dtype, copy=False), y
+
+    def _read_csv(self):
+        """Yield chunks of a CSV file"""
+
+        import pandas as pd
+        for df in pd.read_csv(self.source, header=None,
+                              sep=self.delimiter,
+                              skiprows=self.skip_header,
+                              chunksize=self.chunk_size):
+            col = self.target_col % df.shape[1]
+            y = df.iloc[:, col].values
+            X = df.drop(df.columns[col], axis=1).values
+            yield X.astype(self.dtype), y
+
+    def _read_svmlight(self):
+        """Yield chunks of a svmlight file as sparse matrices"""
+
+        from io import BytesIO
+        from itertools import islice
+        from sklearn.datasets import load_svmlight_file
+        with open(self.source, 'rb') as f:
+            while True:
+                lines = list(islice(f, self.chunk_size))
+                if len(lines) == 0:
+                    break
+                X, y = load_svmlight_file(BytesIO(b''.join(lines)),
+                                          n_features=self.nfeatures,
+                                          dtype=np.dtype(self.dtype))
+                yield X, y
+
+    def __iter__(self):
+        if self.fmt == 'csv':
+            return self._read_csv()
+        if self.fmt == 'svmlight':
+            return self._read_svmlight()
+        if self.fmt == 'store':
+            store = self.source
+            if not isinstance(store, FeatureStore):
+                store = FeatureStore.load(store)
+            return self._read_arrays(store.data(), store.target())
+        target = self.target
+        if target is not None and not hasattr(target, 'shape'):
+            target = np.load(target, mmap_mode='r')
+        if self.fmt == 'npy':
+            return self._read_arrays(np.load(self.source, mmap_mode='r'),
+                                     target)
+        return self._read_arrays(self.source, target)
+
+
+class IVFIndex(object):
+    def __init__(self, nlist=None, nprobe=8, train_size=64,
+                 random_state=42):
+        """Approximate nearest neighbor index with inverted lists
+
+        Vectors are assigned to the nearest of nlist k-means centroids
+        and stored sorted by list. A query only scans the nprobe lists
+        of its nearest centroids. Distances are euclidean.
+
+        Keyword arguments:
+        nlist        -- number of lists (default: 4 * sqrt(N))
+        nprobe       -- number of lists scanned per query (default: 8)
+        train_size   -- samples per list used to train the centroids
+                        (default: 64)
+        random_state -- random seed (default: 42)
+
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_size = train_size
+        self.random_state = random_state
+        self.centroids = None
+        self._reset_pending()
+
+    def _reset_pending(self):
+        self._pending = {'data': [], 'labels': [], 'ids': []}
+
+    def _assign(self, X, chunk=8192):
+        """Return the nearest centroid of each row"""
+
+        cnorms = (self.centroids ** 2).sum(axis=1)
+        out = np.empty(X.shape[0], dtype=np.int64)
+        for i in range(0, X.shape[0], chunk):
+            D = cnorms - 2 * np.dot(X[i:i + chunk], self.centroids.T)
+            out[i:i + chunk] = D.argmin(axis=1)
+        return out
+
+    def _store(self, X, labels, ids):
+        """Sort the vectors by list and build the offsets"""
+
+        assign = self._assign(X)
+        order = np.argsort(assign, kind='mergesort')
+        self.data = np.ascontiguousarray(X[order])
+        self.norms = (self.data ** 2).sum(axis=1)
+        self.labels = None if labels is None else labels[order]
+        self.ids = ids[order]
+        counts = np.bincount(assign, minlength=len(self.centroids))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def fit(self, X, y=None):
+        """Train the centroids and add the vectors
+
+        @param X: vectors in (N, nfeatures)
+
+        Keyword arguments:
+        y -- labels stored with the vectors (default: None)
+
+        """
+        from sklearn.cluster import MiniBatchKMeans
+        X = np.asarray(X, dtype=np.float32)
+        nlist = self.nlist
+        if nlist is None:
+            nlist = int(4 * np.sqrt(X.shape[0]))
+        nlist = max(1, min(nlist, X.shape[0]))
+        rng = np.random.RandomState(self.random_state)
+        size = min(X.shape[0], self.train_size * nlist)
+        sample = X[np.sort(rng.choice(X.shape[0], size, replace=False))]
+        km = MiniBatchKMeans(n_clusters=nlist, n_init=1,
+                             batch_size=max(1024, 4 * nlist),
+                             random_state=self.random_state)
+        self.centroids = km.fit(sample).cluster_centers_.astype(np.float32)
+        self._reset_pending()
+        labels = None if y is None else np.asarray(y)
+        self._store(X, labels, np.arange(X.shape[0]))
+        return self
+
+    @property
+    def size(self):
+        return self.data.shape[0] + sum([len(i) for i in
+                                         self._pending['ids']])
+
+    def add(self, X, y=None):
+        """Insert vectors, they are scanned exhaustively until merge()
+
+        @param X: vectors in (n, nfeatures)
+
+        Keyword arguments:
+        y -- labels of the vectors (default: None)
+
+        @return ids of the vectors
+
+        """
+        X = np.asarray(X, dtype=np.float32)
+        ids = np.arange(self.size, self.size + X.shape[0])
+        self._pending['data'].append(X)
+        self._pending['ids'].append(ids)
+        if y is not None:
+            self._pending['labels'].append(np.asarray(y))
+        if self.size - self.data.shape[0] > 0.1 * self.data.shape[0]:
+            self.merge()
+        return ids
+
+    def merge(self):
+        """Move the inserted vectors into the inverted lists"""
+
+        if len(self._pending['ids']) == 0:
+            return
+        X = np.vstack([self.data] + self._pending['data'])
+        labels = None
+        if self.labels is not None:
+            labels = np.concatenate([self.labels] +
+                                    self._pending['labels'])
+        ids = np.concatenate([self.ids] + self._pending['ids'])
+        self._reset_pending()
+        self._store(X, labels, ids)
+
+    def _probe(self, Q, nprobe):
+        """Return the nprobe nearest lists of each query"""
+
+        nprobe = min(nprobe, len(self.centroids))
+        D = (self.centroids ** 2).sum(axis=1) - \
+            2 * np.dot(Q, self.centroids.T)
+        if nprobe == len(self.centroids):
+            return np.tile(np.arange(nprobe), (Q.shape[0], 1))
+        return np.argpartition(D, nprobe - 1, axis=1)[:, :nprobe]
+
+    def _merge_top(self, best_d, best_i, D, idx, k):
+        """Keep the k nearest of the current best and the new candidates"""
+
+        cand_d = np.hstack([best_d, D])
+        cand_i = np.hstack([best_i, np.broadcast_to(idx, D.shape)])
+        if cand_d.shape[1] > k:
+            sel = np.argpartition(cand_d, k - 1, axis=1)[:, :k]
+            rows = np.arange(cand_d.shape[0])[:, None]
+            cand_d = cand_d[rows, sel]
+            cand_i = cand_i[rows, sel]
+        return cand_d, cand_i
+
+    def search(self, Q, k=5, nprobe=None):
+        """Search the k nearest neighbors of the queries
+
+        @param Q: queries in (nq, nfeatures)
+
+        Keyword arguments:
+        k      -- number of neighbors (default: 5)
+        nprobe -- lists scanned per query (default: self.nprobe)
+
+        @return distances, ids and labels (None if not stored) of the
+                neighbors in (nq, k), missing neighbors have id -1
+
+        """
+        Q = np.atleast_2d(np.asarray(Q, dtype=np.float32))
+        nprobe = self.nprobe if nprobe is None else nprobe
+        nq = Q.shape[0]
+        best_d = np.full((nq, k), np.inf, dtype=np.float32)
+        best_i = np.full((nq, k), -1, dtype=np.int64)
+
+        # group the queries by the lists they probe
+        probes = self._probe(Q, nprobe).ravel()
+        qrows = np.repeat(np.arange(nq), len(probes) // nq)
+        order = np.argsort(probes, kind='mergesort')
+        lists, starts = np.unique(probes[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for l, a, b in zip(lists, starts, ends):
+            start, end = self.offsets[l], self.offsets[l + 1]
+            if start == end:
+                continue
+            q = qrows[order[a:b]]
+            D = self.norms[start:end] - \
+                2 * np.dot(Q[q], self.data[start:end].T)
+            best_d[q], best_i[q] = self._merge_top(
+                best_d[q], best_i[q], D, np.arange(start, end), k)
+
+        ndata = self.data.shape[0]
+        if len(self._pending['ids']) > 0:
+            P = np.vstack(self._pending['data'])
+            D = (P ** 2).sum(axis=1) - 2 * np.dot(Q, P.T)
+            best_d, best_i = self._merge_top(
+                best_d, best_i, D, np.arange(ndata, ndata + len(P)), k)
+
+        order = np.argsort(best_d, axis=1)
+        rows = np.arange(nq)[:, None]
+        best_d = best_d[rows, order]
+        best_i = best_i[rows, order]
+        missing = best_i < 0
+        dist = np.sqrt(np.maximum(best_d + (Q ** 2).sum(axis=1)[:, None],
+                                  0))
+        dist[missing] = np.inf
+        ids = self._lookup(self.ids, self._pending['ids'], best_i)
+        labels = None
+        if self.labels is not None:
+            labels = self._lookup(self.labels, self._pending['labels'],
+                                  best_i)
+        return dist, ids, labels
+
+    def _lookup(self, base, pending, idx):
+        """Return base (then pending) values at the positions idx"""
+
+        values = base
+        if len(pending) > 0:
+            values = np.concatenate([base] + pending)
+        out = values[np.maximum(idx, 0)]
+        if out.dtype.kind in 'iu':
+            out[idx < 0] = -1
+        return out
+
+    def tune(self, Q, k=10, target_recall=0.95, nprobes=None):
+        """Set nprobe to the smallest value whose recall@k of the sample
+           queries reaches target_recall
+
+        @param Q: sample queries in (nq, nfeatures)
+
+        Keyword arguments:
+        k             -- number of neighbors (default: 10)
+        target_recall -- recall to reach (default: 0.95)
+        nprobes       -- nprobe values to try (default: powers of 2)
+
+        @return list of (nprobe, recall, ms per query)
+
+        """
+        nlist = len(self.centroids)
+        if nprobes is None:
+            nprobes = [2 ** i for i in range(int(np.log2(nlist)) + 1)]
+        exact = self.search(Q, k=k, nprobe=nlist)[1]
+        report = []
+        for nprobe in sorted(nprobes):
+            t0 = time.time()
+            ids = self.search(Q, k=k, nprobe=nprobe)[1]
+            ms = 1000. * (time.time() - t0) / len(Q)
+            recall = np.mean([len(np.intersect1d(a, b)) / float(k)
+                              for a, b in zip(ids, exact)])
+            report.append((nprobe, recall, ms))
+            print('[ML] nprobe %i: recall@%i %0.4f, %0.3f ms per query'
+                  % (nprobe, k, recall, ms))
+            if recall >= target_recall:
+                break
+        self.nprobe = report[-1][0]
+        return report
+
+    def __getstate__(self):
+        self.merge()
+        return self.__dict__
+
+
+class ANNClassifier(object):
+    _estimator_type = 'classifier'
+
+    def __init__(self, n_neighbors=5, weights='uniform', nlist=None,
+                 nprobe=8, random_state=42):
+        """k-NN classifier on an IVFIndex, with the sklearn estimator API
+
+        Keyword arguments:
+        n_neighbors  -- number of neighbors (default: 5)
+        weights      -- uniform or distance (default: uniform)
+        nlist        -- number of lists of the index (default: 4*sqrt(N))
+        nprobe       -- lists scanned per query (default: 8)
+        random_state -- random seed of the index (default: 42)
+
+        """
+        self.n_neighbors = n_neighbors
+        self.weights = weights
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.random_state = random_state
+
+    def get_params(self, deep=True):
+        return {'n_neighbors': self.n_neighbors, 'weights': self.weights,
+                'nlist': self.nlist, 'nprobe': self.nprobe,
+                'random_state': self.random_state}
+
+    def __sklearn_tags__(self):
+        # sklearn >= 1.6 reads tags instead of _estimator_type
+        from sklearn.utils import ClassifierTags, Tags, TargetTags
+        return Tags(estimator_type='classifier',
+                    target_tags=TargetTags(required=True),
+                    classifier_tags=ClassifierTags())
+
+    def set_params(self, **params):
+        for k, v in params.items():
+            setattr(self, k, v)
+        if 'nprobe' in params and hasattr(self, 'index_'):
+            self.index_.nprobe = params['nprobe']
+        return self
+
+    def fit(self, X, y):
+        """Build the index of the training data"""
+
+        self.classes_, y = np.unique(y, return_inverse=True)
+        self.index_ = IVFIndex(nlist=self.nlist, nprobe=self.nprobe,
+                               random_state=self.random_state)
+        self.index_.fit(X, y)
+        return self
+
+    def partial_fit(self, X, y):
+        """Insert samples, labels must be in classes_"""
+
+        y = np.asarray(y)
+        pos = np.searchsorted(self.classes_, y)
+        pos = np.minimum(pos, len(self.classes_) - 1)
+        if not (self.classes_[pos] == y).all():
+            raise Exception("Labels of partial_fit must be in classes_")
+        self.index_.add(X, pos)
+        return self
+
+    def tune(self, X, target_recall=0.95):
+        """Tune nprobe of the index with sample queries X"""
+
+        self.index_.tune(X, k=self.n_neighbors,
+                         target_recall=target_recall)
+        self.nprobe = self.index_.nprobe
+        return self
+
+    def kneighbors(self, X, n_neighbors=None):
+        """Return distances and ids of the neighbors"""
+
+        k = self.n_neighbors if n_neighbors is None else n_neighbors
+        dist, ids, labels = self.index_.search(X, k=k)
+        return dist, ids
+
+    def predict_proba(self, X):
+        dist, ids, labels = self.index_.search(X, k=self.n_neighbors)
+        if self.weights == 'distance':
+            with np.errstate(divide='ignore'):
+                w = 1. / dist
+            exact = np.isinf(w)
+            w[exact.any(axis=1)] = exact[exact.any(axis=1)]
+        else:
+            w = np.ones(dist.shape)
+        w[ids < 0] = 0
+        proba = np.zeros((len(dist), len(self.classes_)))
+        rows = np.repeat(np.arange(len(dist)), dist.shape[1])
+        np.add.at(proba, (rows, np.maximum(labels, 0).ravel()), w.ravel())
+        norm = proba.sum(axis=1)[:, None]
+        norm[norm == 0] = 1
+        return proba / norm
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+    def score(self, X, y):
+        return np.mean(self.predict(X) == np.asarray(y))
+
+
+class HalvingSearchCV(object):
+    def __init__(self, estimator, grids, factor=3, hyperband=False,
+                 nfolds=5, min_samples=None, n_jobs=1, random_state=42,
+                 verbose=0):
+        """Successive halving (or hyperband) search over the same grid
+           definitions as GridSearchCV
+
+        All candidates are scored with KFold on a small stratified
+        subset of the data, only the best 1/factor of them survive to
+        a subset factor times larger, until the survivors are scored
+        on the full data. Subsets are nested, so samples seen by early
+        rungs are reused by later ones. Hyperband runs several such
+        brackets, from many candidates on small subsets to few
+        candidates on the full data, to hedge against rankings on
+        small subsets being wrong.
+
+        The fitted object has best_params_, best_score_ and a refitted
+        best_estimator_ like GridSearchCV, and results_ with the score
+        of every candidate at every rung.
+
+        @param estimator: the sklearn estimator
+        @param grids: parameter grid(s), as args.grids
+
+        Keyword arguments:
+        factor       -- fraction 1/factor of candidates kept per rung
+                        (default: 3)
+        hyperband    -- True to run hyperband brackets (default: False)
+        nfolds       -- number of folds used at every rung (default: 5)
+        min_samples  -- smallest subset size
+                        (default: 2 * nfolds * number of classes)
+        n_jobs       -- number of jobs of cross_val_score (default: 1)
+        random_state -- seed of the subsets and hyperband sampling
+                        (default: 42)
+        verbose      -- verbose level of cross_val_score (default: 0)
+
+        """
+        self.estimator = estimator
+        self.grids = grids
+        self.factor = factor
+        self.hyperband = hyperband
+        self.nfolds = nfolds
+        self.min_samples = min_samples
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.verbose = verbose
+        self.recorder = None
+        self.results_ = []
+
+    def _order(self, target, rng):
+        """Order samples so that every prefix is stratified"""
+
+        N = len(target)
+        perm = rng.permutation(N)
+        classes, inv = np.unique(np.asarray(target)[perm],
+                                 return_inverse=True)
+        counts = np.bincount(inv)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        by_class = np.argsort(inv, kind='mergesort')
+        rank = np.empty(N)
+        rank[by_class] = np.arange(N) - starts[inv[by_class]]
+        key = (rank + 0.5) / counts[inv]
+        return perm[np.argsort(key, kind='mergesort')], len(classes)
+
+    def _score(self, parms, data, target, idx, rung):
+        from sklearn import cross_validation
+        from sklearn.base import clone
+        est = clone(self.estimator).set_params(**parms)
+        cv = cross_validation.KFold(len(idx), n_folds=self.nfolds)
+        try:
+            if self.recorder is not None:
+                scores = [self.recorder.fit_score(
+                    clone(est), data[idx], target[idx], train, test, parms,
+                    fold, rung=rung) for fold, (train, test) in
+                    enumerate(cv)]
+            else:
+                scores = cross_validation.cross_val_score(
+                    est, data[idx], target[idx], cv=cv,
+                    n_jobs=self.n_jobs, verbose=self.verbose)
+            score = float(np.mean(scores))
+        except ValueError as e:
+            # e.g. a subset too small for the parameters
+            logging.debug('[ML] %s failed: %s' % (str(parms), str(e)))
+            score = -np.inf
+        self.results_.append({'params': parms, 'rung': rung,
+                              'n_samples': len(idx), 'score': score})
+        return score
+
+    def _halving(self, candidates, data, target, order, start):
+        """Run one bracket of successive halving
+
+        @param start: number of samples of the first rung
+
+        @return list of (score on the full data, parameters)
+
+        """
+        import math
+        N = len(order)
+        nrungs = 1 + max(0, int(round(math.log(N / float(start)) /
+                                      math.log(self.factor))))
+        for rung in range(nrungs):
+            if rung == nrungs - 1 or len(candidates) == 1:
+                size = N
+            else:
+                size = int(N / self.factor ** (nrungs - 1 - rung))
+            idx = order[:size]
+            scored = [(self._score(p, data, target, idx, rung), p)
+                      for p in candidates]
+            scored.sort(key=lambda s: -s[0])
+            print('[ML] Halving rung %i: %i candidates on %i samples, '
+                  'best score %.5f' % (rung, len(candidates), size,
+                                       scored[0][0]))
+            if size >= N:
+                return scored
+            nkeep = max(1, int(math.ceil(len(candidates) /
+                                         float(self.factor))))
+            candidates = [p for s, p in scored[:nkeep]]
+
+    def fit(self, data, target):
+        """Search the best parameters and refit on the full data
+
+        @param data: Input training data array (multi-dimensional np array)
+        @param target: Input training target array (1D np array)
+
+        """
+        import math
+        from sklearn.base import clone
+        from sklearn.grid_search import ParameterGrid
+        data = np.asarray(data)
+        target = np.asarray(target)
+        rng = np.random.RandomState(self.random_state)
+        candidates = list(ParameterGrid(self.grids))
+        order, nclasses = self._order(target, rng)
+        min_samples = self.min_samples or 2 * self.nfolds * nclasses
+        self.results_ = []
+        final = []
+        N = len(order)
+        if not self.hyperband:
+            nrungs = int(math.ceil(math.log(max(len(candidates), 1)) /
+                                   math.log(self.factor)))
+            start = max(min_samples, N / self.factor ** nrungs)
+            final = self._halving(candidates, data, target, order, start)
+        else:
+            smax = max(0, int(math.log(N / float(min_samples)) /
+                              math.log(self.factor)))
+            for s in range(smax, -1, -1):
+                n = int(math.ceil((smax + 1) / float(s + 1) *
+                                  self.factor ** s))
+                n = min(n, len(candidates))
+                pick = rng.choice(len(candidates), n, replace=False)
+                print('[ML] Hyperband bracket %i: %i candidates' % (s, n))
+                final += self._halving([candidates[i] for i in pick],
+                                       data, target, order,
+                                       N / self.factor ** s)
+        final.sort(key=lambda s: -s[0])
+        self.best_score_, self.best_params_ = final[0]
+        self.best_estimator_ = clone(self.estimator).set_params(
+            **self.best_params_)
+        with _measure(self.recorder, 'refit', self.best_params_,
+                      n_samples=len(data)) as rec:
+            self.best_estimator_.fit(data, target)
+            rec['model'] = self.best_estimator_
+        return self
+
+
+class KernelSearchCV(object):
+    def __init__(self, estimator, grids, cv, memory=2048, n_jobs=1,
+                 verbose=0):
+        """Grid search of SVC which computes every kernel matrix once
+           per (kernel parameters, fold) and reuses it for all C
+
+        Candidates of the grids are grouped by their kernel parameters
+        (kernel, gamma, degree, coef0). For every group and fold the
+        train and test Gram matrices are computed once and all C values
+        are fitted with kernel='precomputed'. The scores are the same
+        as GridSearchCV with iid=True (mean accuracy over the folds
+        weighted by the number of test samples) and the best
+        estimator is refitted with its original kernel, so it predicts
+        on the raw features.
+
+        If the Gram matrices of a fold do not fit in memory, the search
+        falls back to GridSearchCV.
+
+        @param estimator: the sklearn SVC
+        @param grids: parameter grid(s), as args.grids
+        @param cv: list of (train, test) indexes of the folds
+
+        Keyword arguments:
+        memory  -- budget of the Gram matrices in MB (default: 2048)
+        n_jobs  -- number of threads fitting the C values, also used
+                   by the GridSearchCV fallback (default: 1)
+        verbose -- verbose level of the GridSearchCV fallback
+                   (default: 0)
+
+        """
+        self.estimator = estimator
+        self.grids = grids
+        self.cv = list(cv)
+        self.memory = memory
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        self.recorder = None
+        self.results_ = []
+
+    def _gamma(self, gamma, data):
+        """Resolve gamma as SVC does for 'auto' and 'scale', data are
+           the training samples of the fold"""
+
+        if gamma in ['auto', 0.0, None]:
+            return 1.0 / data.shape[1]
+        if gamma == 'scale':
+            return 1.0 / (data.shape[1] * data.var())
+        return gamma
+
+    def _kernel(self, X, Y, kparms):
+        from sklearn.metrics.pairwise import pairwise_kernels
+        args = dict(kparms)
+        return pairwise_kernels(X, Y, metric=args.pop('kernel'), **args)
+
+    def _kernel_parms(self, parms, defaults):
+        """Parameters of the kernel function of a candidate, gamma is
+           resolved per fold by _gamma"""
+
+        kernel = parms.get('kernel', defaults['kernel'])
+        kparms = {'kernel': kernel}
+        if kernel != 'linear':
+            kparms['gamma'] = parms.get('gamma', defaults['gamma'])
+        if kernel in ['poly', 'sigmoid']:
+            kparms['coef0'] = parms.get('coef0', defaults['coef0'])
+        if kernel == 'poly':
+            kparms['degree'] = parms.get('degree', defaults['degree'])
+        return kparms
+
+    def _fit_score(self, parms, K_train, y_train, K_test, y_test, C,
+                   fold=None):
+        from sklearn.base import clone
+        est = clone(self.estimator).set_params(
+            kernel='precomputed', probability=False, C=C)
+        with _measure(self.recorder, 'fit', parms, fold,
+                      n_samples=len(y_train)) as rec:
+            est.fit(K_train, y_train)
+            rec['model'] = est
+        with _measure(self.recorder, 'score', parms, fold,
+                      n_samples=len(y_test)) as rec:
+            score = est.score(K_test, y_test)
+            rec['score'] = score
+        return parms, score
+
+    def fits_memory(self, nsamples):
+        """Check if the Gram matrices of the largest fold fit the budget
+
+        @param nsamples: number of training samples
+
+        """
+        ntrain = max([len(train) for train, test in self.cv])
+        return 8. * ntrain * nsamples / 1e6 <= self.memory
+
+    def fit(self, data, target):
+        """Search the best parameters and refit on the full data
+
+        @param data: Input training data array (multi-dimensional np array)
+        @param target: Input training target array (1D np array)
+
+        """
+        from sklearn.base import clone
+        from sklearn.grid_search import ParameterGrid
+        data = np.asarray(data, dtype=np.float64)
+        target = np.asarray(target)
+        if not self.fits_memory(len(data)):
+            from sklearn.grid_search import GridSearchCV
+            print('[ML] Gram matrices exceed %i MB, use GridSearchCV'
+                  % self.memory)
+            if self.recorder is not None:
+                clf = ProfiledSearchCV(self.estimator, self.grids, self.cv,
+                                       n_jobs=self.n_jobs)
+                clf.recorder = self.recorder
+            else:
+                clf = GridSearchCV(self.estimator, self.grids, cv=self.cv,
+                                   n_jobs=self.n_jobs,
+                                   verbose=self.verbose)
+            clf.fit(data, target)
+            self.best_params_ = clf.best_params_
+            self.best_score_ = clf.best_score_
+            self.best_estimator_ = clf.best_estimator_
+            return self
+
+        try:
+            from sklearn.externals.joblib import Parallel, delayed
+        except ImportError:
+            from joblib import Parallel, delayed
+        defaults = self.estimator.get_params()
+        groups = {}
+        for parms in ParameterGrid(self.grids):
+            kparms = self._kernel_parms(parms, defaults)
+            key = tuple(sorted(kparms.items()))
+            groups.setdefault(key, []).append(parms)
+
+        scores = {}
+        weights = [len(test) for train, test in self.cv]
+        # libsvm releases the GIL, threads share the Gram matrices
+        pool = Parallel(n_jobs=self.n_jobs, backend='threading')
+        for key, candidates in groups.items():
+            kparms = dict(key)
+            for fold, (train, test) in enumerate(self.cv):
+                X_train = data[train]
+                fparms = dict(kparms)
+                if 'gamma' in fparms:
+                    # SVC resolves 'scale' and 'auto' on its training set
+                    fparms['gamma'] = self._gamma(fparms['gamma'], X_train)
+                with _measure(self.recorder, 'kernel', kparms, fold,
+                              n_samples=len(train)):
+                    K_train = self._kernel(X_train, X_train, fparms)
+                    K_test = self._kernel(data[test], X_train, fparms)
+                results = pool(delayed(self._fit_score)(
+                    parms, K_train, target[train], K_test, target[test],
+                    parms.get('C', defaults['C']), fold)
+                    for parms in candidates)
+                for parms, score in results:
+                    pkey = tuple(sorted(parms.items()))
+                    scores.setdefault(pkey, []).append(score)
+            print('[ML] Kernel %s: %i C values on %i folds'
+                  % (str(kparms), len(candidates), len(self.cv)))
+
+        self.results_ = []
+        for parms in ParameterGrid(self.grids):
+            v = scores[tuple(sorted(parms.items()))]
+            self.results_.append({
+                'params': parms, 'scores': v,
+                'score': float(np.average(v, weights=weights))})
+        best = max(self.results_, key=lambda r: r['score'])
+        self.best_params_ = best['params']
+        self.best_score_ = best['score']
+        self.best_estimator_ = clone(self.estimator).set_params(
+            **self.best_params_)
+        with _measure(self.recorder, 'refit', self.best_params_,
+                      n_samples=len(data)) as rec:
+            self.best_estimator_.fit(data, target)
+            rec['model'] = self.best_estimator_
+        return self
+
+
+class KNNSearchCV(object):
+    def __init__(self, estimator, grids, cv, n_jobs=1, verbose=0,
+                 chunk=1024):
+        """Grid search of KNeighborsClassifier which queries the neighbor
+           graph once per (fold, search parameters) at the largest k
+
+        Candidates are grouped by the parameters other than n_neighbors
+        and weights (p, algorithm, and leaf_size unless the algorithm is
+        brute). For every group and fold the neighbors of the test
+        samples are queried once with the largest n_neighbors of the
+        group, and every n_neighbors and weights is scored from
+        prefixes of this graph, with the same voting and tie breaking
+        as KNeighborsClassifier.predict. Fold scores are weighted by
+        the number of test samples, as GridSearchCV with iid=True.
+
+        @param estimator: the sklearn KNeighborsClassifier
+        @param grids: parameter grid(s), as args.grids
+        @param cv: list of (train, test) indexes of the folds
+
+        Keyword arguments:
+        n_jobs  -- number of threads querying the graphs (default: 1)
+        verbose -- not used, for the same interface as GridSearchCV
+                   (default: 0)
+        chunk   -- number of test samples voted at once (default: 1024)
+
+        """
+        self.estimator = estimator
+        self.grids = grids
+        self.cv = list(cv)
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        self.chunk = chunk
+        self.recorder = None
+        self.results_ = []
+
+    def _group_key(self, parms, defaults):
+        """Key of the candidates sharing one neighbor graph"""
+
+        skip = ['n_neighbors', 'weights']
+        if parms.get('algorithm', defaults['algorithm']) == 'brute':
+            # leaf_size is only used by the trees
+            skip.append('leaf_size')
+        return tuple(sorted([(k, v) for k, v in parms.items()
+                             if k not in skip]))
+
+    def _weights(self, dist, weights):
+        """Weights of the neighbors as KNeighborsClassifier sets them"""
+
+        if weights == 'uniform':
+            return np.ones(dist.shape)
+        with np.errstate(divide='ignore'):
+            w = 1. / dist
+        inf_mask = np.isinf(w)
+        inf_row = np.any(inf_mask, axis=1)
+        w[inf_row] = inf_mask[inf_row]
+        return w
+
+    def _score_graph(self, est, X_test, dist, ind, y_train, y_test, ks,
+                     weights, nclasses):
+        """Accuracy of every (k, weights) from one neighbor graph
+
+        Test samples with a distance tie across the k-th neighbor are
+        ambiguous, the neighbors kept by sklearn depend on its
+        selection, so they are predicted by est itself.
+
+        @return dictionary of {(k, weights): accuracy}
+
+        """
+        kmax = max(ks)
+        scores = {}
+        for w_name in weights:
+            w = self._weights(dist[:, :kmax], w_name)
+            preds = dict([(k, np.empty(len(ind), dtype=np.int64))
+                          for k in ks])
+            for start in range(0, len(ind), self.chunk):
+                rows = slice(start, start + self.chunk)
+                n = len(ind[rows])
+                votes = np.zeros((n, kmax, nclasses))
+                votes[np.arange(n)[:, None], np.arange(kmax),
+                      y_train[ind[rows, :kmax]]] = w[rows]
+                votes = np.cumsum(votes, axis=1)
+                for k in ks:
+                    preds[k][rows] = votes[:, k - 1].argmax(axis=1)
+            for k in ks:
+                if k < dist.shape[1]:
+                    amb = np.where(dist[:, k - 1] == dist[:, k])[0]
+                    if len(amb) > 0:
+                        est.set_params(n_neighbors=k, weights=w_name)
+                        preds[k][amb] = est.predict(X_test[amb])
+                scores[(k, w_name)] = np.mean(preds[k] == y_test)
+        return scores
+
+    def _fold(self, gparms, ks, weights, data, target, train, test,
+              nclasses, fold=None):
+        """Query the graph of one fold and score the candidates"""
+
+        from sklearn.base import clone
+        ks = [k for k in ks if k <= len(train)]
+        if len(ks) == 0:
+            # GridSearchCV fails these candidates, score them as nan
+            return {}
+        # one more neighbor to detect ties across the largest k
+        nquery = min(max(ks) + 1, len(train))
+        est = clone(self.estimator).set_params(**gparms)
+        est.set_params(n_neighbors=nquery)
+        with _measure(self.recorder, 'graph', gparms, fold,
+                      n_samples=len(train), n_neighbors=nquery) as rec:
+            est.fit(data[train], target[train])
+            dist, ind = est.kneighbors(data[test])
+            rec['model'] = est
+        with _measure(self.recorder, 'score', gparms, fold,
+                      n_samples=len(test),
+                      candidates=len(ks) * len(weights)):
+            return self._score_graph(est, data[test], dist, ind,
+                                     target[train], target[test], ks,
+                                     weights, nclasses)
+
+    def fit(self, data, target):
+        """Search the best parameters and refit on the full data
+
+        @param data: Input training data array (multi-dimensional np array)
+        @param target: Input training target array (1D np array)
+
+        """
+        from sklearn.base import clone
+        from sklearn.grid_search import ParameterGrid
+        try:
+            from sklearn.externals.joblib import Parallel, delayed
+        except ImportError:
+            from joblib import Parallel, delayed
+        data = np.asarray(data)
+        classes, target = np.unique(target, return_inverse=True)
+        defaults = self.estimator.get_params()
+        candidates = list(ParameterGrid(self.grids))
+        groups = {}
+        for parms in candidates:
+            key = self._group_key(parms, defaults)
+            ks, weights = groups.setdefault(key, (set(), set()))
+            ks.add(int(parms.get('n_neighbors', defaults['n_neighbors'])))
+            weights.add(parms.get('weights', defaults['weights']))
+
+        tasks = [(key, fold, train, test) for key in groups
+                 for fold, (train, test) in enumerate(self.cv)]
+        pool = Parallel(n_jobs=self.n_jobs, backend='threading')
+        results = pool(delayed(self._fold)(
+            dict(key), sorted(groups[key][0]), sorted(groups[key][1]),
+            data, target, train, test, len(classes), fold)
+            for key, fold, train, test in tasks)
+        print('[ML] %i neighbor graphs for %i candidates on %i folds'
+              % (len(tasks), len(candidates), len(self.cv)))
+
+        graphs = {}
+        for (key, fold, train, test), scores in zip(tasks, results):
+            graphs.setdefault(key, []).append(scores)
+        # fold scores weighted by the test size, as GridSearchCV(iid=True)
+        fweights = [len(test) for train, test in self.cv]
+        self.results_ = []
+        for parms in candidates:
+            key = self._group_key(parms, defaults)
+            vkey = (int(parms.get('n_neighbors', defaults['n_neighbors'])),
+                    parms.get('weights', defaults['weights']))
+            scores = [s.get(vkey, np.nan) for s in graphs[key]]
+            self.results_.append({
+                'params': parms, 'scores': scores,
+                'score': float(np.average(scores, weights=fweights))})
+
+        # the first best candidate in grid order, as GridSearchCV
+        best = self.results_[int(np.nanargmax(
+            [r['score'] for r in self.results_]))]
+        self.best_params_ = best['params']
+        self.best_score_ = best['score']
+        self.best_estimator_ = clone(self.estimator).set_params(
+            **self.best_params_)
+        with _measure(self.recorder, 'refit', self.best_params_,
+                      n_samples=len(data)) as rec:
+            self.best_estimator_.fit(data, classes[target])
+            rec['model'] = self.best_estimator_
+        return self
+
+
+class ForestSearchCV(object):
+    def __init__(self, estimator, grids, cv, oob=False, n_jobs=1,
+                 verbose=0):
+        """Grid search of random forests which grows every configuration
+           once with warm_start and scores all n_estimators on the way
+
+        Candidates are grouped by the parameters other than
+        n_estimators. For every group and fold the forest is grown
+        with warm_start to each n_estimators of the grid in increasing
+        order. The class probabilities of the new trees on the test
+        fold are added to a running sum, so every size is scored
+        without predicting the earlier trees again. A warm-started
+        forest has the same trees as a forest fitted at that size, so
+        the scores are the same as GridSearchCV when random_state is
+        fixed.
+
+        With oob, the forests are grown on the full data and every size
+        is scored by its out-of-bag accuracy, without folds. Only
+        bootstrap candidates can be scored this way, the others are
+        dropped.
+
+        @param estimator: the sklearn RandomForestClassifier or
+                          ExtraTreesClassifier
+        @param grids: parameter grid(s), as args.grids
+        @param cv: list of (train, test) indexes of the folds
+
+        Keyword arguments:
+        oob     -- True to score with the out-of-bag samples
+                   (default: False)
+        n_jobs  -- number of jobs of the forests (default: 1)
+        verbose -- not used, for the same interface as GridSearchCV
+                   (default: 0)
+
+        """
+        self.estimator = estimator
+        self.grids = grids
+        self.cv = list(cv)
+        self.oob = oob
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        self.recorder = None
+        self.results_ = []
+
+    def _group_key(self, parms):
+        """Key of the candidates grown as one forest"""
+
+        return tuple(sorted([(k, v) for k, v in parms.items()
+                             if k != 'n_estimators']))
+
+    def _grow(self, gparms, sizes, X_train, y_train, X_test=None,
+              y_test=None, fold=None):
+        """Grow one forest through sizes and return {size: score}"""
+
+        from sklearn.base import clone
+        est = clone(self.estimator).set_params(warm_start=True,
+                                               n_jobs=self.n_jobs,
+                                               **gparms)
+        if self.oob:
+            est.set_params(oob_score=True)
+        else:
+            X_test = np.asarray(X_test, dtype=np.float32)
+        scores = {}
+        proba = 0
+        for n in sizes:
+            parms = dict(gparms, n_estimators=n)
+            ntrees = len(getattr(est, 'estimators_', []))
+            est.set_params(n_estimators=n)
+            with _measure(self.recorder, 'fit', parms, fold,
+                          n_samples=len(y_train),
+                          trees_added=n - ntrees) as rec:
+                est.fit(X_train, y_train)
+                rec['model'] = est
+            if self.oob:
+                scores[n] = est.oob_score_
+                continue
+            with _measure(self.recorder, 'score', parms, fold,
+                          n_samples=len(y_test)) as rec:
+                for tree in est.estimators_[ntrees:]:
+                    proba = proba + tree.predict_proba(X_test)
+                predicted = np.take(est.classes_, proba.argmax(axis=1))
+                scores[n] = np.mean(predicted == y_test)
+                rec['score'] = scores[n]
+        return scores
+
+    def fit(self, data, target):
+        """Search the best parameters and refit on the full data
+
+        @param data: Input training data array (multi-dimensional np array)
+        @param target: Input training target array (1D np array)
+
+        """
+        from sklearn.base import clone
+        from sklearn.grid_search import ParameterGrid
+        data = np.asarray(data)
+        target = np.asarray(target)
+        defaults = self.estimator.get_params()
+        candidates = list(ParameterGrid(self.grids))
+        if self.oob:
+            candidates = [c for c in candidates
+                          if c.get('bootstrap', defaults['bootstrap'])]
+            if len(candidates) == 0:
+                raise Exception("oob needs candidates with bootstrap")
+        groups = {}
+        for parms in candidates:
+            groups.setdefault(self._group_key(parms), set()).add(
+                int(parms.get('n_estimators', defaults['n_estimators'])))
+
+        graphs = {}
+        for key, sizes in groups.items():
+            sizes = sorted(sizes)
+            if self.oob:
+                graphs[key] = [self._grow(dict(key), sizes, data, target)]
+            else:
+                graphs[key] = [self._grow(dict(key), sizes, data[train],
+                                          target[train], data[test],
+                                          target[test], fold)
+                               for fold, (train, test) in
+                               enumerate(self.cv)]
+        nfits = len(groups) * (1 if self.oob else len(self.cv))
+        print('[ML] %i forests grown for %i candidates' % (nfits,
+                                                           len(candidates)))
+
+        # fold scores weighted by the test size, as GridSearchCV(iid=True)
+        fweights = None if self.oob else \
+            [len(test) for train, test in self.cv]
+        self.results_ = []
+        for parms in candidates:
+            n = int(parms.get('n_estimators', defaults['n_estimators']))
+            scores = [s[n] for s in graphs[self._group_key(parms)]]
+            self.results_.append({
+                'params': parms, 'scores': scores,
+                'score': float(np.average(scores, weights=fweights))})
+
+        # the first best candidate in grid order, as GridSearchCV
+        best = self.results_[int(np.argmax(
+            [r['score'] for r in self.results_]))]
+        self.best_params_ = best['params']
+        self.best_score_ = best['score']
+        self.best_estimator_ = clone(self.estimator).set_params(
+            **self.best_params_)
+        with _measure(self.recorder, 'refit', self.best_params_,
+                      n_samples=len(data)) as rec:
+            self.best_estimator_.fit(data, target)
+            rec['model'] = self.best_estimator_
+        return self
+
+
+class _ByteCounter(object):
+    """File-like sink which only counts the bytes written"""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+class MetricsRecorder(object):
+    def __init__(self, model_size=True):
+        """Record wall time, peak RSS and model size of every fit, score,
+           test and predict run by MLRun and its searches
+
+        Peak RSS is reset before every measure on Linux, so it is the
+        peak of that step. Elsewhere it is the peak of the process.
+        Steps running in parallel threads share the process peak.
+
+        Keyword arguments:
+        model_size -- True to record the pickled size of the fitted
+                      models (default: True)
+
+        """
+        self.model_size = model_size
+        self.records = []
+        self.t0 = time.time()
+
+    def _json_value(self, v):
+        if isinstance(v, np.generic):
+            return v.item()
+        if v is None or isinstance(v, (bool, int, float, str)):
+            return v
+        return str(v)
+
+    def _params(self, params):
+        if params is None:
+            return None
+        return dict([(k, self._json_value(v)) for k, v in params.items()])
+
+    def _reset_peak(self):
+        try:
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+        except (IOError, OSError):
+            pass
+
+    def peak_rss(self):
+        """Peak RSS in MB"""
+
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) / 1024.
+        except (IOError, OSError):
+            pass
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            return rss / (1024. * 1024.)
+        return rss / 1024.
+
+    def size_of(self, model):
+        """Size of the pickled model in bytes"""
+
+        counter = _ByteCounter()
+        pickle.dump(model, counter, protocol=pickle.HIGHEST_PROTOCOL)
+        return counter.size
+
+    @contextlib.contextmanager
+    def measure(self, kind, params=None, fold=None, **info):
+        """Measure the enclosed step
+
+        The yielded dictionary is the record. Set 'model' in it to
+        record the model size, or any other metric such as 'score'.
+
+        @param kind: fit/score/graph/test/predict...
+
+        Keyword arguments:
+        params -- parameters of the candidate (default: None)
+        fold   -- index of the fold (default: None)
+
+        """
+        import threading
+        rec = {'kind': kind, 'params': self._params(params), 'fold': fold,
+               'tid': threading.current_thread().ident}
+        rec.update(info)
+        self._reset_peak()
+        start = time.time()
+        yield rec
+        rec['start'] = start - self.t0
+        rec['time'] = time.time() - start
+        rec['peak_rss_mb'] = self.peak_rss()
+        model = rec.pop('model', None)
+        if model is not None and self.model_size:
+            rec['model_size'] = self.size_of(model)
+        for k in rec:
+            if k != 'params':
+                rec[k] = self._json_value(rec[k])
+        self.records.append(rec)
+
+    def fit_score(self, est, data, target, train, test, params, fold,
+                  **info):
+        """Fit est on train, score it on test and record both steps
+
+        @return score of est on test
+
+        """
+        with self.measure('fit', params, fold, n_samples=len(train),
+                          **info) as rec:
+            est.fit(data[train], target[train])
+            rec['model'] = est
+        with self.measure('score', params, fold, n_samples=len(test),
+                          **info) as rec:
+            score = est.score(data[test], target[test])
+            rec['score'] = score
+        return score
+
+    def summary(self, top=10):
+        """Print the candidates and parameter values taking the most time
+
+        @return dictionary of the time per candidate and per parameter
+                value
+
+        """
+        total = sum([r['time'] for r in self.records]) or 1.
+        by_candidate = {}
+        by_value = {}
+        for r in self.records:
+            if r['params'] is None:
+                continue
+            key = str(sorted(r['params'].items()))
+            by_candidate[key] = by_candidate.get(key, 0) + r['time']
+            for k, v in r['params'].items():
+                kv = '%s=%s' % (k, str(v))
+                by_value[kv] = by_value.get(kv, 0) + r['time']
+        print('[ML] %.3f s measured in %i steps' % (total,
+                                                     len(self.records)))
+        for name, values in [('candidates', by_candidate),
+                             ('parameter values', by_value)]:
+            print('[ML] Top %s by time:' % name)
+            for key, t in sorted(values.items(),
+                                 key=lambda i: -i[1])[:top]:
+                print('[ML]   %5.1f%% %9.3f s %s'
+                      % (100. * t / total, t, key))
+        return {'total': total, 'candidates': by_candidate,
+                'values': by_value}
+
+    def write(self, prefix, trace=False):
+        """Write prefix.json, prefix.csv and prefix_trace.json
+
+        @param prefix: prefix of the output files
+
+        Keyword arguments:
+        trace -- True to write the Chrome trace file, which can be
+                 opened with chrome://tracing (default: False)
+
+        """
+        import csv
+        import json
+        io.write_json({'records': self.records, 'summary': self.summary()},
+                      fname=prefix + '.json')
+        fields = ['kind', 'params', 'fold', 'start', 'time',
+                  'peak_rss_mb', 'model_size', 'score', 'n_samples']
+        for r in self.records:
+            fields += [k for k in r if k not in fields]
+        with open(prefix + '.csv', 'w') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for r in self.records:
+                row = dict(r)
+                row['params'] = json.dumps(r['params'], sort_keys=True)
+                writer.writerow(row)
+        outputs = [prefix + '.json', prefix + '.csv']
+        if trace:
+            events = []
+            for r in self.records:
+                name = r['kind']
+                if r['params'] is not None:
+                    name += ' ' + json.dumps(r['params'], sort_keys=True)
+                events.append({'name': name, 'cat': r['kind'], 'ph': 'X',
+                               'ts': int(r['start'] * 1e6),
+                               'dur': int(r['time'] * 1e6),
+                               'pid': os.getpid(), 'tid': r['tid'],
+                               'args': r})
+            io.write_json({'traceEvents': events},
+                          fname=prefix + '_trace.json')
+            outputs.append(prefix + '_trace.json')
+        print('[ML] Metrics are written to %s' % ', '.join(outputs))
+        return outputs
+
+
+@contextlib.contextmanager
+def _null_measure():
+    yield {}
+
+
+def _measure(recorder, kind, params=None, fold=None, **info):
+    """recorder.measure, or a context which records nothing if recorder
+       is None"""
+
+    if recorder is None:
+        return _null_measure()
+    return recorder.measure(kind, params, fold, **info)
+
+
+def _with_metrics(func):
+    """Decorator of the MLRun entry points, which creates the recorder
+       if args.metrics is True and writes the metrics when the
+       outermost entry point returns"""
+
+    import functools
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if self.args.metrics and self.recorder is None:
+            self.recorder = MetricsRecorder(self.args.metrics_model_size)
+        self._metrics_depth += 1
+        try:
+            output = func(self, *args, **kwargs)
+        finally:
+            self._metrics_depth -= 1
+        if self._metrics_depth == 0 and self.recorder is not None:
+            self.write_metrics()
+        return output
+    return wrapper
+
+
+class ProfiledSearchCV(object):
+    def __init__(self, estimator, grids, cv, n_jobs=1, verbose=0):
+        """Grid search as GridSearchCV which records every fit and score
+           of every candidate and fold with a MetricsRecorder
+
+        @param estimator: the sklearn estimator
+        @param grids: parameter grid(s), as args.grids
+        @param cv: list of (train, test) indexes of the folds
+
+        Keyword arguments:
+        n_jobs  -- number of threads (default: 1)
+        verbose -- not used, for the same interface as GridSearchCV
+                   (default: 0)
+
+        """
+        self.estimator = estimator
+        self.grids = grids
+        self.cv = list(cv)
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        self.recorder = None
+        self.results_ = []
+
+    def _fit_score(self, parms, data, target, train, test, fold):
+        from sklearn.base import clone
+        est = clone(self.estimator).set_params(**parms)
+        return self.recorder.fit_score(est, data, target, train, test,
+                                       parms, fold)
+
+    def fit(self, data, target):
+        """Search the best parameters and refit on the full data
+
+        @param data: Input training data array (multi-dimensional np array)
+        @param target: Input training target array (1D np array)
+
+        """
+        from sklearn.base import clone
+        from sklearn.grid_search import ParameterGrid
+        try:
+            from sklearn.externals.joblib import Parallel, delayed
+        except ImportError:
+            from joblib import Parallel, delayed
+        if self.recorder is None:
+            self.recorder = MetricsRecorder()
+        data = np.asarray(data)
+        target = np.asarray(target)
+        candidates = list(ParameterGrid(self.grids))
+        nfolds = len(self.cv)
+        pool = Parallel(n_jobs=self.n_jobs, backend='threading')
+        scores = pool(delayed(self._fit_score)(
+            parms, data, target, train, test, fold)
+            for parms in candidates
+            for fold, (train, test) in enumerate(self.cv))
+        # fold scores weighted by the test size, as GridSearchCV(iid=True)
+        fweights = [len(test) for train, test in self.cv]
+        self.results_ = []
+        for i, parms in enumerate(candidates):
+            s = scores[i * nfolds:(i + 1) * nfolds]
+            self.results_.append({
+                'params': parms, 'scores': s,
+                'score': float(np.average(s, weights=fweights))})
+        best = self.results_[int(np.argmax(
+            [r['score'] for r in self.results_]))]
+        self.best_params_ = best['params']
+        self.best_score_ = best['score']
+        self.best_estimator_ = clone(self.estimator).set_params(
+            **self.best_params_)
+        with self.recorder.measure('refit', self.best_params_,
+                                   n_samples=len(data)) as rec:
+            self.best_estimator_.fit(data, target)
+            rec['model'] = self.best_estimator_
+        return self
+
+
+class _ArrayPickler(pickle.Pickler):
+    def __init__(self, f, path, min_size, protocol):
+        """Pickler which writes large arrays to separate .npy files
+
+        @param f: file of the pickle
+        @param path: directory of the .npy files
+        @param min_size: minimal size in bytes of the arrays to write
+        @param protocol: pickle protocol
+
+        """
+        pickle.Pickler.__init__(self, f, protocol)
+        self.path = path
+        self.min_size = min_size
+        self.arrays = {}
+
+    def persistent_id(self, obj):
+        if not isinstance(obj, np.ndarray) or obj.dtype.hasobject \
+                or obj.nbytes < self.min_size:
+            return None
+        if id(obj) not in self.arrays:
+            fname = '%05i.npy' % len(self.arrays)
+            np.save(os.path.join(self.path, fname), obj)
+            # keep obj alive so that its id is not reused
+            self.arrays[id(obj)] = (fname, obj)
+        return self.arrays[id(obj)][0]
+
+
+class _ArrayUnpickler(pickle.Unpickler):
+    def __init__(self, f, path, mmap_mode):
+        """Unpickler of _ArrayPickler, reads arrays as np.memmap
+
+        @param f: file of the pickle
+        @param path: directory of the .npy files
+        @param mmap_mode: mmap_mode of np.load, None to read in memory
+
+        """
+        pickle.Unpickler.__init__(self, f)
+        self.path = path
+        self.mmap_mode = mmap_mode
+
+    def persistent_load(self, pid):
+        return np.load(os.path.join(self.path, pid),
+                       mmap_mode=self.mmap_mode)
+
+
+class _NpyStream(object):
+    def __init__(self, fname, n):
+        """Write a .npy file of n rows chunk by chunk
+
+        The header is written with the first chunk, which sets the dtype
+        and the shape of the remaining dimensions.
+
+        @param fname: output file name
+        @param n: total number of rows
+
+        """
+        self.fname = fname
+        self.n = n
+        self.count = 0
+        self._f = None
+
+    def write(self, chunk):
+        chunk = np.ascontiguousarray(chunk)
+        if self._f is None:
+            from numpy.lib import format as npformat
+            header = npformat.header_data_from_array_1_0(chunk)
+            header['shape'] = (self.n,) + chunk.shape[1:]
+            self._f = open(self.fname, 'wb')
+            npformat.write_array_header_1_0(self._f, header)
+        self._f.write(chunk.tobytes())
+        self.count += chunk.shape[0]
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+        if self.count != self.n:
+            raise Exception("%s: %i rows are written, expected %i"
+                            % (self.fname, self.count, self.n))
+
+
+_pool_runner = None
+_pool_model = None
+
+
+def _pool_init(runner, model):
+    """Initializer of the prediction worker processes"""
+
+    global _pool_runner, _pool_model
+    _pool_runner = runner
+    _pool_model = model
+
+
+def _pool_predict(X, prob):
+    """Predict one chunk in a worker process"""
+
+    return _pool_runner._predict_chunk(_pool_model, X, prob)
+
+
+class ModelRegistry(object):
+    def __init__(self, path):
+        """Versioned registry of the saved models
+
+        Every registered model gets a version number per name, and the
+        entry records its path, parameters, data hash and metrics in
+        path/registry.json.
+
+        @param path: directory of the registry
+
+        """
+        self.path = path
+        self.fname = os.path.join(path, 'registry.json')
+
+    def read(self):
+        """Return all entries as {name: [entries]}"""
+
+        if not os.path.isfile(self.fname):
+            return {}
+        return io.parse_json(self.fname)
+
+    def next_version(self, name):
+        """Return the next version number of the model"""
+
+        entries = self.read().get(name, [])
+        return max([e['version'] for e in entries] + [0]) + 1
+
+    def _json_params(self, model):
+        """Parameters of the model which can be written to json"""
+
+        if not hasattr(model, 'get_params'):
+            return {}
+        params = {}
+        for k, v in model.get_params(deep=False).items():
+            if v is None or isinstance(v, (bool, int, float, str)):
+                params[k] = v
+            else:
+                params[k] = str(v)
+        return params
+
+    def register(self, name, version, path, model=None, fmt='pickle',
+                 data_hash=None, metrics=None):
+        """Add an entry of a saved model
+
+        @param name: name of the model
+        @param version: version number, see next_version
+        @param path: path of the saved model
+
+        Keyword arguments:
+        model     -- model saved, used to record its parameters
+                     (default: None)
+        fmt       -- format of the saved model, pickle/mmap
+                     (default: pickle)
+        data_hash -- hash of the training data (default: None)
+        metrics   -- dictionary of the metrics (default: None)
+
+        @return the entry added
+
+        """
+        entries = self.read()
+        entry = {'version': version, 'path': path, 'format': fmt,
+                 'params': self._json_params(model),
+                 'data_hash': data_hash,
+                 'metrics': metrics if metrics is not None else {},
+                 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+        entries.setdefault(name, []).append(entry)
+        io.dir_check(self.path)
+        io.write_json(entries, fname=self.fname + '.tmp')
+        os.rename(self.fname + '.tmp', self.fname)
+        print('[ML] %s version %i is registered' % (name, version))
+        return entry
+
+    def get(self, name, version=None):
+        """Return the entry of a model
+
+        @param name: name of the model
+
+        Keyword arguments:
+        version -- version number (default: the latest)
+
+        """
+        entries = self.read().get(name, [])
+        if version is not None:
+            entries = [e for e in entries if e['version'] == version]
+        if len(entries) == 0:
+            raise Exception("Model %s version %s is not registered."
+                            % (name, str(version)))
+        return max(entries, key=lambda e: e['version'])
+
+
 class MLTools():
     def __init__(self):
         """Init function of MLTools class"""
@@ -225,7 +2133,84 @@ class MLTools():
             _dirname = os.path.dirname(_dirname)
         return None
 
-    def PCA(self, X, Y=None, ncomp=2, method='PCA'):
+    def _iter_rows(self, X, chunk_size):
+        """Yield chunks of rows of an array, or the data of a ChunkReader"""
+
+        if isinstance(X, ChunkReader):
+            for data, target in X:
+                yield data
+            return
+        for start in range(0, X.shape[0], chunk_size):
+            yield X[start:start + chunk_size]
+
+    def fit_pca(self, X, ncomp=2, method='PCA', chunk_size=10000,
+                fout=None):
+        """Fit a decomposition and return the fitted transformer
+
+        @param X: Input dataset, np.ndarray, np.memmap or ChunkReader
+
+        Keyword Arguments:
+        ncomp      -- number or components to be kept (Default: 2)
+        method     -- method to be used, PCA(default)/Randomized/
+                      Incremental/Sparse/rbf/linear/sigmoid/SVD
+        chunk_size -- rows per partial_fit of Incremental (Default: 10000)
+        fout       -- prefix of the file to save the transformer with
+                      save_model (Default: not saved)
+
+        """
+        from sklearn import decomposition
+        if method == 'Incremental':
+            pca = decomposition.IncrementalPCA(n_components=ncomp)
+            for chunk in self._iter_rows(X, chunk_size):
+                pca.partial_fit(chunk)
+        else:
+            if isinstance(X, ChunkReader):
+                raise Exception("Only Incremental PCA reads chunks")
+            if method == 'Randomized':
+                # RandomizedPCA is replaced by svd_solver in sklearn 0.18
+                try:
+                    pca = decomposition.PCA(n_components=ncomp,
+                                            svd_solver='randomized')
+                except TypeError:
+                    pca = decomposition.RandomizedPCA(n_components=ncomp)
+            elif method == 'Sparse':
+                pca = decomposition.SparsePCA(n_components=ncomp)
+            elif method == 'rbf':
+                pca = decomposition.KernelPCA(n_components=ncomp,
+                                              fit_inverse_transform=True,
+                                              gamma=10, kernel="rbf")
+            elif method == 'linear':
+                pca = decomposition.KernelPCA(n_components=ncomp,
+                                              kernel="linear")
+            elif method == 'sigmoid':
+                pca = decomposition.KernelPCA(n_components=ncomp,
+                                              kernel="sigmoid")
+            elif method == 'SVD':
+                pca = decomposition.TruncatedSVD(n_components=ncomp)
+            else:
+                pca = decomposition.PCA(n_components=ncomp)
+                method = 'PCA'
+            pca.fit(X)
+        print('[ML] Using %s method' % method)
+        if fout is not None:
+            self.save_model(fout, pca)
+        return pca
+
+    def iter_transform(self, pca, X, chunk_size=10000):
+        """Yield the projection of X chunk by chunk
+
+        @param pca: fitted transformer, see fit_pca
+        @param X: np.ndarray, np.memmap or ChunkReader
+
+        Keyword Arguments:
+        chunk_size -- rows per chunk (Default: 10000)
+
+        """
+        for chunk in self._iter_rows(X, chunk_size):
+            yield pca.transform(chunk)
+
+    def PCA(self, X, Y=None, ncomp=2, method='PCA', model=None,
+            fout=None):
         """ decompose a multivariate dataset in an orthogonal
             set that explain a maximum amount of the variance
 
@@ -234,68 +2219,156 @@ class MLTools():
         Keyword Arguments:
         ncomp  -- number or components to be kept (Default: 2)
         method -- method to be used
-                  PCA(default)/Randomized/Sparse
+                  PCA(default)/Randomized/Incremental/Sparse
+        model  -- fitted transformer to apply, or a file saved by
+                  fit_pca, instead of fitting X (Default: None)
+        fout   -- prefix of the file to save the transformer
+                  (Default: not saved)
 
         """
-        from sklearn import decomposition
-        from sklearn import cross_decomposition
-        if method == 'Randomized':
-            pca = decomposition.RandomizedPCA(n_components=ncomp)
-        elif method == 'Sparse':
-            pca = decomposition.SparsePCA(n_components=ncomp)
-        elif method == 'rbf':
-            pca = decomposition.KernelPCA(n_components=ncomp,
-                                          fit_inverse_transform=True,
-                                          gamma=10, kernel="rbf")
-        elif method == 'linear':
-            pca = decomposition.KernelPCA(n_components=ncomp,
-                                          kernel="linear")
-        elif method == 'sigmoid':
-            pca = decomposition.KernelPCA(n_components=ncomp,
-                                          kernel="sigmoid")
-        elif method == 'SVD':
-            pca = decomposition.TruncatedSVD(n_components=ncomp)
-        else:
-            pca = decomposition.PCA(n_components=ncomp)
-            method = 'PCA'
-        print('[ML] Using %s method' % method)
-        pca.fit(X)
-        return pca.transform(X)
+        if model is None:
+            model = self.fit_pca(X, ncomp=ncomp, method=method, fout=fout)
+        elif not hasattr(model, 'transform'):
+            model = self.read_model(model)
+        return np.concatenate(list(self.iter_transform(model, X)))
+
+    def data_hash(self, data, target=None, chunk_size=10000):
+        """Return the md5 hash of the data, read chunk by chunk
+
+        @param data: data array (np.ndarray or np.memmap)
 
-    def save_model(self, fprefix, model, high=False):
+        Keyword arguments:
+        target     -- target array (default: None)
+        chunk_size -- number of rows hashed at once (default: 10000)
+
+        """
+        import hashlib
+        md5 = hashlib.md5()
+        for array in [data, target]:
+            if array is None:
+                continue
+            md5.update(str(np.shape(array)).encode('utf-8'))
+            for i in range(0, len(array), chunk_size):
+                md5.update(np.ascontiguousarray(
+                    array[i:i + chunk_size]).tobytes())
+        return md5.hexdigest()
+
+    def save_model(self, fprefix, model, high=False, mmap=None, meta=None):
         """Save model to a file for future use
 
+        If args.registry is True, the model is saved as
+        fprefix-v<version> and registered in args.outd/registry.json.
+
         @param fprefix: prefix of the output file
         @param model: model to be saved
 
+        Keyword arguments:
+        high -- True to use the highest pickle protocol (default: False)
+        mmap -- True to write the large arrays of the model as separate
+                .npy files which read_model can memory map
+                (default: args.mmap)
+        meta -- dictionary with data_hash and metrics to be registered
+                (default: None)
+
         """
-        import pickle
         io.dir_check(self.args.outd)
-        outf = ''.join([self.args.outd, fprefix, '.pkl'])
-
-        with open(outf, 'wb') as f:
-            if high:
-                pickle.dump(model, f,
-                             protocol=pickle.HIGHEST_PROTOCOL)
-            else:
-                pickle.dump(model, f)
+        if mmap is None:
+            mmap = self.args.mmap
+        name = fprefix
+        if self.args.registry:
+            registry = ModelRegistry(self.args.outd)
+            version = registry.next_version(fprefix)
+            name = '%s-v%i' % (fprefix, version)
+
+        if mmap:
+            outf = os.path.join(self.args.outd, name)
+            self.dump_mmap(model, outf)
+        else:
+            outf = ''.join([self.args.outd, name, '.pkl'])
+            with open(outf, 'wb') as f:
+                if high:
+                    pickle.dump(model, f,
+                                protocol=pickle.HIGHEST_PROTOCOL)
+                else:
+                    pickle.dump(model, f)
         print("[ML] Model is saved to %s" % outf)
+
+        if self.args.registry:
+            meta = meta if meta is not None else {}
+            registry.register(fprefix, version, outf, model=model,
+                              fmt='mmap' if mmap else 'pickle',
+                              data_hash=meta.get('data_hash'),
+                              metrics=meta.get('metrics'))
         return outf
 
-    def read_model(self, fmodel):
+    def dump_mmap(self, model, path):
+        """Save model as path/model.pkl and path/arrays/*.npy
+
+        Arrays larger than args.mmap_min_size bytes are written as .npy
+        files. The model is written to a temporary directory which then
+        replaces path, so processes which memory map the old files are
+        not affected.
+
+        @param model: model to be saved
+        @param path: output directory
+
+        """
+        import shutil
+        tmp = path + '.tmp'
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(os.path.join(tmp, 'arrays'))
+        with open(os.path.join(tmp, 'model.pkl'), 'wb') as f:
+            _ArrayPickler(f, os.path.join(tmp, 'arrays'),
+                          self.args.mmap_min_size,
+                          pickle.HIGHEST_PROTOCOL).dump(model)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(tmp, path)
+
+    def read_model(self, fmodel, mmap=True):
         """Read model from a file
 
-        @param fmodel: file path of the input model
+        @param fmodel: file path of the input model, or the directory
+                       written by save_model with mmap
+
+        Keyword arguments:
+        mmap -- True to memory map the arrays of a model saved with
+                mmap, which are then shared with other processes via
+                the page cache (default: True)
+
+        Trees of sklearn forests copy their node and value arrays when
+        they are unpickled, so they are read in memory and not shared,
+        only the loading is faster than a plain pickle. Arrays held by
+        the estimator itself, e.g. support vectors of SVC or the
+        vectors of ANNClassifier, stay memory mapped.
 
         """
+        if os.path.isdir(fmodel):
+            with open(os.path.join(fmodel, 'model.pkl'), 'rb') as f:
+                return _ArrayUnpickler(f, os.path.join(fmodel, 'arrays'),
+                                       'r' if mmap else None).load()
         if not os.path.isfile(fmodel):
             raise Exception("Model file %s does not exist." % fmodel)
 
-        import pickle
         with open(fmodel, 'rb') as f:
             model = pickle.load(f)
         return model
 
+    def read_registered(self, name, version=None, mmap=True):
+        """Read a model from the registry of args.outd
+
+        @param name: name of the model
+
+        Keyword arguments:
+        version -- version number (default: the latest)
+        mmap    -- see read_model (default: True)
+
+        """
+        entry = ModelRegistry(self.args.outd).get(name, version=version)
+        print('[ML] Reading %s version %i' % (name, entry['version']))
+        return self.read_model(entry['path'], mmap=mmap)
+
 
 class MLRun(MLTools):
     def __init__(self, pfs=['ml.json']):
@@ -305,6 +2378,8 @@ class MLRun(MLTools):
         pfs -- profiles to read (default: ['ml.json'])
 
         """
+        self.recorder = None
+        self._metrics_depth = 0
         self.ml_init(pfs)
 
     def ml_init(self, pfs):
@@ -320,32 +2395,74 @@ class MLRun(MLTools):
 
         return None
 
-    def run(self, data, target):
+    @_with_metrics
+    def run(self, data, target=None):
         """Run spliting sample, training and testing
 
-        @param data: Input full data array (multi-dimensional np array)
-        @param target: Input full target array (1D np array)
+        The estimators of MLRun are fitted in memory, so all training
+        samples of a FeatureStore are loaded, only the testing samples
+        are read chunk by chunk. Use IncrementalRun to train on a store
+        which does not fit in memory.
+
+        @param data: Input full data array (multi-dimensional np array),
+                     or a FeatureStore which is read as np.memmap
+        @param target: Input full target array (1D np array),
+                       not needed if data is a FeatureStore
 
         """
+        store = isinstance(data, FeatureStore)
+        if store:
+            target = data.target()
+            data = data.data()
+        if self.args.metrics:
+            # every run starts a new record
+            self.recorder = MetricsRecorder(self.args.metrics_model_size)
         data = dt.conv_to_np(data)
         target = dt.conv_to_np(target)
         length = dt.check_len(data, target)
-        train_d, test_d, train_t, test_t = \
-            self.split_samples(data, target)
+        if store:
+            train_d, test_d, train_t, test_t = \
+                self.split_store(data, target)
+        else:
+            train_d, test_d, train_t, test_t = \
+                self.split_samples(data, target)
         model, method = self.train(train_d, train_t)
         if len(test_t) > 0:
             result = self.test(test_d, test_t, model)
-            if self.args.retrain:
+            if self.args.retrain and store:
+                print("[ML] Re-fit is skipped for FeatureStore data, "
+                      "use IncrementalRun to train with all samples")
+            elif self.args.retrain:
                 print("[ML] Re-fit model with the full dataset")
                 if method == 'MLP':
                     target = dt.convert_cats(target)
-                model.fit(data, target)
+                with _measure(self.recorder, 'refit',
+                              n_samples=len(data)):
+                    model.fit(data, target)
         else:
             print('[ML] No additional testing is performed')
             result = None
-        mf = self.save_model(method, model)
+        meta = None
+        if self.args.registry:
+            meta = {'data_hash': self.data_hash(data, target)}
+            if result is not None:
+                meta['metrics'] = {'accuracy': float(result['accuracy']),
+                                   'error': float(result['error'])}
+        mf = self.save_model(method, model, meta=meta)
         return result
 
+    def write_metrics(self, prefix='metrics'):
+        """Write the metrics recorded by train/test/predict to args.outd,
+           called when run, train, test or predict returns
+
+        Keyword arguments:
+        prefix -- prefix of the output files (default: metrics)
+
+        """
+        io.dir_check(self.args.outd)
+        return self.recorder.write(os.path.join(self.args.outd, prefix),
+                                   trace=self.args.metrics_trace)
+
     def split_samples(self, data, target):
         """Split samples
 
@@ -360,8 +2477,28 @@ class MLRun(MLTools):
                                               random_state=self.args.random)
         return train_d, test_d, train_t, test_t
 
+    def split_store(self, data, target):
+        """Split samples of a FeatureStore by index, only the training
+           samples are read in memory, the testing samples are read
+           chunk by chunk while testing
+
+        @param data: FeatureStore data (np.memmap)
+        @param target: Input full target array (1D np array)
+
+        """
+        from sklearn import cross_validation
+        train_i, test_i = \
+            cross_validation.train_test_split(np.arange(len(target)),
+                                              test_size=self.args.test_size,
+                                              random_state=self.args.random)
+        test_i = np.sort(test_i)
+        return data[train_i], _RowView(data, test_i), \
+            target[train_i], target[test_i]
+
+    @_with_metrics
     def train(self, data, target):
-        """Train with GridSearchCV to Find the best parameters
+        """Train with GridSearchCV to Find the best parameters, or with
+           HalvingSearchCV if args.search is 'halving' or 'hyperband'
 
         @param data: Input training data array (multi-dimensional np array)
         @param target: Input training target array (1D np array)
@@ -378,7 +2515,6 @@ class MLRun(MLTools):
             print("[ML] Error: cannot set the model properly")
             sys.exit(1)
 
-        from sklearn.grid_search import GridSearchCV
         t0 = time.time()
         if 'grids' not in self.args.__dict__.keys():
             raise Exception("grids are not set properly")
@@ -393,11 +2529,9 @@ class MLRun(MLTools):
         if model is None:
             print("[ML] Error: cannot set the model properly")
             sys.exit(1)
-        print('[ML] GridSearchCV for: %s' % str(self.args.grids))
-
-        clf = GridSearchCV(model, self.args.grids,
-                           n_jobs=self.args.njobs,
-                           cv=cv, verbose=verbose)
+        clf = self._init_search(model, cv, verbose)
+        if self.recorder is not None and hasattr(clf, 'recorder'):
+            clf.recorder = self.recorder
         clf.fit(data, target)
         best_parms = clf.best_params_
         t0 = dt.print_time(t0, 'find best parameters - train')
@@ -410,6 +2544,37 @@ class MLRun(MLTools):
 
         return best_model, method
 
+    def _init_search(self, model, cv, verbose):
+        """Return the search object selected by args.search
+
+        @param model: the sklearn estimator
+        @param cv: KFold of the training data
+        @param verbose: verbose level
+
+        """
+        if self.args.search not in ['grid', 'halving', 'hyperband']:
+            raise Exception("Unknown search %s, use grid, halving or "
+                            "hyperband" % self.args.search)
+        if self.args.search in ['halving', 'hyperband']:
+            print('[ML] %s search for: %s'
+                  % (self.args.search, str(self.args.grids)))
+            return HalvingSearchCV(
+                model, self.args.grids, factor=self.args.halving_factor,
+                hyperband=(self.args.search == 'hyperband'),
+                nfolds=self.args.nfolds,
+                min_samples=self.args.halving_min_samples,
+                n_jobs=self.args.njobs, random_state=self.args.random,
+                verbose=verbose)
+        if self.args.metrics:
+            print('[ML] ProfiledSearchCV for: %s' % str(self.args.grids))
+            return ProfiledSearchCV(model, self.args.grids, cv,
+                                    n_jobs=self.args.njobs)
+        from sklearn.grid_search import GridSearchCV
+        print('[ML] GridSearchCV for: %s' % str(self.args.grids))
+        return GridSearchCV(model, self.args.grids,
+                            n_jobs=self.args.njobs,
+                            cv=cv, verbose=verbose)
+
     def _multiclass_refit(self, clf):
         """Return advanced choices of the classification method"""
 
@@ -432,30 +2597,204 @@ class MLRun(MLTools):
 
         return clf
 
-    def predict(self, data, trained_model, outf=None):
+    def _argmax_proba(self, model):
+        """True if the labels are the argmax of predict_proba, so that
+           both are computed in one pass"""
+
+        return hasattr(model, 'classes_')
+
+    def _predict_chunk(self, model, data, prob):
+        """Return predicted labels and probabilities (or None) of a chunk
+
+        @param model: pre-trained model
+        @param data: chunk of the input data
+        @param prob: True to compute the probabilities
+
+        """
+        if not prob:
+            return self._get_predicted(data, model), None
+        proba = model.predict_proba(data)
+        if self._argmax_proba(model):
+            return np.take(model.classes_, proba.argmax(axis=1)), proba
+        return self._get_predicted(data, model), proba
+
+    def _iter_data(self, data):
+        """Yield chunks of args.predict_chunk rows of the data
+
+        @param data: np.ndarray, np.memmap, list or ChunkReader
+
+        """
+        if isinstance(data, ChunkReader):
+            for X, y in data:
+                yield X
+            return
+        if not hasattr(data, 'shape'):
+            data = dt.conv_to_np(data)
+        size = self.args.predict_chunk
+        for start in range(0, data.shape[0], size):
+            yield data[start:start + size]
+
+    def _init_pool(self, model):
+        """Return the worker pool of args.predict_backend, or None"""
+
+        if self.args.predict_jobs <= 1:
+            return None
+        backend = self.args.predict_backend
+        if backend == 'auto':
+            # sklearn releases the GIL in its compiled predict loops
+            module = type(model).__module__
+            backend = 'thread' if module.startswith('sklearn') \
+                else 'process'
+        print('[ML] Predicting with %i %s workers'
+              % (self.args.predict_jobs, backend))
+        if backend == 'thread':
+            from multiprocessing.pool import ThreadPool
+            return ThreadPool(self.args.predict_jobs)
+        from multiprocessing import Pool
+        return Pool(self.args.predict_jobs, initializer=_pool_init,
+                    initargs=(self, model))
+
+    def iter_predict(self, data, trained_model, prob=False):
+        """Yield (labels, probabilities) of the chunks of data in order
+
+        Chunks are predicted by args.predict_jobs workers, at most
+        2 * args.predict_jobs chunks are in flight so that memory does
+        not grow with the size of the data.
+
+        @param data: np.ndarray, np.memmap, list or ChunkReader
+        @param trained_model: pre-trained model used for predicting
+
+        Keyword arguments:
+        prob -- True to compute the probabilities (default: False)
+
+        """
+        from collections import deque
+        from multiprocessing.pool import ThreadPool
+        pool = self._init_pool(trained_model)
+        if pool is None:
+            for X in self._iter_data(data):
+                yield self._predict_chunk(trained_model, X, prob)
+            return
+
+        process = not isinstance(pool, ThreadPool)
+        pending = deque()
+        try:
+            for X in self._iter_data(data):
+                if process:
+                    pending.append(pool.apply_async(_pool_predict,
+                                                    (X, prob)))
+                else:
+                    pending.append(pool.apply_async(
+                        self._predict_chunk, (trained_model, X, prob)))
+                if len(pending) >= 2 * self.args.predict_jobs:
+                    yield pending.popleft().get()
+            while len(pending) > 0:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+
+    @_with_metrics
+    def predict(self, data, trained_model, outf=None, prob=False):
         """Predict using the existing model
 
-        @param data: Input testing data array (multi-dimensional np array)
+        @param data: Input testing data array (multi-dimensional np array,
+                     np.memmap, or ChunkReader)
         @param trained_model: pre-trained model used for predicting
 
         Keyword arguments:
-        outf -- path of the output file (default: no output)
+        outf -- path of the output file, .npy and .jsonl outputs are
+                streamed chunk by chunk, otherwise the result is written
+                as json (default: no output)
+        prob -- True to also output the probabilities (default: False)
 
         """
         t0 = time.time()
-        result = {'Result': self._get_predicted(data, trained_model)}
-        result['predicted'] = result['Result']
-        if outf is not None:
-            io.write_json(result, fname=outf)
-        t0 = dt.print_time(t0, 'predict %i data entries' % len(data))
+        with _measure(self.recorder, 'predict') as rec:
+            result = self._predict(data, trained_model, outf, prob)
+            count = result['count'] if 'count' in result \
+                else len(result['Result'])
+            rec['n_samples'] = count
+        t0 = dt.print_time(t0, 'predict %i data entries' % count)
+        return result
+
+    def _predict(self, data, trained_model, outf, prob):
+        """Predict and write outf, see predict"""
+
+        if outf is not None and outf.endswith(('.npy', '.jsonl')):
+            result = self._stream_predict(data, trained_model, outf, prob)
+            result['predicted'] = result['Result']
+        else:
+            labels = []
+            probs = []
+            for predicted, proba in self.iter_predict(data, trained_model,
+                                                      prob=prob):
+                labels.append(predicted)
+                probs.append(proba)
+            result = {'Result': np.concatenate(labels)}
+            result['predicted'] = result['Result']
+            if prob:
+                result['prob'] = np.concatenate(probs)
+            if outf is not None:
+                output = dict(result)
+                if prob:
+                    output['prob'] = output['prob'].tolist()
+                io.write_json(output, fname=outf)
+        return result
+
+    def _stream_predict(self, data, trained_model, outf, prob):
+        """Write predictions to .npy (probabilities to *_prob.npy) or
+           to .jsonl, one json object per row
+
+        @return dictionary with the output files, and the outputs read
+                as np.memmap for .npy
+
+        """
+        import json
+        result = {'outf': outf}
+        if outf.endswith('.npy'):
+            if not hasattr(data, 'shape'):
+                raise Exception(".npy output needs data with a shape")
+            fprob = outf[:-4] + '_prob.npy'
+            writers = [_NpyStream(outf, data.shape[0]),
+                       _NpyStream(fprob, data.shape[0])]
+            for predicted, proba in self.iter_predict(data, trained_model,
+                                                      prob=prob):
+                writers[0].write(predicted)
+                if prob:
+                    writers[1].write(proba)
+            writers[0].close()
+            result['Result'] = np.load(outf, mmap_mode='r')
+            result['count'] = writers[0].count
+            if prob:
+                writers[1].close()
+                result['prob'] = np.load(fprob, mmap_mode='r')
+                result['fprob'] = fprob
+            return result
+
+        count = 0
+        with open(outf, 'w') as f:
+            for predicted, proba in self.iter_predict(data, trained_model,
+                                                      prob=prob):
+                predicted = predicted.tolist()
+                proba = proba.tolist() if prob else [None] * len(predicted)
+                for label, p in zip(predicted, proba):
+                    row = {'predicted': label}
+                    if prob:
+                        row['prob'] = p
+                    f.write(json.dumps(row) + '\n')
+                count += len(predicted)
+        result['Result'] = None
+        result['count'] = count
         return result
 
     def _get_predicted(self, data, trained_model):
         """Get predicted vector"""
         return trained_model.predict(data)
 
+    @_with_metrics
     def test(self, data, target, trained_model, target_names=None):
-        """Test the existing model
+        """Test the existing model, labels and probabilities are computed
+           in one chunked pass
 
         @param data: Input testing data array (multi-dimensional np array)
         @param target: Input testing target array (1D np array)
@@ -466,9 +2805,16 @@ class MLRun(MLTools):
         """
         t0 = time.time()
         from sklearn import metrics
-        predicted = self._get_predicted(data, trained_model)
+        labels = []
+        probs = []
+        with _measure(self.recorder, 'test', n_samples=len(data)):
+            for predicted, proba in self.iter_predict(
+                    data, trained_model, prob=self.args.get_prob):
+                labels.append(predicted)
+                probs.append(proba)
+        predicted = np.concatenate(labels)
         if self.args.get_prob:
-            prob = trained_model.predict_proba(data)
+            prob = np.concatenate(probs)
         else:
             prob = None
         accuracy = metrics.accuracy_score(target, predicted)
@@ -559,12 +2905,15 @@ class MLPRun(MLRun):
         model.load_weights(fmodel)
         return model
 
-    def save_model(self, fprefix, model):
+    def save_model(self, fprefix, model, meta=None):
         """Save model to a file for future use
 
         @param fprefix: prefix of the output file
         @param model: model to be saved
 
+        Keyword arguments:
+        meta -- not used, Keras weights are not registered
+
         """
         io.dir_check(self.args.outd)
         outf = ''.join([self.args.outd, fprefix, '.pkl'])
@@ -586,6 +2935,12 @@ class NeighborsRun(MLRun):
         """Set ML model"""
 
         from sklearn import neighbors
+        if self.args.algorithm == 'ivf':
+            if parms is None:
+                parms = {}
+            parms.setdefault('nprobe', self.args.nprobe)
+            return 'NeighborsANN', ANNClassifier(nlist=self.args.nlist,
+                                                 **parms)
         if self.args.radius == 0:
             if parms is not None:
                 model = neighbors.KNeighborsClassifier(**parms)
@@ -599,6 +2954,37 @@ class NeighborsRun(MLRun):
                 model = neighbors.RadiusNeighborsClassifier()
         return 'Neighbors', model
 
+    def _init_search(self, model, cv, verbose):
+        """Use KNNSearchCV for grid search of KNeighborsClassifier if
+           args.graph_search is True"""
+
+        if self.args.search == 'grid' and self.args.graph_search and \
+                self.args.radius == 0 and self.args.algorithm != 'ivf':
+            print('[ML] KNNSearchCV for: %s' % str(self.args.grids))
+            return KNNSearchCV(model, self.args.grids, cv,
+                               n_jobs=self.args.njobs, verbose=verbose)
+        return MLRun._init_search(self, model, cv, verbose)
+
+    def train(self, data, target):
+        """Train, then tune nprobe of the ivf index to reach
+           args.target_recall"""
+
+        model, method = MLRun.train(self, data, target)
+        if isinstance(model, ANNClassifier) and self.args.target_recall:
+            rng = np.random.RandomState(self.args.random)
+            sample = rng.choice(len(data), min(len(data), 1000),
+                                replace=False)
+            model.tune(data[sample], target_recall=self.args.target_recall)
+        return model, method
+
+    def save_model(self, fprefix, model, high=False, mmap=None, meta=None):
+        """Save the ivf index as memory mapped arrays next to the model"""
+
+        if mmap is None and isinstance(model, ANNClassifier):
+            mmap = True
+        return MLRun.save_model(self, fprefix, model, high=high, mmap=mmap,
+                                meta=meta)
+
 
 class RFRun(MLRun):
     def ml_init(self, pfs):
@@ -622,6 +3008,16 @@ class RFRun(MLRun):
                 return 'RF', ensemble.RandomForestClassifier(**parms)
             return 'RF', ensemble.RandomForestClassifier()
 
+    def _init_search(self, model, cv, verbose):
+        """Use ForestSearchCV for grid search if args.warm_start is True"""
+
+        if self.args.search == 'grid' and self.args.warm_start:
+            print('[ML] ForestSearchCV for: %s' % str(self.args.grids))
+            return ForestSearchCV(model, self.args.grids, cv,
+                                  oob=self.args.oob,
+                                  n_jobs=self.args.njobs, verbose=verbose)
+        return MLRun._init_search(self, model, cv, verbose)
+
 
 class SVMRun(MLRun):
     def ml_init(self, pfs):
@@ -641,3 +3037,287 @@ class SVMRun(MLRun):
         else:
             parms['probability'] = True
         return 'SVC', svm.SVC(**parms)
+
+    def _argmax_proba(self, model):
+        """Platt scaled probabilities of SVC may disagree with predict"""
+
+        return False
+
+    def _init_search(self, model, cv, verbose):
+        """Use KernelSearchCV for grid search if args.precompute is True"""
+
+        if self.args.search == 'grid' and self.args.precompute:
+            print('[ML] KernelSearchCV for: %s' % str(self.args.grids))
+            return KernelSearchCV(model, self.args.grids, cv,
+                                  memory=self.args.kernel_memory,
+                                  n_jobs=self.args.njobs, verbose=verbose)
+        return MLRun._init_search(self, model, cv, verbose)
+
+
+class IncrementalRun(MLRun):
+    def ml_init(self, pfs):
+        """Initialize arguments needed
+
+        @param pfs: profiles to be read (used by IncrementalArgs)
+
+        """
+        self.args = IncrementalArgs(pfs=pfs)
+
+    def _init_model(self, parms=None):
+        """Set ML model which supports partial_fit"""
+
+        from sklearn import cluster
+        from sklearn import linear_model
+        from sklearn import naive_bayes
+        models = {'SGD': linear_model.SGDClassifier,
+                  'PassiveAggressive':
+                  linear_model.PassiveAggressiveClassifier,
+                  'Perceptron': linear_model.Perceptron,
+                  'NB': naive_bayes.GaussianNB,
+                  'MultinomialNB': naive_bayes.MultinomialNB,
+                  'BernoulliNB': naive_bayes.BernoulliNB,
+                  'MiniBatchKMeans': cluster.MiniBatchKMeans}
+        if self.args.method not in models:
+            print('[ML] Error: %s does not support partial_fit'
+                  % self.args.method)
+            return self.args.method, None
+        if parms is None:
+            parms = dict(self.args.parms)
+        return self.args.method, models[self.args.method](**parms)
+
+    def reader(self, source, target=None):
+        """Return the ChunkReader of the source set by the args
+
+        @param source: source of the data, see ChunkReader
+
+        Keyword arguments:
+        target -- labels of array sources (default: None)
+
+        """
+        return ChunkReader(source, target=target,
+                           fmt=self.args.source_format,
+                           chunk_size=self.args.chunk_size,
+                           target_col=self.args.target_col,
+                           delimiter=self.args.delimiter,
+                           skip_header=self.args.skip_header,
+                           nfeatures=self.args.nfeatures,
+                           dtype=self.args.dtype)
+
+    def _get_classes(self, reader):
+        """Return args.classes, or scan the labels of the source"""
+
+        if self.args.classes is not None:
+            return np.array(self.args.classes)
+        print('[ML] Scanning labels, set classes in the profile to skip')
+        classes = set()
+        for X, y in reader:
+            classes.update(np.unique(y).tolist())
+        return np.array(sorted(classes))
+
+    def _holdout_mask(self, ichunk, n):
+        """Streaming split, the same rows of a chunk are held out in
+           every epoch
+
+        @param ichunk: index of the chunk
+        @param n: number of rows of the chunk
+
+        """
+        rng = np.random.RandomState(self.args.random + ichunk)
+        return rng.rand(n) < self.args.test_size
+
+    def _checkpoint_paths(self, method):
+        prefix = os.path.join(self.args.outd, method + '_checkpoint')
+        return prefix + '.pkl', prefix + '.json'
+
+    def save_checkpoint(self, method, model, epoch, ichunk):
+        """Save the model and the position in the stream
+
+        The model is written to a temporary file first so that a crash
+        does not leave a broken checkpoint behind.
+
+        @param method: name of the model
+        @param model: model to be saved
+        @param epoch: current epoch
+        @param ichunk: index of the last chunk trained
+
+        """
+        io.dir_check(self.args.outd)
+        fmodel, fstate = self._checkpoint_paths(method)
+        with open(fmodel + '.tmp', 'wb') as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(fmodel + '.tmp', fmodel)
+        io.write_json({'epoch': epoch, 'chunk': ichunk}, fname=fstate)
+        logging.debug('[ML] Checkpoint at epoch %i chunk %i'
+                      % (epoch, ichunk))
+
+    def _resume(self, method, model):
+        """Read the checkpoint if args.resume is True
+
+        @return model, epoch, index of the last chunk trained
+
+        """
+        fmodel, fstate = self._checkpoint_paths(method)
+        if not self.args.resume or not os.path.isfile(fstate):
+            return model, 0, -1
+        state = io.parse_json(fstate)
+        print('[ML] Resume from epoch %i chunk %i'
+              % (state['epoch'], state['chunk']))
+        return self.read_model(fmodel), state['epoch'], state['chunk']
+
+    def _partial_fit(self, model, X, y, classes, rng):
+        """Fit one chunk, shuffled if args.shuffle is True"""
+
+        if self.args.shuffle:
+            idx = rng.permutation(X.shape[0])
+            X = X[idx]
+            y = y[idx]
+        if classes is None:
+            model.partial_fit(X)
+        else:
+            model.partial_fit(X, y, classes=classes)
+
+    def source_hash(self, source, target=None):
+        """Return the md5 hash of a streamed source, from the path, size
+           and modification time of its files, or of the data of arrays
+
+        @param source: source of the data, see ChunkReader
+
+        Keyword arguments:
+        target -- labels of array sources (default: None)
+
+        """
+        import hashlib
+        if hasattr(source, 'shape'):
+            return self.data_hash(source, target)
+        if isinstance(source, FeatureStore):
+            source = source.path
+        md5 = hashlib.md5()
+        paths = [source]
+        if target is not None and not hasattr(target, 'shape'):
+            paths.append(target)
+        for path in paths:
+            files = [path]
+            if os.path.isdir(path):
+                files = [os.path.join(path, f)
+                         for f in sorted(os.listdir(path))]
+            for fname in files:
+                st = os.stat(fname)
+                md5.update(('%s %i %i' % (os.path.abspath(fname),
+                                          st.st_size, int(st.st_mtime))
+                            ).encode('utf-8'))
+        if hasattr(target, 'shape'):
+            md5.update(self.data_hash(target).encode('utf-8'))
+        return md5.hexdigest()
+
+    @_with_metrics
+    def run(self, source, target=None):
+        """Stream the source chunk by chunk into partial_fit, evaluate
+           with the held out rows and save the model
+
+        args.test_size of the rows of each chunk are held out. After
+        the last epoch they are evaluated in one more pass, and also
+        fitted if args.retrain is True.
+
+        @param source: source of the data, see ChunkReader
+
+        Keyword arguments:
+        target -- labels of array sources (default: None)
+
+        @return a dictionary of accuracy, std error, predicted output
+                and confusion matrix (inertia for MiniBatchKMeans)
+
+        """
+        reader = self.reader(source, target)
+        method, model = self._init_model()
+        if model is None:
+            print("[ML] Error: cannot set the model properly")
+            sys.exit(1)
+        clustering = method == 'MiniBatchKMeans'
+        classes = None if clustering else self._get_classes(reader)
+        model, start_epoch, done = self._resume(method, model)
+
+        t0 = time.time()
+        for epoch in range(start_epoch, self.args.nb_epoch):
+            rng = np.random.RandomState(self.args.random + epoch)
+            nrows = 0
+            with _measure(self.recorder, 'fit', epoch=epoch) as rec:
+                for ichunk, (X, y) in enumerate(reader):
+                    if ichunk <= done:
+                        continue
+                    mask = self._holdout_mask(ichunk, X.shape[0])
+                    train = np.where(~mask)[0]
+                    if len(train) > 0:
+                        self._partial_fit(model, X[train], y[train],
+                                          classes, rng)
+                    nrows += len(train)
+                    if self.args.checkpoint and \
+                            (ichunk + 1) % self.args.checkpoint == 0:
+                        self.save_checkpoint(method, model, epoch, ichunk)
+                rec['n_samples'] = nrows
+                rec['model'] = model
+            done = -1
+            self.save_checkpoint(method, model, epoch + 1, -1)
+            t0 = dt.print_time(t0, 'epoch %i, %i rows trained'
+                               % (epoch, nrows))
+
+        if self.args.test_size > 0:
+            with _measure(self.recorder, 'test'):
+                result = self._evaluate(reader, model, classes, clustering)
+        else:
+            print('[ML] No additional testing is performed')
+            result = None
+        meta = None
+        if self.args.registry:
+            meta = {'data_hash': self.source_hash(source, target)}
+            if result is not None and 'accuracy' in result:
+                meta['metrics'] = {'accuracy': float(result['accuracy']),
+                                   'error': float(result['error'])}
+        self.save_model(method, model, meta=meta)
+        return result
+
+    def _fit_holdout(self, reader, model, classes):
+        """Fit the held out rows after testing"""
+
+        print("[ML] Fit the held out rows after testing")
+        rng = np.random.RandomState(self.args.random)
+        for ichunk, (X, y) in enumerate(reader):
+            test = np.where(self._holdout_mask(ichunk, X.shape[0]))[0]
+            if len(test) > 0:
+                self._partial_fit(model, X[test], y[test], classes, rng)
+
+    def _evaluate(self, reader, model, classes, clustering):
+        """Evaluate the held out rows in one pass, then fit them in
+           another pass if args.retrain is True, so no row is scored
+           by a model which has seen other held out rows"""
+
+        from sklearn import metrics
+        predicted = []
+        targets = []
+        inertia = 0.
+        for ichunk, (X, y) in enumerate(reader):
+            test = np.where(self._holdout_mask(ichunk, X.shape[0]))[0]
+            if len(test) == 0:
+                continue
+            if clustering:
+                inertia -= model.score(X[test])
+            else:
+                predicted.append(model.predict(X[test]))
+                targets.append(y[test])
+        if self.args.retrain:
+            self._fit_holdout(reader, model, classes)
+
+        if clustering:
+            print("[ML] Held out inertia: %0.5f" % inertia)
+            return {'inertia': inertia}
+        if len(predicted) == 0:
+            print('[ML] No rows are held out')
+            return None
+        predicted = np.concatenate(predicted)
+        target = np.concatenate(targets)
+        accuracy = metrics.accuracy_score(target, predicted)
+        error = dt.cal_standard_error(predicted)
+        print(metrics.classification_report(target, predicted))
+        print("[ML] Accuracy: %0.5f (+/- %0.5f)" % (accuracy, error))
+        return {'accuracy': accuracy, 'error': error,
+                'predicted': predicted, 'prob': None,
+                'cm': metrics.confusion_matrix(target, predicted)}
@@ -2,11 +2,12 @@ import sys
 import os
 from os import path
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.mlab as mlab
-from matplotlib import font_manager
 from simdat.core import tools
 
+plt = tools.LazyImport('matplotlib.pyplot')
+mlab = tools.LazyImport('matplotlib.mlab')
+font_manager = tools.LazyImport('matplotlib.font_manager')
+
 
 class COLORS:
     red = ['#7E3517', '#954535', '#8C001A', '#C11B17',
@@ -39,10 +40,22 @@ class COLORS:
 
 class PLOT(tools.DATA, COLORS):
     def tools_init(self):
-        self.ax = plt.axes()
+        self._ax = None
         self.loc_map = {'rt': 1, 'rb': 4, 'lb': 3,
                         'lt': 2, 'c': 9, 'cb': 8, 'ct': 9}
 
+    @property
+    def ax(self):
+        """Axes of the current figure, created on first use"""
+
+        if self._ax is None:
+            self._ax = plt.gca()
+        return self._ax
+
+    @ax.setter
+    def ax(self, value):
+        self._ax = value
+
     def check_array_length(self, arrays):
         """Check if lengths of all arrays are equal
 
@@ -1154,3 +1167,107 @@ class PLOT(tools.DATA, COLORS):
             newmarks.append(marks[-1])
             newticks.append(ticks[-1])
         return newmarks, newticks
+
+    def mosaic(self, imgs, nrows=None, ncols=None, border=1):
+        """Tile a stack of images into one mosaic
+
+        The images are copied into a preallocated canvas with one
+        reshape/transpose, borders and empty tiles are masked.
+
+        @param imgs: images in (N, H, W)
+
+        Keyword arguments:
+        nrows  -- number of rows of the mosaic (default: N / ncols)
+        ncols  -- number of columns of the mosaic (default: sqrt(N))
+        border -- width of the borders between images (default: 1)
+
+        @return masked array in (nrows * (H + border) - border,
+                ncols * (W + border) - border)
+
+        """
+        imgs = np.asarray(imgs, dtype=np.float32)
+        if imgs.ndim == 2:
+            imgs = imgs[np.newaxis]
+        nimgs, h, w = imgs.shape
+        if ncols is None:
+            ncols = int(np.ceil(np.sqrt(nimgs)))
+        if nrows is None:
+            nrows = int(np.ceil(float(nimgs) / ncols))
+        nimgs = min(nimgs, nrows * ncols)
+        ph = h + border
+        pw = w + border
+        canvas = np.empty((nrows * ph, ncols * pw), dtype=np.float32)
+        canvas.fill(np.nan)
+        # (nrows, ncols, ph, pw) view of the canvas
+        tiles = canvas.reshape(nrows, ph, ncols, pw).transpose(0, 2, 1, 3)
+        nfull = nimgs // ncols
+        if nfull > 0:
+            tiles[:nfull, :, :h, :w] = \
+                imgs[:nfull * ncols].reshape(nfull, ncols, h, w)
+        rest = nimgs - nfull * ncols
+        if rest > 0:
+            tiles[nfull, :rest, :h, :w] = imgs[nfull * ncols:nimgs]
+        canvas = canvas[:nrows * ph - border, :ncols * pw - border]
+        return np.ma.masked_invalid(canvas, copy=False)
+
+    def colormap_lut(self, cmap='binary'):
+        """Return the (256, 3) uint8 lookup table of a colormap
+
+        gray and binary are built in, other names are read from
+        matplotlib.cm without creating any figure.
+
+        """
+        ramp = np.arange(256, dtype=np.uint8)
+        if cmap == 'gray':
+            return np.repeat(ramp[:, np.newaxis], 3, axis=1)
+        if cmap == 'binary':
+            return np.repeat(ramp[::-1, np.newaxis], 3, axis=1)
+        import matplotlib.cm as mcm
+        rgba = mcm.get_cmap(cmap)(np.linspace(0, 1, 256))
+        return (rgba[:, :3] * 255 + 0.5).astype(np.uint8)
+
+    def write_png(self, data, fname='./mosaic.png', cmap='binary',
+                  vmin=None, vmax=None, bkg=(255, 255, 255), level=1):
+        """Write a 2D array to PNG through a colormap, without matplotlib
+
+        @param data: 2D array or masked array, e.g. the output of mosaic
+
+        Keyword arguments:
+        fname -- output filename (default: './mosaic.png')
+        cmap  -- colormap name (default: 'binary')
+        vmin  -- value mapped to the first color (default: data.min())
+        vmax  -- value mapped to the last color (default: data.max())
+        bkg   -- RGB color of masked pixels (default: white)
+        level -- zlib compression level (default: 1)
+
+        """
+        import zlib
+        import struct
+        mask = np.ma.getmaskarray(data)
+        values = np.ma.getdata(data).astype(np.float32)
+        valid = values[~mask]
+        if vmin is None:
+            vmin = valid.min() if valid.size else 0.
+        if vmax is None:
+            vmax = valid.max() if valid.size else 1.
+        span = float(vmax - vmin) or 1.
+        index = np.clip((values - vmin) * (255. / span), 0, 255)
+        index[mask] = 0
+        rgb = self.colormap_lut(cmap)[index.astype(np.uint8)]
+        rgb[mask] = bkg
+        h, w = rgb.shape[:2]
+        # every scanline starts with filter type 0
+        raw = np.zeros((h, w * 3 + 1), dtype=np.uint8)
+        raw[:, 1:] = rgb.reshape(h, w * 3)
+
+        def _chunk(tag, body):
+            return struct.pack('>I', len(body)) + tag + body + \
+                struct.pack('>I', zlib.crc32(tag + body) & 0xffffffff)
+
+        with open(fname, 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\n')
+            f.write(_chunk(b'IHDR', struct.pack('>IIBBBBB', w, h,
+                                                8, 2, 0, 0, 0)))
+            f.write(_chunk(b'IDAT', zlib.compress(raw.tobytes(), level)))
+            f.write(_chunk(b'IEND', b''))
+        print('[PLOT] Mosaic is written to %s' % fname)
@@ -0,0 +1,477 @@
+import os
+import io
+import json
+import stat
+import time
+import threading
+import numpy as np
+from collections import deque
+
+try:
+    import queue
+    import socketserver
+    from http import server as http_server
+    from http import client as http_client
+except ImportError:
+    import Queue as queue
+    import SocketServer as socketserver
+    import BaseHTTPServer as http_server
+    import httplib as http_client
+
+
+def dumps_arrays(arrays):
+    """Serialize a list of np.ndarray to npz bytes"""
+
+    buf = io.BytesIO()
+    np.savez(buf, *arrays)
+    return buf.getvalue()
+
+
+def loads_arrays(data):
+    """Deserialize npz bytes written by dumps_arrays to a list"""
+
+    npz = np.load(io.BytesIO(data))
+    return [npz['arr_%i' % i] for i in range(len(npz.files))]
+
+
+class _Request(object):
+    def __init__(self, X):
+        self.X = X
+        self.t0 = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class DynamicBatcher(object):
+    def __init__(self, predict, max_batch_size=32, max_wait=0.01,
+                 nb_latency=1000):
+        """Merge concurrent predict requests into batches
+
+        A background thread takes the first waiting request, then keeps
+        collecting requests of the same sample shape until the batch
+        has max_batch_size samples or max_wait seconds have passed.
+
+        @param predict: function mapping a batch to an array or
+                        a list of arrays (one per model output)
+
+        Keyword arguments:
+        max_batch_size -- maximum number of samples per batch (default: 32)
+        max_wait       -- maximum seconds to wait for more requests
+                          (default: 0.01)
+        nb_latency     -- number of recent latencies kept for the
+                          percentiles (default: 1000)
+
+        """
+        self.predict_fn = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.latencies = deque(maxlen=nb_latency)
+        self.lock = threading.Lock()
+        self.reset_stats()
+        self._pending = None
+        self._stop = False
+        self.thread = threading.Thread(target=self._loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def reset_stats(self):
+        """Reset the latency and throughput counters"""
+
+        with self.lock:
+            self.t_start = time.time()
+            self.nb_requests = 0
+            self.nb_samples = 0
+            self.nb_batches = 0
+            self.busy_time = 0.
+            self.latency_sum = 0.
+            self.latency_max = 0.
+            self.latencies.clear()
+
+    def stats(self):
+        """Return latency and throughput counters
+
+        @return dictionary of requests, samples, batches, mean batch
+                size, samples per second since reset, busy ratio of the
+                model and latency mean/max/p50/p95 in seconds
+
+        """
+        with self.lock:
+            elapsed = max(time.time() - self.t_start, 1e-9)
+            lat = np.array(self.latencies)
+            nreq = max(self.nb_requests, 1)
+            return {
+                'requests': self.nb_requests,
+                'samples': self.nb_samples,
+                'batches': self.nb_batches,
+                'mean_batch_size':
+                    float(self.nb_samples) / max(self.nb_batches, 1),
+                'throughput': self.nb_samples / elapsed,
+                'busy_ratio': self.busy_time / elapsed,
+                'latency_mean': self.latency_sum / nreq,
+                'latency_max': self.latency_max,
+                'latency_p50':
+                    float(np.percentile(lat, 50)) if len(lat) else 0.,
+                'latency_p95':
+                    float(np.percentile(lat, 95)) if len(lat) else 0.}
+
+    def submit(self, X):
+        """Predict X, blocking until its batch is done
+
+        @param X: input samples in (n, ...)
+
+        @return array or list of arrays, one per model output
+
+        """
+        req = _Request(np.asarray(X))
+        self.requests.put(req)
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def _next_request(self, timeout=None):
+        if self._pending is not None:
+            req, self._pending = self._pending, None
+            return req
+        try:
+            return self.requests.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _collect(self):
+        """Collect requests for one batch"""
+
+        first = self._next_request(timeout=0.5)
+        if first is None:
+            return []
+        batch = [first]
+        size = len(first.X)
+        deadline = time.time() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            req = self._next_request(timeout=remaining)
+            if req is None:
+                break
+            if req.X.shape[1:] != first.X.shape[1:] or \
+                    size + len(req.X) > self.max_batch_size:
+                self._pending = req
+                break
+            batch.append(req)
+            size += len(req.X)
+        return batch
+
+    def _loop(self):
+        while not self._stop:
+            batch = self._collect()
+            if len(batch) == 0:
+                continue
+            t0 = time.time()
+            try:
+                X = np.concatenate([r.X for r in batch])
+                outputs = self.predict_fn(X)
+                single = not isinstance(outputs, (list, tuple))
+                if single:
+                    outputs = [outputs]
+                start = 0
+                for r in batch:
+                    end = start + len(r.X)
+                    res = [o[start:end] for o in outputs]
+                    r.result = res[0] if single else res
+                    start = end
+            except Exception as e:
+                for r in batch:
+                    r.error = e
+            t1 = time.time()
+            with self.lock:
+                self.nb_batches += 1
+                self.busy_time += t1 - t0
+                for r in batch:
+                    latency = t1 - r.t0
+                    self.nb_requests += 1
+                    self.nb_samples += len(r.X)
+                    self.latency_sum += latency
+                    self.latency_max = max(self.latency_max, latency)
+                    self.latencies.append(latency)
+            for r in batch:
+                r.done.set()
+
+    def close(self):
+        """Stop the batching thread"""
+
+        self._stop = True
+        self.thread.join(1)
+
+
+class _Handler(http_server.BaseHTTPRequestHandler):
+    """POST /predict/<model> with npz body, GET /stats, GET /models"""
+
+    def _reply(self, code, body, ctype='application/octet-stream'):
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _reply_json(self, code, data):
+        self._reply(code, json.dumps(data).encode('utf8'),
+                    ctype='application/json')
+
+    def do_GET(self):
+        srv = self.server.inference
+        if self.path == '/stats':
+            self._reply_json(200, srv.stats())
+        elif self.path == '/models':
+            self._reply_json(200, sorted(srv.batchers.keys()))
+        else:
+            self._reply_json(404, {'error': 'unknown path %s' % self.path})
+
+    def do_POST(self):
+        srv = self.server.inference
+        name = self.path.split('/predict/')[-1]
+        if not self.path.startswith('/predict/') or \
+                name not in srv.batchers:
+            self._reply_json(404, {'error': 'unknown model %s' % name})
+            return
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self._reply_json(411, {'error': 'Content-Length is required'})
+            return
+        try:
+            length = int(length)
+        except ValueError:
+            self._reply_json(400, {'error': 'bad Content-Length'})
+            return
+        try:
+            X = loads_arrays(self.rfile.read(length))[0]
+            out = srv.batchers[name].submit(X)
+        except Exception as e:
+            self._reply_json(500, {'error': str(e)})
+            return
+        if not isinstance(out, list):
+            out = [out]
+        self._reply(200, dumps_arrays(out))
+
+    def address_string(self):
+        # client_address is not a tuple with Unix sockets
+        return str(self.client_address)
+
+    def log_message(self, format, *args):
+        if self.server.inference.verbose:
+            http_server.BaseHTTPRequestHandler.log_message(
+                self, format, *args)
+
+
+class _TCPServer(socketserver.ThreadingMixIn, http_server.HTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn,
+                  socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, addr = socketserver.UnixStreamServer.get_request(self)
+        return request, ('unix', 0)
+
+
+class InferenceServer(object):
+    def __init__(self, max_batch_size=32, max_wait=0.01, verbose=False):
+        """Resident server which keeps models loaded and batches
+           concurrent predict requests
+
+        Keyword arguments:
+        max_batch_size -- maximum number of samples per batch (default: 32)
+        max_wait       -- maximum seconds a request waits for others
+                          to be merged with (default: 0.01)
+        verbose        -- True to log every HTTP request (default: False)
+
+        """
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.verbose = verbose
+        self.models = {}
+        self.batchers = {}
+        self.httpd = None
+
+    def add_model(self, name, model, batch_size=None):
+        """Serve a built model
+
+        @param name: name used in the request path
+        @param model: the Keras model
+
+        Keyword arguments:
+        batch_size -- batch size used by model.predict
+                      (default: max_batch_size)
+
+        """
+        bsize = batch_size or self.max_batch_size
+
+        def _predict(X):
+            return model.predict(X, batch_size=bsize, verbose=0)
+
+        self.models[name] = model
+        self.batchers[name] = DynamicBatcher(
+            _predict, max_batch_size=self.max_batch_size,
+            max_wait=self.max_wait)
+        print('[Serving] Model %s is loaded' % name)
+
+    def load_model(self, name, arch, **kwargs):
+        """Build and serve a network of keras_models
+
+        @param name: name used in the request path
+        @param arch: function name in keras_models, e.g. VGG_16,
+                     Inception_v3, SqueezeNet or Simple
+
+        Keyword arguments are passed to the keras_models function,
+        e.g. weights_path
+
+        """
+        from simdat.core import keras_models
+        model = getattr(keras_models, arch)(**kwargs)
+        self.add_model(name, model)
+
+    def load_json_model(self, name, path_model, path_weights):
+        """Serve a model saved by model.to_json and model.save_weights
+
+        @param name: name used in the request path
+        @param path_model: path of the json file
+        @param path_weights: path of the weight file
+
+        """
+        from keras.models import model_from_json
+        from simdat.core import keras_models
+        with open(path_model) as f:
+            model = model_from_json(f.read())
+        keras_models.load_weights(model, path_weights)
+        self.add_model(name, model)
+
+    def stats(self):
+        """Return counters of all models"""
+
+        return dict([(name, b.stats()) for name, b in self.batchers.items()])
+
+    def serve(self, host='127.0.0.1', port=8500, socket_path=None):
+        """Serve forever over localhost HTTP or a Unix socket
+
+        Keyword arguments:
+        host        -- host to bind (default: 127.0.0.1)
+        port        -- port to bind (default: 8500)
+        socket_path -- path of the Unix socket, overwrites host and port
+                       (default: None)
+
+        """
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                # only a stale socket of a previous server is replaced
+                if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                    raise Exception('[Serving] %s exists and is not a '
+                                    'socket' % socket_path)
+                os.remove(socket_path)
+            self.httpd = _UnixServer(socket_path, _Handler)
+            print('[Serving] Listening on %s' % socket_path)
+        else:
+            self.httpd = _TCPServer((host, port), _Handler)
+            print('[Serving] Listening on http://%s:%i' % (host, port))
+        self.httpd.inference = self
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop serving and the batching threads"""
+
+        if self.httpd is not None:
+            self.httpd.server_close()
+            self.httpd = None
+        for b in self.batchers.values():
+            b.close()
+
+
+class _UnixHTTPConnection(http_client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        http_client.HTTPConnection.__init__(self, 'localhost',
+                                            timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        import socket
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class InferenceClient(object):
+    def __init__(self, model, host='127.0.0.1', port=8500,
+                 socket_path=None, timeout=None):
+        """Client of InferenceServer mirroring model.predict
+
+        @param model: name of the served model
+
+        Keyword arguments:
+        host        -- host of the server (default: 127.0.0.1)
+        port        -- port of the server (default: 8500)
+        socket_path -- path of the Unix socket of the server
+        timeout     -- socket timeout in seconds (default: None)
+
+        """
+        self.model = model
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _connect(self):
+        if self.socket_path is not None:
+            return _UnixHTTPConnection(self.socket_path,
+                                       timeout=self.timeout)
+        return http_client.HTTPConnection(self.host, self.port,
+                                          timeout=self.timeout)
+
+    def _request(self, method, path, body=None):
+        conn = self._connect()
+        try:
+            conn.request(method, path, body=body)
+            res = conn.getresponse()
+            data = res.read()
+        finally:
+            conn.close()
+        if res.status != 200:
+            raise Exception('[Serving] %s %s failed: %s'
+                            % (method, path, data.decode('utf8')))
+        return data
+
+    def predict(self, X, batch_size=None, verbose=0):
+        """Predict X with the served model
+
+        @param X: input samples in (n, ...)
+
+        Keyword arguments:
+        batch_size -- number of samples sent per request, the server
+                      merges requests anyway (default: all)
+
+        @return array or list of arrays, the same as model.predict
+
+        """
+        X = np.asarray(X)
+        if batch_size is None:
+            batch_size = max(len(X), 1)
+        outputs = []
+        for start in range(0, len(X), batch_size):
+            body = dumps_arrays([X[start:start + batch_size]])
+            outputs.append(loads_arrays(
+                self._request('POST', '/predict/' + self.model, body)))
+        results = [np.concatenate(o) for o in zip(*outputs)]
+        if len(results) == 1:
+            return results[0]
+        return results
+
+    def stats(self):
+        """Return latency and throughput counters of the server"""
+
+        return json.loads(self._request('GET', '/stats').decode('utf8'))
@@ -14,6 +14,37 @@ class NumpyAwareJSONEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+class LazyImport(object):
+    def __init__(self, name):
+        """Module proxy which imports the module on first attribute access
+
+        Heavy dependencies (keras, cv2, matplotlib, sklearn...) are
+        declared as module globals with LazyImport so that importing
+        simdat.core modules stays fast for tools-only use.
+
+        @param name: full name of the module, e.g. 'matplotlib.pyplot'
+
+        """
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            import importlib
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return '<LazyImport %s (%s)>' % (self._name, state)
+
+
 class TOOLS(object):
     def __init__(self):
         """Init function of TOOLS, class of small tools"""
@@ -397,7 +428,7 @@ class DATA(TOOLS):
     def is_np(self, array):
         """Check if the input array is in type of np.ndarray"""
 
-        if type(array) in [np.ndarray, np.int64, np.float64]:
+        if isinstance(array, (np.ndarray, np.int64, np.float64)):
             return True
         return False
 
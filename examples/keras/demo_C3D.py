@@ -2,10 +2,9 @@
 import os
 import cv2
 import time
-import numpy as np
 import argparse
 from simdat.core import plot
-from simdat.core import dp_models
+from simdat.core import dp_tools
 from simdat.core import tools
 from keras.models import model_from_json
 
@@ -30,11 +29,18 @@ def main():
         "--img-height", type=int, default=171, dest='height',
         help="Columns of the images, default: 171."
         )
+    parser.add_argument(
+        "--stride", type=int, default=1,
+        help="Frames between two clips, default: 1."
+        )
+    parser.add_argument(
+        "--batch-size", type=int, default=32, dest='batch_size',
+        help="Clips per predict call, default: 32."
+        )
 
     t0 = time.time()
     tl = tools.TOOLS()
     pl = plot.PLOT()
-    mdls = dp_models.DPModel()
     args = parser.parse_args()
     path_model = os.path.join(args.ofolder, 'model.json')
     path_weights = os.path.join(args.ofolder, 'weights.h5')
@@ -52,23 +58,19 @@ def main():
         labels = [line.strip() for line in f.readlines()]
     print('Total labels: {}'.format(len(labels)))
 
-    X_test, Y_test, classes, F = mdls.prepare_data_test(
-        args.path, args.width, args.height, trans=False, scale=False)
-    t0 = tl.print_time(t0, 'load data')
-
     # c x l x h x w where c is the number of
     # channels, l is length in number of frames, h and w are the
     # height and width of the frame
-    # Original shape = (16, 3, 122, 122)
-    # New shape = (3, 16, 122, 122)
+    # Frames are cropped to (112, 112) and clips are batched as
+    # (n, 3, 16, 112, 112) views of the frame buffer
+    frames = dp_tools.image_frames(args.path, size=(args.height, args.width))
+    engine = dp_tools.ClipEngine(
+        model.predict_on_batch, clip_len=16, stride=args.stride,
+        batch_size=args.batch_size, crop=(slice(8, 120), slice(30, 142)))
     results = []
     detected_lbs = {}
-    for i in range(0, X_test.shape[0]-16):
-        X = X_test[i:i+16, 8:120, 30:142, :].transpose((3, 0, 1, 2))
-        output = model.predict_on_batch(np.array([X]))
-        # iframe = int(F[i].split('.')[0].split('_')[1])
-        iframe = int(F[i].split('.')[0].split('-')[1])
-        pos_max = output[0].argmax()
+    for i, output in engine.run(frames):
+        pos_max = output.argmax()
         results.append(pos_max)
         if pos_max not in detected_lbs:
             detected_lbs[pos_max] = labels[pos_max]
@@ -7,6 +7,7 @@ import argparse
 from cv2 import imread
 from cv2 import resize
 from keras.models import model_from_json
+from simdat.core import dp_tools
 
 
 def check_ext(file_name, extensions):
@@ -139,6 +140,14 @@ def main():
         "--img-height", type=int, default=171, dest='height',
         help="Columns of the images, default: 171."
         )
+    parser.add_argument(
+        "--stride", type=int, default=1,
+        help="Frames between two clips, default: 1."
+        )
+    parser.add_argument(
+        "--batch-size", type=int, default=32, dest='batch_size',
+        help="Clips per predict call, default: 32."
+        )
 
     t0 = time.time()
     args = parser.parse_args()
@@ -156,15 +165,15 @@ def main():
         labels = [line.strip() for line in f.readlines()]
     print('Total labels: {}'.format(len(labels)))
 
-    X_test = prepare_data(
-        args.path, args.width, args.height, sort=True)
-
+    imgs = sorted(find_images(dir_path=args.path))
+    frames = (read(f, size=(args.height, args.width)) for f in imgs)
+    engine = dp_tools.ClipEngine(
+        model.predict_on_batch, clip_len=16, stride=args.stride,
+        batch_size=args.batch_size, crop=(slice(8, 120), slice(30, 142)))
     results = []
     detected_lbs = {}
-    for i in range(0, X_test.shape[0]-16):
-        X = X_test[i:i+16, 8:120, 30:142, :].transpose((3, 0, 1, 2))
-        output = model.predict_on_batch(np.array([X]))
-        pos_max = output[0].argmax()
+    for i, output in engine.run(f for f in frames if f is not None):
+        pos_max = output.argmax()
         results.append(pos_max)
         if pos_max not in detected_lbs:
             detected_lbs[pos_max] = labels[pos_max]
@@ -4,6 +4,7 @@ import argparse
 import numpy as np
 from random import shuffle
 from simdat.core import dp_models
+from simdat.core import dp_tools
 from simdat.core import image
 from simdat.core import tools
 from keras.optimizers import SGD
@@ -43,6 +44,11 @@ def add_traiining_args(train_parser):
         "--momentum", type=float, default=0.9,
         help="Momentum of SGD lr, default 0.9."
         )
+    train_parser.add_argument(
+        "--bottleneck", default=False, action='store_true',
+        help="Run the frozen conv layers once and train only the dense"
+             " layers on their cached outputs (train only)."
+        )
     group = train_parser.add_mutually_exclusive_group()
     group.add_argument(
         "--rc", default=False, action='store_true',
@@ -95,6 +101,10 @@ def add_prediction_args(predict_parser):
         "--cm", default=False, action='store_true',
         help="Draw confusion matrix."
         )
+    predict_parser.add_argument(
+        "--tta", default=False, action='store_true',
+        help="Average predictions over crop and flip variants."
+        )
 
 
 def main():
@@ -219,11 +229,31 @@ def main():
         model.compile(optimizer=sgd, loss='categorical_crossentropy')
         t0 = tl.print_time(t0, 'compile the model to be fine tuned.')
 
-        for stack in ['conv1', 'conv2', 'conv3', 'conv4', 'conv5']:
+        frozen = ['conv1', 'conv2', 'conv3', 'conv4', 'conv5']
+        for stack in frozen:
             for l in mdls.layers[stack]:
                 l.trainable = False
 
-        if args.augmentation:
+        eval_model, X_eval = model, X_test
+        if args.bottleneck:
+            if args.augmentation:
+                print('[finetune_vgg] Error: --bottleneck does not work'
+                      ' with --augmentation')
+                return
+            cache = dp_tools.BottleneckCache(
+                model, mdls.count_layers(frozen),
+                cache_dir=os.path.join(args.ofolder, 'bottleneck'))
+            F_train = cache.features(X_train, batch_size=args.batchsize)
+            F_test = cache.features(X_test, batch_size=args.batchsize)
+            t0 = tl.print_time(t0, 'compute bottleneck features')
+            head = cache.head_model()
+            head.compile(optimizer=sgd, loss='categorical_crossentropy')
+            head.fit(F_train, Y_train, batch_size=args.batchsize,
+                     nb_epoch=args.epochs, show_accuracy=True, verbose=1,
+                     validation_data=(F_test, Y_test))
+            eval_model, X_eval = head, F_test
+
+        elif args.augmentation:
             datagen = ImageDataGenerator(
                 featurewise_center=True,
                 samplewise_center=False,
@@ -249,7 +279,8 @@ def main():
                       nb_epoch=args.epochs, show_accuracy=True, verbose=1,
                       validation_data=(X_test, Y_test))
         t0 = tl.print_time(t0, 'fit')
-        score = model.evaluate(X_test, Y_test, show_accuracy=True, verbose=0)
+        score = eval_model.evaluate(X_eval, Y_test, show_accuracy=True,
+                                    verbose=0)
         print('[finetune_vgg] Test score:', score[0])
         print('[finetune_vgg] Test accuracy:', score[1])
         t0 = tl.print_time(t0, 'evaluate')
@@ -275,8 +306,12 @@ def main():
                 args.path, args.width, args.height, convert_Y=False,
                 y_as_str=False, classes=cls_map)
             t0 = tl.print_time(t0, 'prepare data')
-            results = model.predict_classes(
-                X_test, batch_size=args.batchsize, verbose=1)
+            if args.tta:
+                results = mdls.predict_tta(
+                    model, X_test, batch_size=args.batchsize).argmax(axis=1)
+            else:
+                results = model.predict_classes(
+                    X_test, batch_size=args.batchsize, verbose=1)
             cm = confusion_matrix(Y_test, results)
             pl.plot_confusion_matrix(cm, xticks=cls_map, yticks=cls_map,
                                      xrotation=90)
@@ -286,8 +321,12 @@ def main():
                 args.path, args.width, args.height)
             t0 = tl.print_time(t0, 'prepare data')
 
-            results = model.predict_proba(
-                X_test, batch_size=args.batchsize, verbose=1)
+            if args.tta:
+                results = mdls.predict_tta(
+                    model, X_test, batch_size=args.batchsize)
+            else:
+                results = model.predict_proba(
+                    X_test, batch_size=args.batchsize, verbose=1)
             outputs = []
             precision = dict((el, 0) for el in cls_map)
             recall = dict((el, 0) for el in cls_map)
@@ -10,7 +10,6 @@ import warnings
 import pylab as pl
 import matplotlib.cm as cm
 import numpy as np
-import numpy.ma as ma
 np.random.seed(1337)  # for reproducibility
 
 import theano
@@ -21,6 +20,7 @@ from keras.layers.core import Dense, Dropout, Activation, Flatten
 from keras.layers.convolutional import Convolution2D, MaxPooling2D
 from keras.utils import np_utils
 from mpl_toolkits.axes_grid1 import make_axes_locatable
+from simdat.core import plot
 
 
 os.environ['THEANO_FLAGS'] = 'mode=FAST_RUN,device=gpu,floatX=float32'
@@ -43,27 +43,8 @@ def nice_imshow(ax, data, name='output.png', vmin=None, vmax=None, cmap=None):
     pl.savefig(name)
 
 
-def make_mosaic(imgs, nrows, ncols, border=1):
-    """
-    Given a set of images with all the same shape, makes a
-    mosaic with nrows and ncols
-    """
-    nimgs = imgs.shape[0]
-    imshape = imgs.shape[1:]
-    mosaic = ma.masked_all(
-        (nrows * imshape[0] + (nrows - 1) * border,
-         ncols * imshape[1] + (ncols - 1) * border), dtype=np.float32)
-    paddedh = imshape[0] + border
-    paddedw = imshape[1] + border
-    for i in xrange(nimgs):
-        row = int(np.floor(i / ncols))
-        col = i % ncols
-        mosaic[row * paddedh:row * paddedh + imshape[0],
-               col * paddedw:col * paddedw + imshape[1]] = imgs[i]
-    return mosaic
-
-
 np.set_printoptions(precision=5, suppress=True)
+spl = plot.PLOT()
 nb_classes = 10
 
 (X_train, y_train), (X_test, y_test) = mnist.load_data()
@@ -147,7 +128,7 @@ W = np.squeeze(W)
 print("W shape : ", W.shape)
 pl.figure(figsize=(15, 15))
 pl.title('conv1 weights')
-nice_imshow(pl.gca(), make_mosaic(W, 6, 6), cmap=cm.binary,
+nice_imshow(pl.gca(), spl.mosaic(W, 6, 6), cmap=cm.binary,
             name='mnist_vis_conv1_weights.png')
 
 
@@ -163,5 +144,5 @@ print("C1 shape : ", C1.shape)
 
 pl.figure(figsize=(15, 15))
 pl.suptitle('convout1')
-nice_imshow(pl.gca(), make_mosaic(C1, 6, 6), cmap=cm.binary,
+nice_imshow(pl.gca(), spl.mosaic(C1, 6, 6), cmap=cm.binary,
             name='mnist_vis_convout1.png')
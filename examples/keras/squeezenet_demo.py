@@ -45,12 +45,24 @@ def main():
         help="Channels of the images, default: 3."
         )
 
+    parser.add_argument(
+        "--workers", type=int, default=0,
+        help="Processes decoding and augmenting images ahead of training,"
+             " 0 to use keras ImageDataGenerator. Default: 0."
+        )
+    parser.add_argument(
+        "--prefetch", type=int, default=4,
+        help="Batches prepared ahead by the workers, default 4."
+        )
+
     args = parser.parse_args()
 
     train_generator = dp.train_data_generator(
-        args.path, args.width, args.height)
+        args.path, args.width, args.height,
+        nb_worker=args.workers, prefetch=args.prefetch)
     validation_generator = dp.val_data_generator(
-        args.valpath, args.width, args.height)
+        args.valpath, args.width, args.height,
+        nb_worker=args.workers, prefetch=args.prefetch)
 
     nb_train_samples = train_generator.nb_sample
     nb_val_samples = validation_generator.nb_sample
@@ -79,6 +91,10 @@ def main():
         nb_val_samples=nb_val_samples)
 
     print "[squeezenet] Model trained."
+    if args.workers > 0:
+        train_generator.print_stats()
+        train_generator.close()
+        validation_generator.close()
 
     t0 = tl.print_time(t0, 'score squeezenet')
     model.save_weights('squeeze_net.h5', overwrite=True)
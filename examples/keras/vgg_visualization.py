@@ -10,16 +10,14 @@ and make sure the variable `args.weights` in this script matches the location.
 '''
 from __future__ import print_function
 import numpy as np
-import numpy.ma as ma
 import time
 import os
-import math
 import argparse
 import pylab as pl
 import matplotlib.cm as cm
-from keras import backend as K
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from simdat.core import dp_models
+from simdat.core import plot
 from simdat.core import tools
 
 
@@ -39,27 +37,6 @@ def nice_imshow(ax, data, name='output.png', vmin=None, vmax=None, cmap=None):
     pl.savefig(name)
 
 
-def make_mosaic(imgs, border=1):
-    """
-    Given a set of images with all the same shape, makes a
-    mosaic with nrows and ncols
-    """
-    nimgs = imgs.shape[0]
-    nrows = math.ceil(math.sqrt(nimgs))
-    imshape = imgs.shape[1:]
-    mosaic = ma.masked_all(
-        (nrows * imshape[0] + (nrows - 1) * border,
-         nrows * imshape[1] + (nrows - 1) * border), dtype=np.float32)
-    paddedh = imshape[0] + border
-    paddedw = imshape[1] + border
-    for i in xrange(nimgs):
-        row = int(np.floor(i / nrows))
-        col = i % nrows
-        mosaic[row * paddedh:row * paddedh + imshape[0],
-               col * paddedw:col * paddedw + imshape[1]] = imgs[i]
-    return mosaic
-
-
 def main():
     parser = argparse.ArgumentParser(
         description="Simple script to visualize VGG fliters."
@@ -72,12 +49,17 @@ def main():
         "-w", "--weights", type=str, default=None, required=True,
         help="Path of the VGG-16 weight file."
         )
+    parser.add_argument(
+        "--direct-png", default=False, action='store_true',
+        help="Write the mosaics to PNG directly, without matplotlib."
+        )
 
     args = parser.parse_args()
 
     # simdat dependencies
     dp = dp_models.DPModel()
     tl = tools.DATA()
+    spl = plot.PLOT()
 
     # basic parameters
     img_width = 224
@@ -87,26 +69,22 @@ def main():
     model.summary()
     X, Y, cls, F = dp.prepare_data_test(
         args.path, img_width, img_height, convert_Y=False, y_as_str=False)
-    inputs = [K.learning_phase()] + model.inputs
 
     # Visualize convolution result (after activation)
-    def conv_f(X):
-        # The [0] is to disable the training phase flag
-        return _conv_f([0] + [X])
+    # All convolutional outputs come from one forward pass
+    conv_layers = [l for l in model.layers if dp.is_convolutional(l)]
+    probe = dp.activation_probe(model, conv_layers)
+    acts = probe.run(X)
 
-    for layer in model.layers:
-        lname = dp.is_convolutional(layer)
-        if lname is None:
-            continue
-        # return the output of a certain layer given a certain input
-        # http://keras.io/getting-started/faq/
-        _conv_f = K.function(inputs, [layer.output])
-        C1 = conv_f(X)
+    for lname, C1 in acts.items():
         C1 = np.squeeze(C1)
         print("%s shape : " % lname, C1.shape)
+        if args.direct_png:
+            spl.write_png(spl.mosaic(C1), fname=lname + '.png')
+            continue
         pl.figure(figsize=(15, 15))
         pl.suptitle(lname)
-        nice_imshow(pl.gca(), make_mosaic(C1), cmap=cm.binary,
+        nice_imshow(pl.gca(), spl.mosaic(C1), cmap=cm.binary,
                     name=lname + '.png')
 
     # TODO: Visualize weights
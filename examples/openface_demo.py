@@ -84,7 +84,7 @@ class DEMO(oftools.OpenFace):
                   'Make sure self.set_classifier(method=$METHOD) ran properly')
             sys.exit(1)
 
-    def _pca(self, df, ncomp=2, pca_method='PCA'):
+    def _pca(self, df, ncomp=2, pca_method='PCA', model=None):
         """ Draw for principal component analysis
 
         @param df: DataFrame of the input data
@@ -92,7 +92,9 @@ class DEMO(oftools.OpenFace):
         Keyword arguments:
         ncomp  -- number or components to be kept (Default: 2)
         method -- method to be used
-                  PCA(default)/Randomized/Sparse
+                  PCA(default)/Randomized/Incremental/Sparse
+        model  -- fitted transformer shared by the classes
+                  (Default: fit with df)
 
         """
         mltl = ml.MLTools()
@@ -102,12 +104,12 @@ class DEMO(oftools.OpenFace):
         fname = p + '_pca.png'
         if ncomp == 1:
             pca_data = mltl.PCA(data, ncomp=1,
-                                method=pca_method)
+                                method=pca_method, model=model)
             pca_data = np.array(pca_data).T[0]
             self.pl.histogram(pca_data, fname=fname)
             return p, pca_data
         else:
-            pca_data = mltl.PCA(data, method=pca_method)
+            pca_data = mltl.PCA(data, method=pca_method, model=model)
             pca_data = np.array(pca_data).T
             self.pl.plot_points(pca_data[0], pca_data[1], fname=fname,
                                 xmin=-1, xmax=1, ymin=-1, ymax=1)
@@ -152,12 +154,19 @@ class DEMO(oftools.OpenFace):
         df = self._pick_imgs()
         all_data = []
         labels = []
-        for p in mapping.keys():
-            df['class'] = df['class'].astype(type(p))
+        # fit once with all classes so that they share the same axes
+        classes = list(mapping.keys())
+        if len(classes) > 0:
+            df['class'] = df['class'].astype(type(classes[0]))
+        reps = df[df['class'].isin(classes)]['rep'].tolist()
+        mltl = ml.MLTools()
+        model = mltl.fit_pca(np.array(reps), ncomp=ncomp, method='PCA')
+        for p in classes:
             _df = df[df['class'] == p]
             if _df.empty:
                 continue
-            p, data = self._pca(_df, ncomp=ncomp, pca_method='PCA')
+            p, data = self._pca(_df, ncomp=ncomp, pca_method='PCA',
+                                model=model)
             all_data.append(data)
             labels.append(p)
         if ncomp == 1:
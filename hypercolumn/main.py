@@ -1,4 +1,3 @@
-import os
 import cv2
 import time
 import numpy as np
@@ -27,24 +26,30 @@ t0 = pl.print_time(t0, 'compile')
 
 imgs = im.find_images()
 t0 = pl.print_time(t0, 'find images')
-X = []
-Y = []
+store = ml.FeatureStore('hc_features', ncomp=1024, method='random')
 
-for fimg in imgs:
-    t0 = pl.print_time(t0, 'compute for one image')
-    print('Processing %s' % fimg)
-    _cls = int(mlr.get_class_from_path(fimg))
-    Y.append(_cls)
-    name, ext = os.path.splitext(fimg)
-    img_original = im.read(fimg, size=(224, 224))
-    img = img_original.transpose((2, 0, 1))
-    img = np.expand_dims(img, axis=0)
+layers_extract = [3, 8, 15, 22, 29]
+# hypercolumns of the layers are about 300MB per image in float32,
+# so only a couple of images are extracted at once, through a memmap
+batch_size = 2
+extractor = mdls.hypercolumn_extractor(model, layers_extract)
 
-    layers_extract = [3, 8, 15, 22, 29]
-    hc = mdls.extract_hypercolumn(model, layers_extract, img)
+for start in range(0, len(imgs), batch_size):
+    batch = []
+    Y = []
+    for fimg in imgs[start:start + batch_size]:
+        print('Processing %s' % fimg)
+        Y.append(int(mlr.get_class_from_path(fimg)))
+        img_original = im.read(fimg, size=(224, 224))
+        batch.append(img_original.transpose((2, 0, 1)))
+    hcs = extractor.extract(np.array(batch), batch_size=batch_size,
+                            fname='hc_batch.dat')
+    t0 = pl.print_time(t0, 'compute for %i images' % len(batch))
     # new_shape = 224*224
-    # ave = np.average(hc.transpose(1, 2, 0), axis=2).reshape(new_shape)
-    # X.append(ave)
-    X.append(hc.ravel())
+    # ave = np.average(hcs.transpose(0, 2, 3, 1), axis=3)
+    # store.append(ave.reshape(len(hcs), new_shape), Y)
+    store.append(hcs.reshape(len(hcs), -1), Y)
 
-mf = mlr.run(X, Y)
+store.close()
+t0 = pl.print_time(t0, 'store features')
+mf = mlr.run(store)
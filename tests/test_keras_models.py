@@ -0,0 +1,60 @@
+import unittest
+import numpy as np
+
+try:
+    from simdat.core import keras_models
+except ImportError:
+    keras_models = None
+
+
+@unittest.skipIf(keras_models is None, 'keras is not installed')
+class QuantizeWeightTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        # per channel magnitudes differ, as in trained kernels
+        self.conv = (rng.randn(16, 8, 3, 3) *
+                     rng.rand(16, 1, 1, 1)).astype(np.float32)
+        self.dense = (rng.randn(256, 32) *
+                      rng.rand(1, 32)).astype(np.float32)
+
+    def _round_trip(self, arr, quantize):
+        q, scale, axis = keras_models.quantize_weight(arr, quantize)
+        out = keras_models.dequantize_weight(q, scale, axis, arr.dtype)
+        self.assertEqual(out.shape, arr.shape)
+        self.assertEqual(out.dtype, arr.dtype)
+        return q, scale, axis, out
+
+    def test_int8(self):
+        for arr, axis in [(self.conv, 0), (self.dense, 1)]:
+            q, scale, qaxis, out = self._round_trip(arr, 'int8')
+            self.assertEqual(q.dtype, np.int8)
+            self.assertEqual(qaxis, axis)
+            self.assertEqual(len(scale), arr.shape[axis])
+            # rounding error is at most half a step of the channel
+            shape = [1] * arr.ndim
+            shape[axis] = -1
+            err = np.abs(out - arr) / scale.reshape(shape)
+            self.assertTrue(err.max() <= 0.5 + 1e-4)
+
+    def test_float16(self):
+        q, scale, axis, out = self._round_trip(self.dense, 'float16')
+        self.assertEqual(q.dtype, np.float16)
+        self.assertTrue(np.allclose(out, self.dense, rtol=1e-3, atol=1e-4))
+
+    def test_kept(self):
+        bias = np.ones(32, dtype=np.float32)
+        small = np.ones((4, 4), dtype=np.float32)
+        for arr in [bias, small]:
+            q, scale, axis = keras_models.quantize_weight(arr, 'int8')
+            self.assertTrue(q is arr)
+            self.assertTrue(scale is None)
+
+    def test_zero_channel(self):
+        arr = self.dense.copy()
+        arr[:, 3] = 0
+        q, scale, axis, out = self._round_trip(arr, 'int8')
+        self.assertTrue(np.all(out[:, 3] == 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from simdat.core import ml
+
+
+class MLRunPredictTest(unittest.TestCase):
+    def setUp(self):
+        from sklearn.neighbors import KNeighborsClassifier
+        rng = np.random.RandomState(0)
+        self.data = rng.rand(50, 4)
+        self.target = (self.data[:, 0] > 0.5).astype(int)
+        self.model = KNeighborsClassifier(3).fit(self.data, self.target)
+        self.mlr = ml.MLRun()
+        self.mlr.args.predict_chunk = 16
+        self.outd = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.outd)
+
+    def test_predict_jsonl(self):
+        outf = os.path.join(self.outd, 'predicted.jsonl')
+        result = self.mlr.predict(self.data, self.model, outf=outf,
+                                  prob=True)
+        self.assertEqual(result['count'], len(self.data))
+        with open(outf) as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual([r['predicted'] for r in rows],
+                         self.model.predict(self.data).tolist())
+        self.assertTrue(np.allclose([r['prob'] for r in rows],
+                                    self.model.predict_proba(self.data)))
+
+    def test_predict_npy(self):
+        outf = os.path.join(self.outd, 'predicted.npy')
+        result = self.mlr.predict(self.data, self.model, outf=outf)
+        self.assertEqual(result['count'], len(self.data))
+        self.assertEqual(np.load(outf).tolist(),
+                         self.model.predict(self.data).tolist())
+
+
+def _fold_scores(search, nfolds):
+    """Scores of every candidate and fold of a sklearn GridSearchCV"""
+
+    if hasattr(search, 'cv_results_'):
+        res = search.cv_results_
+        return [[res['split%i_test_score' % i][j] for i in range(nfolds)]
+                for j in range(len(res['params']))]
+    return [list(s.cv_validation_scores) for s in search.grid_scores_]
+
+
+class SearchCVTest(unittest.TestCase):
+    """Grid searches which share work across candidates must score every
+       candidate and fold as GridSearchCV does"""
+
+    def setUp(self):
+        from sklearn import cross_validation
+        from sklearn.datasets import make_classification
+        self.data, self.target = make_classification(
+            101, 6, n_informative=4, n_classes=3, random_state=0)
+        # columns on different scales so 'scale' differs per fold
+        self.data *= np.arange(1, 7)
+        self.cv = list(cross_validation.KFold(len(self.data), n_folds=3))
+
+    def _compare(self, search, estimator, grids, data=None):
+        from sklearn.grid_search import GridSearchCV
+        data = self.data if data is None else data
+        ref = GridSearchCV(estimator, grids, cv=self.cv)
+        ref.fit(data, self.target)
+        search.fit(data, self.target)
+        expected = _fold_scores(ref, len(self.cv))
+        self.assertEqual(len(search.results_), len(expected))
+        weights = [len(test) for train, test in self.cv]
+        for result, scores in zip(search.results_, expected):
+            self.assertTrue(np.allclose(result['scores'], scores),
+                            '%s: %s != %s' % (result['params'],
+                                              result['scores'], scores))
+            self.assertAlmostEqual(result['score'],
+                                   np.average(scores, weights=weights))
+        self.assertEqual(search.best_params_, ref.best_params_)
+
+    def test_kernel_search(self):
+        from sklearn.svm import SVC
+        grids = [{'kernel': ['rbf'], 'gamma': ['scale', 'auto', 0.05],
+                  'C': [1, 10]},
+                 {'kernel': ['poly'], 'degree': [2], 'C': [0.1, 1]},
+                 {'kernel': ['sigmoid'], 'gamma': [0.01], 'C': [1]}]
+        self._compare(ml.KernelSearchCV(SVC(), grids, self.cv), SVC(),
+                      grids)
+
+    def test_knn_search(self):
+        from sklearn.neighbors import KNeighborsClassifier
+        grids = [{'n_neighbors': [1, 4, 7], 'p': [1, 2],
+                  'weights': ['uniform', 'distance'],
+                  'algorithm': ['brute', 'kd_tree']}]
+        self._compare(ml.KNNSearchCV(KNeighborsClassifier(), grids,
+                                     self.cv),
+                      KNeighborsClassifier(), grids)
+        # rounded features give ties of the distances at the k-th
+        # neighbor, which are broken as KNeighborsClassifier does
+        self._compare(ml.KNNSearchCV(KNeighborsClassifier(), grids,
+                                     self.cv),
+                      KNeighborsClassifier(), grids,
+                      data=np.round(self.data / 2.))
+
+    def test_forest_search(self):
+        from sklearn.ensemble import ExtraTreesClassifier
+        from sklearn.ensemble import RandomForestClassifier
+        grids = [{'n_estimators': [2, 5, 9], 'max_features': ['sqrt', None],
+                  'random_state': [0]}]
+        for estimator in [ExtraTreesClassifier(), RandomForestClassifier()]:
+            self._compare(ml.ForestSearchCV(estimator, grids, self.cv),
+                          estimator, grids)
+
+
+class ModelPersistenceTest(unittest.TestCase):
+    def setUp(self):
+        from sklearn.datasets import make_classification
+        self.data, self.target = make_classification(
+            300, 8, n_informative=4, n_classes=3, random_state=0)
+        self.mlr = ml.MLRun()
+        self.mlr.args.outd = tempfile.mkdtemp() + '/'
+        self.mlr.args.mmap_min_size = 1024
+
+    def tearDown(self):
+        shutil.rmtree(self.mlr.args.outd)
+
+    def _round_trip(self, name, model):
+        outf = self.mlr.save_model(name, model, mmap=True)
+        self.assertTrue(os.path.isdir(outf))
+        read = self.mlr.read_model(outf, mmap=True)
+        self.assertEqual(read.predict(self.data).tolist(),
+                         model.predict(self.data).tolist())
+        return read
+
+    def test_mmap_svc(self):
+        from sklearn.svm import SVC
+        model = SVC().fit(self.data, self.target)
+        read = self._round_trip('SVC', model)
+        self.assertTrue(isinstance(read.support_vectors_, np.memmap))
+        self.assertTrue(np.array_equal(read.dual_coef_, model.dual_coef_))
+
+    def test_mmap_forest(self):
+        from sklearn.ensemble import ExtraTreesClassifier
+        model = ExtraTreesClassifier(10, random_state=0)
+        self._round_trip('ExtraTrees', model.fit(self.data, self.target))
+
+    def test_read_pickle(self):
+        from sklearn.svm import SVC
+        model = SVC().fit(self.data, self.target)
+        outf = self.mlr.save_model('SVC', model, mmap=False)
+        read = self.mlr.read_model(outf)
+        self.assertEqual(read.predict(self.data).tolist(),
+                         model.predict(self.data).tolist())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+'''
+Usage:
+    python convert_weights.py -p $PATH_OF_YOUR_HDF5_FILE
+    python convert_weights.py -p $PATH_OF_YOUR_HDF5_FILE -q int8
+    python convert_weights.py -p vgg16_weights.h5 --report VGG_16 -i $IMAGES
+
+Convert Keras HDF5 weights to the flat format which
+simdat.core.keras_models.load_weights maps to memory, optionally
+quantized to float16 or int8. With --report, compare the size, load
+time and predictions of the quantized files on sample images.
+'''
+from __future__ import print_function
+import argparse
+from simdat.core import keras_models
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert Keras HDF5 weights to a memory-mappable file."
+        )
+    parser.add_argument(
+        "-p", "--path", type=str, default=None, required=True,
+        help="Path of the hdf5 file."
+        )
+    parser.add_argument(
+        "-o", "--output", type=str, default=None,
+        help="Path of the output file (default: $PATH[.$QUANTIZE].flat)."
+        )
+    parser.add_argument(
+        "-q", "--quantize", type=str, default=None,
+        choices=['float16', 'int8'],
+        help="Store kernels as float16 or as int8 with per-channel scales."
+        )
+    parser.add_argument(
+        "--report", type=str, default=None,
+        help="keras_models function of the network, e.g. VGG_16, to "
+             "compare float32, float16 and int8 files on --images."
+        )
+    parser.add_argument(
+        "-i", "--images", type=str, default=None,
+        help="Path of the sample images used by --report."
+        )
+    parser.add_argument(
+        "--img-width", type=int, default=224, dest='width',
+        help="Rows of the images, default: 224."
+        )
+    parser.add_argument(
+        "--img-height", type=int, default=224, dest='height',
+        help="Columns of the images, default: 224."
+        )
+    args = parser.parse_args()
+
+    if args.report is None:
+        keras_models.convert_weights(args.path, flat_path=args.output,
+                                     quantize=args.quantize)
+        return
+    if args.images is None:
+        parser.error('--report requires --images.')
+    from simdat.core import dp_models
+    mdls = dp_models.DPModel()
+    X, Y, classes, F = mdls.prepare_data_test(
+        args.images, args.width, args.height)
+    keras_models.quantization_report(
+        getattr(keras_models, args.report), args.path, X)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+'''
+Usage:
+    python import_benchmark.py
+    python import_benchmark.py -m simdat.core.tools --budget 100 -r 5
+
+Measure the import time of simdat.core modules in fresh interpreters
+and check that heavy dependencies are not loaded at import. Budgets
+apply to the time spent after numpy is imported, since numpy alone
+takes most of the startup of tools-only use. Exit with
+status 1 if a module is over budget or imports a heavy dependency, so
+it can guard against import-time regressions.
+'''
+from __future__ import print_function
+import sys
+import json
+import argparse
+import subprocess
+
+HEAVY = ['keras', 'theano', 'tensorflow', 'h5py', 'scipy', 'sklearn',
+         'cv2', 'PIL', 'matplotlib', 'pandas']
+
+DEFAULT = ['simdat.core.tools:30', 'simdat.core.args:30',
+           'simdat.core.ml:40', 'simdat.core.plot:60',
+           'simdat.core.image:80', 'simdat.core.dp_tools:100']
+
+PROBE = '''
+import sys, time, json
+t0 = time.time()
+import numpy
+t1 = time.time()
+import %s
+t2 = time.time()
+heavy = [m for m in %r if m in sys.modules]
+print(json.dumps({'numpy': (t1 - t0) * 1000, 'module': (t2 - t0) * 1000,
+                  'heavy': heavy}))
+'''
+
+
+def measure(module, repeat=5):
+    """Import module in fresh interpreters
+
+    @param module: full name of the module
+
+    Keyword arguments:
+    repeat -- number of interpreters to start (default: 5)
+
+    @return (best import time in ms including numpy, best numpy
+             import time in ms, heavy modules loaded)
+
+    """
+    best = None
+    best_np = None
+    heavy = []
+    for i in range(repeat):
+        out = subprocess.check_output(
+            [sys.executable, '-c', PROBE % (module, HEAVY)])
+        res = json.loads(out.decode('utf8').strip().split('\n')[-1])
+        best = res['module'] if best is None else min(best, res['module'])
+        best_np = res['numpy'] if best_np is None \
+            else min(best_np, res['numpy'])
+        heavy = res['heavy']
+    return best, best_np, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import-time benchmark of simdat.core modules."
+        )
+    parser.add_argument(
+        "-m", "--module", type=str, action='append', default=None,
+        help="MODULE[:BUDGET_MS] to measure (repeatable), "
+             "default: the core modules."
+        )
+    parser.add_argument(
+        "--budget", type=float, default=50,
+        help="Budget in ms for modules given without one (default: 50)."
+        )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=5,
+        help="Fresh interpreters per module, the best time is kept."
+        )
+    args = parser.parse_args()
+
+    failed = False
+    for spec in args.module or DEFAULT:
+        items = spec.split(':')
+        module = items[0]
+        budget = float(items[1]) if len(items) > 1 else args.budget
+        try:
+            t, t_np, heavy = measure(module, repeat=args.repeat)
+        except subprocess.CalledProcessError:
+            print('[Benchmark] %s: import failed' % module)
+            failed = True
+            continue
+        status = 'OK'
+        if t - t_np > budget or len(heavy) > 0:
+            status = 'FAIL'
+            failed = True
+        print('[Benchmark] %-24s %6.1f ms + numpy %5.1f ms (budget %4.0f ms)'
+              ' %s' % (module, t - t_np, t_np, budget, status))
+        if len(heavy) > 0:
+            print('[Benchmark]   heavy modules imported: %s'
+                  % ', '.join(heavy))
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
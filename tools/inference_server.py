@@ -0,0 +1,74 @@
+'''
+Usage:
+    python inference_server.py -m vgg:VGG_16:vgg16_weights.h5 --port 8500
+    python inference_server.py -j sq:model.json:weights.h5 -s /tmp/sq.sock
+
+Keep keras_models networks loaded and merge concurrent predict requests
+into dynamic batches. Query it with simdat.core.serving.InferenceClient.
+'''
+from __future__ import print_function
+import argparse
+from simdat.core import serving
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Resident inference server with dynamic batching."
+        )
+    parser.add_argument(
+        "-m", "--model", type=str, action='append', default=[],
+        help="NAME:ARCH[:WEIGHTS[:KEY=VALUE...]] of a keras_models "
+             "network, e.g. vgg:VGG_16:vgg16_weights.h5 or "
+             "sq:SqueezeNet::nb_classes=10 (repeatable)."
+        )
+    parser.add_argument(
+        "-j", "--json", type=str, action='append', default=[],
+        help="NAME:MODEL_JSON:WEIGHTS of a saved model (repeatable)."
+        )
+    parser.add_argument(
+        "--host", type=str, default='127.0.0.1',
+        help="Host to bind (default: 127.0.0.1)."
+        )
+    parser.add_argument(
+        "--port", type=int, default=8500,
+        help="Port to bind (default: 8500)."
+        )
+    parser.add_argument(
+        "-s", "--socket", type=str, default=None,
+        help="Path of a Unix socket to listen on instead of host/port."
+        )
+    parser.add_argument(
+        "--max-batch", type=int, default=32,
+        help="Maximum number of samples per batch (default: 32)."
+        )
+    parser.add_argument(
+        "--max-wait", type=float, default=0.01,
+        help="Maximum seconds to wait for more requests (default: 0.01)."
+        )
+    parser.add_argument(
+        "-v", "--verbose", action='store_true',
+        help="Log every request."
+        )
+    args = parser.parse_args()
+
+    server = serving.InferenceServer(max_batch_size=args.max_batch,
+                                     max_wait=args.max_wait,
+                                     verbose=args.verbose)
+    for spec in args.model:
+        items = spec.split(':')
+        kwargs = {}
+        if len(items) > 2 and items[2]:
+            kwargs['weights_path'] = items[2]
+        for item in items[3:]:
+            key, value = item.split('=')
+            kwargs[key] = int(value) if value.isdigit() else value
+        server.load_model(items[0], items[1], **kwargs)
+    for spec in args.json:
+        name, path_model, path_weights = spec.split(':')
+        server.load_json_model(name, path_model, path_weights)
+    if len(server.batchers) == 0:
+        parser.error('No model is given, use -m or -j.')
+    server.serve(host=args.host, port=args.port, socket_path=args.socket)
+
+if __name__ == '__main__':
+    main()